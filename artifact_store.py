@@ -0,0 +1,96 @@
+'''
+content addressed artifact store for incremental runs.
+an artifact is keyed by the sha256 of the stage input (a binary, an idb, a pseudo code file)
+and a fingerprint of everything else the output depends on (stage version, models, settings),
+so a binary replaced in place or a new sentencepiece model is recomputed, and nothing else is.
+the store is a plain directory, point several machines at one shared directory to reuse their work:
+    {root}/{stage}/{key[:2]}/{key}-{fingerprint}
+shared by the binja and ida scripts, they put the repository root on sys.path to import it
+'''
+from __future__ import print_function, division
+import os
+import json
+import pickle
+import shutil
+import hashlib
+
+
+def file_sha256(path, chunk_size=1 << 20) -> str:
+    m = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+def fingerprint(*parts) -> str:
+    '''
+    short stable hash of json-able config parts, e.g. fingerprint(STAGE_VERSION, file_sha256(MODEL_PATH), FLAG)
+    '''
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+class ArtifactStore:
+    def __init__(self, root):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, stage, key, fp):
+        return os.path.join(self.root, stage, key[:2], "{}-{}".format(key, fp))
+
+    def get(self, stage, key, fp):
+        '''
+        path of the artifact or None
+        '''
+        path = self.path(stage, key, fp)
+        if os.path.exists(path):
+            self.hits += 1
+            return path
+        self.misses += 1
+        return None
+
+    def _copy(self, src, dst):
+        # copy next to dst then rename, readers never see a partial file
+        tmp = "{}.{}.tmp".format(dst, os.getpid())
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+    def fetch(self, stage, key, fp, dst) -> bool:
+        '''
+        copy the artifact to dst, False if it is not in the store
+        '''
+        path = self.get(stage, key, fp)
+        if path is None:
+            return False
+        self._copy(path, dst)
+        return True
+
+    def put(self, stage, key, fp, src):
+        path = self.path(stage, key, fp)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._copy(src, path)
+        return path
+
+    def load(self, stage, key, fp):
+        '''
+        unpickled artifact or None
+        '''
+        path = self.get(stage, key, fp)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def dump(self, stage, key, fp, obj):
+        path = self.path(stage, key, fp)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return path
+
+    def cache_info(self):
+        return "hits={}, misses={}".format(self.hits, self.misses)
@@ -1,27 +1,52 @@
 import os
+import sys
 import logging
 import pickle
 from glob import glob
 from binaryninja import *
 import sentencepiece
-from nltk.corpus import words
 from binaryninja.function import DisassemblySettings, DisassemblyOption
 from multiprocessing import Pool, cpu_count, set_start_method
+from functools import lru_cache
 
-from normalizer import normalize_instruction, normalize_LLIL, normalize_MLIL
-from utils.utils import split_func_name, split_sentence_piece, merge_suffix
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+from normalizer import Normalizer, NUM_THRESHOLD, SECTION_CLASSES
+from utils.utils import NameSplitter, load_lexicon
 from utils.lexer import tokenize_raw_code_binja
+from utils.packed import save_methods
+from utils.scheduler import run_jobs, SKIPPED
+from utils.partition import partition_spans, merge
+from utils.render_cache import RenderCache
+from artifact_store import ArtifactStore, file_sha256, fingerprint
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s| %(levelname)s| %(message)s')
 
 
 BIN_DIR = "D:/PythonProject/NER/binja/amd64/*"
 MODEL_PATH = "D:/PythonProject/NER/binja/model/sentencepiece.model"
 MEANINGLESS_FUNC_PATH = "D:/PythonProject/NER/binja/model/meaningless_funcs.txt"
+NAME_CACHE_PATH = "D:/PythonProject/NER/binja/model/name_split_cache.pkl"
+LEXICON_PATH = "D:/PythonProject/NER/binja/model/lexicon.pkl"
 FILTER_MEANINGLESS = True # slightly slow the speed
+LEDGER_PATH = "D:/PythonProject/NER/binja/amd64/ext_code_ledger.json" # job states, rerun to resume a killed run
+JOB_TIMEOUT = 3 * 60 * 60 # seconds per binary, None for no limit
+JOB_RETRIES = 1
+# split binaries with at least INTRA_BINARY_MIN_FUNCS functions across INTRA_BINARY_PROCESSES processes,
+# 1 to always extract a binary in its own job process only
+INTRA_BINARY_PROCESSES = 1
+INTRA_BINARY_MIN_FUNCS = 20000
+INTRA_BINARY_CHUNKS_PER_PROCESS = 4
+# rendered pseudo c by (binary sha256, function start, binary ninja version/RENDER_VERSION), None to disable
+RENDER_CACHE_PATH = "D:/PythonProject/NER/binja/amd64/pseudo_c_cache.sqlite"
+RENDER_VERSION = 1 # bump when PseudoCRenderer output changes
+PACKED_COMPRESSION = "zlib" # "none", "zlib" or "zstd" (needs zstandard), see utils/packed.py
+# {file}.packed by (binary sha256, fingerprint of everything else it depends on), None to only skip existing files
+ARTIFACT_STORE_DIR = "D:/PythonProject/NER/binja/artifacts"
+EXT_CODE_VERSION = 1 # bump when the extraction output changes
+NO_TEXT = "no .text section" # ledger note of a binary with nothing to extract, done for good
 
 sp = sentencepiece.SentencePieceProcessor()
 sp.load(MODEL_PATH)
-vocab = words.words()
+vocab = load_lexicon(LEXICON_PATH)
 with open(MEANINGLESS_FUNC_PATH,"r",encoding="utf-8") as f:
     meaningless = [line.strip() for line in f.readlines() if line.strip()]
 
@@ -35,26 +60,65 @@ def is_meaningful_name(name:str):
     return True
 
 
-def my_split_func_name(name):
-    return merge_suffix(split_sentence_piece(sp, split_func_name(name)), vocab)
+my_split_func_name = NameSplitter(sp, vocab, cache_path=NAME_CACHE_PATH)
+
+
+@lru_cache(maxsize=None)
+def settings_fingerprint() -> str:
+    '''
+    versions, settings and models every {file}.packed depends on, hashed once per process
+    '''
+    return fingerprint(EXT_CODE_VERSION, RENDER_VERSION, binaryninja.core_version(), FILTER_MEANINGLESS,
+                       NUM_THRESHOLD, SECTION_CLASSES, file_sha256(MODEL_PATH), file_sha256(LEXICON_PATH),
+                       file_sha256(MEANINGLESS_FUNC_PATH))
+
+
+def ext_code_fingerprint(file) -> str:
+    '''
+    everything besides the binary that {file}.packed depends on, a missing .name_and_addr is part of it too
+    '''
+    name_and_addr = f"{file}.name_and_addr"
+    return fingerprint(settings_fingerprint(), file_sha256(name_and_addr) if os.path.exists(name_and_addr) else None)
+
+
+class PseudoCRenderer:
+    '''
+    pseudo c of the functions of one binary view, the settings, the language representation
+    and the cursor are created once per view instead of once per function
+    '''
+    def __init__(self, bv, cache=None, binary_hash=None):
+        self.bv = bv
+        settings = DisassemblySettings()
+        settings.set_option(DisassemblyOption.ShowAddress, False)
+        settings.set_option(DisassemblyOption.WaitForIL, True)
+        self.obj = lineardisassembly.LinearViewObject.language_representation(bv, settings)
+        self.cursor = lineardisassembly.LinearViewCursor(self.obj)
+        self.cache = cache
+        self.binary_hash = binary_hash
+
+    def render(self, func) -> str:
+        if self.cache is not None:
+            text = self.cache.get(self.binary_hash, func.lowest_address)
+            if text is not None:
+                return text
+        self.cursor.seek_to_address(func.highest_address)
+        body = self.bv.get_next_linear_disassembly_lines(self.cursor)
+        self.cursor.seek_to_address(func.highest_address)
+        header = self.bv.get_previous_linear_disassembly_lines(self.cursor)
+        text = "".join([str(line) + '\n' for line in header] + [str(line) + '\n' for line in body])
+        if self.cache is not None:
+            self.cache.put(self.binary_hash, func.lowest_address, text)
+        return text
 
 
 def get_pseudo_c(func, bv):
-    lines = ''
-    settings = DisassemblySettings()
-    settings.set_option(DisassemblyOption.ShowAddress, False)
-    settings.set_option(DisassemblyOption.WaitForIL, True)
-    obj = lineardisassembly.LinearViewObject.language_representation(bv, settings)
-    cursor_end = lineardisassembly.LinearViewCursor(obj)
-    cursor_end.seek_to_address(func.highest_address)
-    body = bv.get_next_linear_disassembly_lines(cursor_end)
-    cursor_end.seek_to_address(func.highest_address)
-    header = bv.get_previous_linear_disassembly_lines(cursor_end)
-    for line in header:
-        lines += str(line) + '\n'
-    for line in body:
-        lines += str(line) + '\n'
-    return lines
+    return PseudoCRenderer(bv).render(func)
+
+
+def open_render_cache():
+    if RENDER_CACHE_PATH is None:
+        return None
+    return RenderCache(RENDER_CACHE_PATH, f"{binaryninja.core_version()}/{RENDER_VERSION}")
 
 
 def get_startaddr_name_maps(file, filter_meaningless=False):
@@ -72,10 +136,91 @@ def get_startaddr_name_maps(file, filter_meaningless=False):
     return addr_name_maps
 
 
+def select_functions(bv, startaddr_name_maps) -> list:
+    '''
+    named, analyzed functions inside .text, in bv.functions order
+    '''
+    tstart = bv.sections['.text'].start
+    tend = bv.sections['.text'].end
+    funcs = []
+    for func in bv.functions:
+        if not (func.lowest_address >= tstart and func.highest_address <= tend):
+            continue
+        if func.lowest_address not in startaddr_name_maps:
+            continue
+        if func is not None and func.analysis_skipped:
+            continue
+            # force analysis large function
+            # func.analysis_skip_override = FunctionAnalysisSkipOverride.NeverSkipFunctionAnalysis
+            # bv.update_analysis_and_wait()
+        funcs.append(func)
+    return funcs
+
+
+def extract_method(func, normalizer, renderer, name) -> dict:
+    addr = f"{func.lowest_address}_{func.highest_address}"
+    return {
+        "start_addr": func.lowest_address,
+        "addr": addr,
+        "name": name,
+        "instructions": list(normalizer.instructions(func)),
+        "llils": list(normalizer.llil(func)),
+        "mlils": list(normalizer.mlil(func)),
+        "pseudo_code": tokenize_raw_code_binja(renderer.render(func), my_split_func_name)
+    }
+
+
+def extract_chunk(args) -> dict:
+    '''
+    pool worker of extract_parallel, extract the functions starting at starts from the saved {file}.bndb
+    '''
+    file, starts, names, symbol_maps, binary_hash = args
+    binaryninja.set_worker_thread_count(1)
+    bv = BinaryViewType.get_view_of_file(file + ".bndb")
+    normalizer = Normalizer(bv, symbol_maps)
+    cache = open_render_cache()
+    renderer = PseudoCRenderer(bv, cache, binary_hash)
+    methods = {}
+    for start in starts:
+        func = bv.get_function_at(start)
+        if func is None:
+            logging.error(f"[!] {file}.bndb has no function at {start}")
+            continue
+        method = extract_method(func, normalizer, renderer, names[start])
+        methods[method["addr"]] = method
+    if cache is not None:
+        cache.close()
+    bv.file.close()
+    return methods
+
+
+def extract_parallel(file, spans, startaddr_name_maps, symbol_maps, processes, binary_hash=None) -> dict:
+    '''
+    functions of one large binary split into balanced chunks (by function size),
+    merged back in bv.functions order so the output equals a serial run.
+    spans: (lowest_address, highest_address) of the functions, taken before the view was closed
+    '''
+    # a few chunks per process so one slow chunk does not hold the others
+    order, chunks = partition_spans(spans, processes * INTRA_BINARY_CHUNKS_PER_PROCESS)
+    jobs = [(file, starts, dict((start, startaddr_name_maps[start]) for start in starts), symbol_maps, binary_hash)
+            for starts in chunks]
+    with Pool(processes=processes) as pool:
+        return merge(order, pool.imap_unordered(extract_chunk, jobs))
+
+
+def save_database(bv, path):
+    '''
+    write the bndb under a temp name and rename it, a killed job never leaves a truncated bndb to be opened next time
+    '''
+    bv.create_database(path + ".tmp")
+    bv.file.close()
+    os.replace(path + ".tmp", path)
+
+
 def filter_binary_file(files):
     res = []
     for file in files:
-        if file.endswith(".name_and_addr") or file.endswith(".bndb") or file.endswith(".json"):
+        if file.endswith((".name_and_addr", ".bndb", ".json", ".packed", ".tmp")):
             continue
         res.append(file)
     return res
@@ -84,10 +229,11 @@ def filter_binary_file(files):
 def main(binaries_path):
     files = filter_binary_file(glob(binaries_path))
     cnt_all = len(files)
+    cache = open_render_cache()
     for idx, file in enumerate(files):
-        # do not overwrite json file
-        if os.path.exists(file+".json") and os.path.getsize(file+".json") > 0:
-            logging.debug(f"[-] {file}.json already exists")
+        # do not overwrite packed file
+        if os.path.exists(file+".packed") and os.path.getsize(file+".packed") > 0:
+            logging.debug(f"[-] {file}.packed already exists")
             continue
         if not os.path.exists(file+".name_and_addr"):
             logging.error(f"[!] {file}.name_and_addr not exists")
@@ -108,56 +254,43 @@ def main(binaries_path):
         for sym in bv.get_symbols():
             symbol_maps[sym.address] = " ".join(my_split_func_name(sym.full_name))
 
-        tstart = bv.sections['.text'].start
-        tend = bv.sections['.text'].end
-
+        normalizer = Normalizer(bv, symbol_maps)
+        renderer = PseudoCRenderer(bv, cache, file_sha256(file) if cache is not None else None)
         methods = {}
-        for idx,func in enumerate(bv.functions):
-            if not (func.lowest_address >= tstart and func.highest_address <= tend):
-                continue
-            if func.lowest_address not in startaddr_name_maps:
-                continue
-            if func is not None and func.analysis_skipped:
-                continue
-                # force analysis large function
-                # func.analysis_skip_override = FunctionAnalysisSkipOverride.NeverSkipFunctionAnalysis
-                # bv.update_analysis_and_wait()
-            addr = f"{func.lowest_address}_{func.highest_address}"
-            name = startaddr_name_maps[func.lowest_address]
-            instructions = normalize_instruction(func,bv,symbol_maps)
-            llils = normalize_LLIL(func,bv,symbol_maps)
-            mlils = normalize_MLIL(func, bv, symbol_maps)
-            pseudo_code = tokenize_raw_code_binja(get_pseudo_c(func, bv),
-                                            my_split_func_name)
-            methods[addr] = {
-                "start_addr": func.lowest_address,
-                "addr": addr,
-                "name": name,
-                "instructions": instructions,
-                "llils": llils,
-                "mlils": mlils,
-                "pseudo_code": pseudo_code
-            }
+        for func in select_functions(bv, startaddr_name_maps):
+            method = extract_method(func, normalizer, renderer, startaddr_name_maps[func.lowest_address])
+            methods[method["addr"]] = method
 
         # save func to file
-        with open(f"{file}.json", 'w', encoding="utf-8") as f:
-            json.dump(methods, f, indent=4)
-        logging.debug(f"[-] save {file}.json, {len(methods)} functions")
+        save_methods(f"{file}.packed", methods, PACKED_COMPRESSION)
+        logging.debug(f"[-] save {file}.packed, {len(methods)} functions")
 
         # save bndb
-        bv.create_database(f"{file}.bndb")
+        save_database(bv, f"{file}.bndb")
         logging.debug(f"[-] save {file}.bndb")
+    if cache is not None:
+        cache.close()
+    my_split_func_name.save()
 
 
-def spawn(file, logprogress):
+def spawn(file, logprogress=""):
     logging.debug(f"[-] {logprogress} processing {file}")
-    # do not overwrite json file
-    if os.path.exists(file + ".json") and os.path.getsize(file + ".json") > 0:
-        logging.debug(f"[-] {file}.json already exists")
+    store = ArtifactStore(ARTIFACT_STORE_DIR) if ARTIFACT_STORE_DIR is not None else None
+    # do not overwrite packed file
+    if store is None and os.path.exists(file + ".packed") and os.path.getsize(file + ".packed") > 0:
+        logging.debug(f"[-] {file}.packed already exists")
         return
     if not os.path.exists(file + ".name_and_addr"):
         logging.error(f"[!] {file}.name_and_addr not exists")
-        return
+        return SKIPPED # not done, tried again once stage 3 wrote it
+
+    binary_hash = file_sha256(file)
+    if store is not None:
+        fp = ext_code_fingerprint(file)
+        # same binary, same settings: reuse the artifact of an earlier run or another machine
+        if store.fetch("ext_code", binary_hash, fp, f"{file}.packed"):
+            logging.debug(f"[-] {file}.packed up to date")
+            return
 
     startaddr_name_maps = get_startaddr_name_maps(file,filter_meaningless=FILTER_MEANINGLESS)
 
@@ -168,65 +301,67 @@ def spawn(file, logprogress):
         bv = BinaryViewType.get_view_of_file(file)
 
     if '.text' not in bv.sections:
-        return
+        logging.error(f"[!] {file} has no .text section")
+        bv.file.close()
+        return NO_TEXT # done, nothing to extract, not tried again
     # get symbols
     symbol_maps = {}
     for sym in bv.get_symbols():
         symbol_maps[sym.address] = " ".join(my_split_func_name(sym.full_name))
 
-    tstart = bv.sections['.text'].start
-    tend = bv.sections['.text'].end
-
-    methods = {}
-    for idx, func in enumerate(bv.functions):
-        if not (func.lowest_address >= tstart and func.highest_address <= tend):
-            continue
-        if func.lowest_address not in startaddr_name_maps:
-            continue
-        if func is not None and func.analysis_skipped:
-            continue
-            # force analysis large function
-            # func.analysis_skip_override = FunctionAnalysisSkipOverride.NeverSkipFunctionAnalysis
-            # bv.update_analysis_and_wait()
-        addr = f"{func.lowest_address}_{func.highest_address}"
-        name = startaddr_name_maps[func.lowest_address]
-        instructions = normalize_instruction(func, bv, symbol_maps)
-        llils = normalize_LLIL(func, bv, symbol_maps)
-        mlils = normalize_MLIL(func, bv, symbol_maps)
-        pseudo_code = tokenize_raw_code_binja(get_pseudo_c(func, bv),
-                                              my_split_func_name)
-        methods[addr] = {
-            "start_addr": func.lowest_address,
-            "addr": addr,
-            "name": name,
-            "instructions": instructions,
-            "llils": llils,
-            "mlils": mlils,
-            "pseudo_code": pseudo_code
-        }
+    funcs = select_functions(bv, startaddr_name_maps)
+    parallel = INTRA_BINARY_PROCESSES > 1 and len(funcs) >= INTRA_BINARY_MIN_FUNCS
+    if parallel:
+        # save_database closes the view, the function objects are unusable after it
+        spans = [(func.lowest_address, func.highest_address) for func in funcs]
+        # analyze once, then the workers open the saved database
+        save_database(bv, f"{file}.bndb")
+        logging.debug(f"[-] save {file}.bndb, extract {len(spans)} functions in {INTRA_BINARY_PROCESSES} processes")
+        methods = extract_parallel(file, spans, startaddr_name_maps, symbol_maps, INTRA_BINARY_PROCESSES, binary_hash)
+    else:
+        normalizer = Normalizer(bv, symbol_maps)
+        cache = open_render_cache()
+        renderer = PseudoCRenderer(bv, cache, binary_hash)
+        methods = {}
+        for func in funcs:
+            method = extract_method(func, normalizer, renderer, startaddr_name_maps[func.lowest_address])
+            methods[method["addr"]] = method
+        if cache is not None:
+            logging.debug(f"[-] pseudo c cache {cache.cache_info()}")
+            cache.close()
 
     # save func to file
-    with open(f"{file}.json", 'w', encoding="utf-8") as f:
-        json.dump(methods, f, indent=4)
-    logging.debug(f"[-] save {file}.json, {len(methods)} functions")
+    save_methods(f"{file}.packed", methods, PACKED_COMPRESSION)
+    logging.debug(f"[-] save {file}.packed, {len(methods)} functions")
+    if store is not None:
+        store.put("ext_code", binary_hash, fp, f"{file}.packed")
 
-    # save bndb
-    bv.create_database(f"{file}.bndb")
-    logging.debug(f"[-] save {file}.bndb")
+    if not parallel:
+        # save bndb
+        save_database(bv, f"{file}.bndb")
+        logging.debug(f"[-] save {file}.bndb")
+    logging.debug(f"[-] name split cache {my_split_func_name.cache_info()}")
+    my_split_func_name.save()
 
 
 def multi_thread_main(binaries_path):
+    '''
+    one process per binary, largest binaries first, job states in LEDGER_PATH,
+    failed and timed out binaries are logged and retried instead of vanishing with the pool results
+    '''
     files = filter_binary_file(glob(binaries_path))
-    cnt_all = len(files)
 
     set_start_method("spawn")
     processes = cpu_count() // 2 if cpu_count() > 1 else 1
-    pool = Pool(processes=processes)
-    results = []
-    for idx, file in enumerate(files):
-        results.append(pool.apply_async(spawn, (file, f"{idx + 1}/{cnt_all}",)))
-    pool.close()
-    pool.join()
+    # a done binary runs again if its content, its .name_and_addr or the extraction settings changed
+    versions = dict((file, f"{file_sha256(file)}-{ext_code_fingerprint(file)}") for file in files)
+    ledger = run_jobs(spawn, dict((file, os.path.getsize(file)) for file in files), LEDGER_PATH,
+                      processes=processes, timeout=JOB_TIMEOUT, retries=JOB_RETRIES, versions=versions)
+    for file, entry in ledger.jobs.items():
+        if entry["state"] == "failed":
+            logging.error(f"[!] {file} failed: {entry['error']}")
+        elif entry["state"] == SKIPPED:
+            logging.warning(f"[!] {file} skipped, no .name_and_addr")
 
 if __name__ == '__main__':
     # main(BIN_DIR)
@@ -1,23 +1,34 @@
 import os
-import json
+import sys
 import logging
 from glob import glob
 from typing import List
+from multiprocessing import Pool
 import sentencepiece
-from nltk.corpus import words
-from utils.utils import split_func_name, split_sentence_piece, merge_suffix
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+from utils.utils import NameSplitter, load_lexicon
+from utils.packed import PackedReader, load_methods
+from utils.lexer import truncate_tokens, write_tokens
+from artifact_store import ArtifactStore, file_sha256, fingerprint
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s| %(levelname)s| %(message)s')
 
 
-CODE_DIR = "D:/PythonProject/NER/binja/amd64/TRAIN/*.json"
+CODE_DIR = "D:/PythonProject/NER/binja/amd64/TRAIN/*.packed" # or *.json of older runs, see utils/packed.py
 MODEL_PATH = "D:/PythonProject/NER/binja/model/sentencepiece.model"
+NAME_CACHE_PATH = "D:/PythonProject/NER/binja/model/name_split_cache.pkl"
+LEXICON_PATH = "D:/PythonProject/NER/binja/model/lexicon.pkl"
 # MEANINGLESS_FUNC_PATH = "D:/PythonProject/NER/binja/model/meaningless_funcs.txt"
 CORPUS_DIR = "D:/PythonProject/NER/binja/amd64/"
 SAVE_TYPE = "train"
+PROCESSES = 1 # >1 to tokenize files in a process pool, output is identical to a serial run
+# tokenized rows by (packed file sha256, fingerprint of the tokenizer), None to always tokenize
+ARTIFACT_STORE_DIR = "D:/PythonProject/NER/binja/artifacts"
+CORPUS_VERSION = 1 # bump when process_method output changes
+MAX_TOKENS = None # keep the first words of the pseudo code (onmt -src_seq_length 3000), None to keep all
 
 sp = sentencepiece.SentencePieceProcessor()
 sp.load(MODEL_PATH)
-vocab = words.words()
+vocab = load_lexicon(LEXICON_PATH)
 # with open(MEANINGLESS_FUNC_PATH,"r",encoding="utf-8") as f:
 #     meaningless = [line.strip() for line in f.readlines() if line.strip()]
 #
@@ -31,15 +42,50 @@ vocab = words.words()
 #     return True
 
 
-def my_split_func_name(name):
-    return merge_suffix(split_sentence_piece(sp, split_func_name(name)), vocab)
+my_split_func_name = NameSplitter(sp, vocab, cache_path=NAME_CACHE_PATH)
+store = ArtifactStore(ARTIFACT_STORE_DIR) if ARTIFACT_STORE_DIR is not None else None
+rows_fingerprint = fingerprint(CORPUS_VERSION, MAX_TOKENS, file_sha256(MODEL_PATH), file_sha256(LEXICON_PATH))
 
 
-def save(src:List, tgt:List, src_type, set_type):
-    with open(os.path.join(CORPUS_DIR,f"src-{set_type}-{src_type}.txt"), "w", encoding="utf-8") as f:
-        f.write("\n".join(src))
-    with open(os.path.join(CORPUS_DIR,f"tgt-{set_type}-{src_type}.txt"), "w", encoding="utf-8") as f:
-        f.write("\n".join(tgt))
+SRC_TYPES = ["inst", "llil", "mlil", "pc"]
+
+
+class CorpusWriter:
+    '''
+    append aligned rows to src-{set_type}-{src_type}.txt and tgt-{set_type}-{src_type}.txt
+    for every src_type, a row is written to all files or none of them
+    '''
+    def __init__(self, corpus_dir, set_type, src_types=SRC_TYPES):
+        self.src_types = src_types
+        self.src_files = {}
+        self.tgt_files = {}
+        for src_type in src_types:
+            self.src_files[src_type] = open(os.path.join(corpus_dir,f"src-{set_type}-{src_type}.txt"), "w", encoding="utf-8")
+            self.tgt_files[src_type] = open(os.path.join(corpus_dir,f"tgt-{set_type}-{src_type}.txt"), "w", encoding="utf-8")
+        self.rows = 0
+
+    def write(self, srcs:dict, tgt:str):
+        # rows are joined by "\n" without a trailing newline, same as "\n".join(rows)
+        # a src is a line or a token list, tokens are written one by one instead of joined first
+        sep = "\n" if self.rows else ""
+        for src_type in self.src_types:
+            if isinstance(srcs[src_type], str):
+                self.src_files[src_type].write(sep + srcs[src_type])
+            else:
+                self.src_files[src_type].write(sep)
+                write_tokens(self.src_files[src_type], srcs[src_type])
+            self.tgt_files[src_type].write(sep + tgt)
+        self.rows += 1
+
+    def close(self):
+        for f in list(self.src_files.values()) + list(self.tgt_files.values()):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 def process_inst(instructions:List[List[str]]) -> str:
@@ -70,64 +116,71 @@ def process_mlil(mlils:List[List[str]]) -> str:
     return line
 
 
-def process_pc(pseudocode:List[str]) -> str:
-    return " ".join(pseudocode)
+def process_pc(pseudocode:List[str]) -> List[str]:
+    # the packed file holds the token list, CorpusWriter writes it without joining
+    if MAX_TOKENS:
+        return list(truncate_tokens(pseudocode, MAX_TOKENS))
+    return pseudocode
 
 
 def process_label(label:str) -> str:
     return " ".join(my_split_func_name(label))
 
 
-def main(code_path):
-    data_inst = []
-    data_llil = []
-    data_mlil = []
-    data_pseudocode = []
-    data_label = []
+def process_method(method:dict) -> dict:
+    return {
+        "inst": process_inst(method["instructions"]),
+        "llil": process_llil(method["llils"]),
+        "mlil": process_mlil(method["mlils"]),
+        "pc": process_pc(method["pseudo_code"]),
+    }
+
+
+def process_file(file) -> List:
+    '''
+    rows of one per-binary packed (or json) file, pure per-file work so it can run in a pool worker,
+    workers import this module and load the sentencepiece model once each
+    '''
+    if store is not None:
+        key = file_sha256(file)
+        rows = store.load("corpus_rows", key, rows_fingerprint)
+        if rows is not None:
+            return rows
+    if file.endswith(".json"):
+        methods = load_methods(file).values()
+        rows = [(process_method(method), process_label(method["name"])) for method in methods]
+    else:
+        # one method decoded at a time, the file stays mapped instead of loaded into a dict
+        with PackedReader(file) as reader:
+            rows = [(process_method(method), process_label(method["name"])) for _addr, method in reader.items()]
+    if store is not None:
+        store.dump("corpus_rows", key, rows_fingerprint, rows)
+    return rows
+
+
+def main(code_path, processes=PROCESSES):
     files = glob(code_path)
     cnt_all = len(files)
 
-    for idx,file in enumerate(files):
-        logging.debug(f"[-] inst {idx+1}/{cnt_all} processing {file}")
-        with open(file, "r", encoding="utf-8") as f:
-            methods = json.load(f)
-        for _addr, method in methods.items():
-            data_inst.append(process_inst(method["instructions"]))
-            data_label.append(process_label(method["name"]))
-    logging.debug(f"[+] save to path {CORPUS_DIR}")
-    save(data_inst,data_label,src_type="inst",set_type=SAVE_TYPE)
-    del data_inst
-
-    for idx,file in enumerate(files):
-        logging.debug(f"[-] llil {idx+1}/{cnt_all} processing {file}")
-        with open(file, "r", encoding="utf-8") as f:
-            methods = json.load(f)
-        for _addr, method in methods.items():
-            data_llil.append(process_llil(method["llils"]))
-            # data_label.append(process_label(method["name"]))
     logging.debug(f"[+] save to path {CORPUS_DIR}")
-    save(data_llil,data_label,src_type="llil",set_type=SAVE_TYPE)
-    del data_llil
-
-    for idx,file in enumerate(files):
-        logging.debug(f"[-] mlil {idx+1}/{cnt_all} processing {file}")
-        with open(file, "r", encoding="utf-8") as f:
-            methods = json.load(f)
-        for _addr, method in methods.items():
-            data_mlil.append(process_mlil(method["mlils"]))
-            # data_label.append(process_label(method["name"]))
-    logging.debug(f"[+] save to path {CORPUS_DIR}")
-    save(data_mlil,data_label,src_type="mlil",set_type=SAVE_TYPE)
-    del data_mlil
-
-    for idx,file in enumerate(files):
-        logging.debug(f"[-] pc {idx+1}/{cnt_all} processing {file}")
-        with open(file, "r", encoding="utf-8") as f:
-            methods = json.load(f)
-        for _addr, method in methods.items():
-            data_pseudocode.append(process_pc(method["pseudo_code"]))
-            # data_label.append(process_label(method["name"]))
-    save(data_pseudocode,data_label,src_type="pc",set_type=SAVE_TYPE)
+    with CorpusWriter(CORPUS_DIR, SAVE_TYPE) as writer:
+        if processes > 1:
+            pool = Pool(processes=processes)
+            # imap yields in file order, whichever worker finishes first
+            results = pool.imap(process_file, files)
+        else:
+            pool = None
+            results = map(process_file, files)
+        for idx, (file, rows) in enumerate(zip(files, results)):
+            logging.debug(f"[-] {idx+1}/{cnt_all} processed {file}")
+            for srcs, label in rows:
+                writer.write(srcs, label)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        logging.debug(f"[+] {writer.rows} rows saved")
+    # in pool mode the workers split the names, their caches are not written back
+    my_split_func_name.save()
 
 
 if __name__ == '__main__':
@@ -1,105 +1,219 @@
-from typing import List
-from binaryninja.architecture import InstructionTextToken, InstructionTextTokenType
-from utils.utils import split_func_name
+from typing import Iterable, Iterator, List, NamedTuple
+from enum import IntEnum
+from bisect import bisect_right
+try:
+    from binaryninja.architecture import InstructionTextTokenType
+except ImportError:
+    # stand-in so the normalizer can be tested and benchmarked without Binary Ninja
+    class InstructionTextTokenType(IntEnum):
+        TextToken = 0
+        InstructionToken = 1
+        OperandSeparatorToken = 2
+        RegisterToken = 3
+        IntegerToken = 4
+        PossibleAddressToken = 5
+        BeginMemoryOperandToken = 6
+        EndMemoryOperandToken = 7
+        FloatingPointToken = 8
+        AnnotationToken = 9
+        CodeRelativeAddressToken = 10
+        StringToken = 17
 
 NUM_THRESHOLD = 0x0
+# class token of an address by the section it falls in, unknown sections and unmapped addresses are <ADDR>
+SECTION_CLASSES = {
+    ".text": "<INTERADDR>",
+    ".plt": "<PLTADDR>", ".plt.got": "<PLTADDR>", ".plt.sec": "<PLTADDR>",
+    ".got": "<GOTADDR>", ".got.plt": "<GOTADDR>",
+    ".rodata": "<RODATAADDR>",
+    ".data": "<DATAADDR>",
+    ".bss": "<BSSADDR>",
+    ".extern": "<EXTERNADDR>", "extern": "<EXTERNADDR>",
+}
 
-def normalize_instruction(func, bv, symbol_maps: dict) -> List[List[str]]:
-    tstart = bv.sections['.text'].start
-    tend = bv.sections['.text'].end
-
-    fstart = func.lowest_address
-    fend = func.highest_address
-
-    instructions: List[List[InstructionTextToken]] = list(func.instructions)
-    nlzed_instructions = []
-    for (inst, addr) in instructions:
-        nlzed_inst = []
-        for token in inst:
-            if token.type in [InstructionTextTokenType.CodeRelativeAddressToken,
-                              InstructionTextTokenType.PossibleAddressToken]:
-                if token.value in symbol_maps:
-                    nlzed_inst.append(symbol_maps[token.value])
-                elif token.value >= fstart and token.value <= fend:
-                    nlzed_inst.append("<LOCADDR>")
-                elif token.value >= tstart and token.value <= tend:
-                    nlzed_inst.append("<INTERADDR>")
-                else:
-                    nlzed_inst.append("<ADDR>")
-            elif token.type == InstructionTextTokenType.IntegerToken:
-                if token.value > NUM_THRESHOLD:
-                    nlzed_inst.append("<NUM>")
-                else:
-                    nlzed_inst.append(str(token))
+
+class Token(NamedTuple):
+    '''
+    pure python stand-in for binaryninja InstructionTextToken, only type, text and value are used
+    '''
+    type: int
+    text: str
+    value: int = 0
+
+    def __str__(self):
+        return self.text
+
+
+class SectionIndex:
+    '''
+    disjoint section intervals of a binary view, classify(addr) is a bisect instead of an if chain.
+    ends are inclusive like the old .text check. nested or overlapping sections are cut into disjoint
+    pieces when the index is built, the innermost section (latest start, then shortest) owns each piece,
+    so if sections touch the later one wins
+    '''
+    def __init__(self, sections: Iterable, classes=SECTION_CLASSES, default="<ADDR>"):
+        # sections: (name, start, end)
+        entries = sorted((start, end, classes.get(name, default)) for name, start, end in sections)
+        bounds = sorted(set([start for start, _end, _token in entries] + [end + 1 for _start, end, _token in entries]))
+        self.starts = []
+        self.ends = []
+        self.tokens = []
+        for lo, hi in zip(bounds, bounds[1:]):
+            covering = [(start, -end, token) for start, end, token in entries if start <= lo and hi - 1 <= end]
+            if not covering:
+                continue
+            token = max(covering)[2]
+            if self.tokens and self.tokens[-1] == token and self.ends[-1] == lo - 1:
+                self.ends[-1] = hi - 1 # same class as the piece before, one interval
             else:
-                nlzed_inst.append(str(token))
-        nlzed_instructions.append(nlzed_inst)
-    return nlzed_instructions
+                self.starts.append(lo)
+                self.ends.append(hi - 1)
+                self.tokens.append(token)
+        self.default = default
+
+    @classmethod
+    def from_bv(cls, bv, **kwargs):
+        return cls(((name, section.start, section.end) for name, section in bv.sections.items()), **kwargs)
+
+    def classify(self, addr) -> str:
+        i = bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr <= self.ends[i]:
+            return self.tokens[i]
+        return self.default
+
+
+class Normalizer:
+    '''
+    token normalization for one binary view, the section index is built once,
+    every token is dispatched on its type through a dict:
+        address tokens -> symbol name, <LOCADDR> (inside the function) or the class of its section,
+                          see SECTION_CLASSES
+        integer tokens -> <NUM> above NUM_THRESHOLD
+        string tokens  -> quotes and underscores split (MLIL only)
+        others         -> str(token)
+    '''
+    def __init__(self, bv, symbol_maps: dict, num_threshold=NUM_THRESHOLD, sections: SectionIndex = None):
+        self.sections = SectionIndex.from_bv(bv) if sections is None else sections
+        self.symbol_maps = symbol_maps
+        self.num_threshold = num_threshold
+        self.handlers = {
+            InstructionTextTokenType.CodeRelativeAddressToken: self._address,
+            InstructionTextTokenType.PossibleAddressToken: self._address,
+            InstructionTextTokenType.IntegerToken: self._integer,
+        }
+        self.mlil_handlers = dict(self.handlers)
+        self.mlil_handlers[InstructionTextTokenType.StringToken] = self._string
+
+    def _address(self, token, fstart, fend):
+        value = token.value
+        if value in self.symbol_maps:
+            return self.symbol_maps[value]
+        if fstart <= value <= fend:
+            return "<LOCADDR>"
+        return self.sections.classify(value)
+
+    def _integer(self, token, fstart, fend):
+        return "<NUM>" if token.value > self.num_threshold else str(token)
+
+    @staticmethod
+    def _string(token, fstart, fend):
+        return str(token).replace("\"", " \" ").replace("_", " ").strip()
+
+    def normalize(self, lines: Iterable[Iterable], fstart, fend, handlers=None) -> Iterator[List[str]]:
+        '''
+        lazily normalize any iterable of token sequences of the function [fstart, fend]
+        '''
+        handlers = self.handlers if handlers is None else handlers
+        get = handlers.get
+        for tokens in lines:
+            nlzed = []
+            for token in tokens:
+                handler = get(token.type)
+                nlzed.append(str(token) if handler is None else handler(token, fstart, fend))
+            yield nlzed
+
+    def instructions(self, func) -> Iterator[List[str]]:
+        return self.normalize((inst for inst, _addr in func.instructions), func.lowest_address, func.highest_address)
+
+    def llil(self, func) -> Iterator[List[str]]:
+        return self.normalize((il.tokens for il in func.llil.instructions), func.lowest_address, func.highest_address)
+
+    def mlil(self, func) -> Iterator[List[str]]:
+        return self.normalize((il.tokens for il in func.mlil.instructions), func.lowest_address, func.highest_address,
+                              self.mlil_handlers)
+
+
+def normalize_instruction(func, bv, symbol_maps: dict) -> List[List[str]]:
+    return list(Normalizer(bv, symbol_maps).instructions(func))
 
 
 def normalize_LLIL(func, bv, symbol_maps: dict) -> List[List[str]]:
-    tstart = bv.sections['.text'].start
-    tend = bv.sections['.text'].end
-
-    fstart = func.lowest_address
-    fend = func.highest_address
-
-    llils = list(func.llil.instructions)
-    nlzed_llils = []
-    for llil in llils:
-        nlzed_llil = []
-        for token in llil.tokens:  # type(token)==InstructionTextToken
-            if token.type in [InstructionTextTokenType.CodeRelativeAddressToken,
-                              InstructionTextTokenType.PossibleAddressToken]:
-                if token.value in symbol_maps:
-                    nlzed_llil.append(symbol_maps[token.value])
-                elif token.value >= fstart and token.value <= fend:
-                    nlzed_llil.append("<LOCADDR>")
-                elif token.value >= tstart and token.value <= tend:
-                    nlzed_llil.append("<INTERADDR>")
-                else:
-                    nlzed_llil.append("<ADDR>")
-            elif token.type == InstructionTextTokenType.IntegerToken:
-                if token.value > NUM_THRESHOLD:
-                    nlzed_llil.append("<NUM>")
-                else:
-                    nlzed_llil.append(str(token))
-            else:
-                nlzed_llil.append(str(token))
-        nlzed_llils.append(nlzed_llil)
-    return nlzed_llils
+    return list(Normalizer(bv, symbol_maps).llil(func))
 
 
 def normalize_MLIL(func, bv, symbol_maps: dict) -> List[List[str]]:
-    tstart = bv.sections['.text'].start
-    tend = bv.sections['.text'].end
-
-    fstart = func.lowest_address
-    fend = func.highest_address
-
-    mlils = list(func.mlil.instructions)
-    nlzed_mlils = []
-    for mlil in mlils:
-        nlzed_mlil = []
-        for token in mlil.tokens:  # type(token)==InstructionTextToken
-            if token.type in [InstructionTextTokenType.CodeRelativeAddressToken,
-                              InstructionTextTokenType.PossibleAddressToken]:
-                if token.value in symbol_maps:
-                    nlzed_mlil.append(symbol_maps[token.value])
-                elif token.value >= fstart and token.value <= fend:
-                    nlzed_mlil.append("<LOCADDR>")
-                elif token.value >= tstart and token.value <= tend:
-                    nlzed_mlil.append("<INTERADDR>")
-                else:
-                    nlzed_mlil.append("<ADDR>")
-            elif token.type == InstructionTextTokenType.IntegerToken:
-                if token.value > NUM_THRESHOLD:
-                    nlzed_mlil.append("<NUM>")
+    return list(Normalizer(bv, symbol_maps).mlil(func))
+
+
+def _benchmark(count=200000):
+    '''
+    old per-token membership chain vs dict dispatch, on stand-in tokens
+    '''
+    import random
+    import time
+    from types import SimpleNamespace
+    T = InstructionTextTokenType
+    random.seed(0)
+    kinds = [T.InstructionToken, T.RegisterToken, T.OperandSeparatorToken, T.IntegerToken,
+             T.PossibleAddressToken, T.CodeRelativeAddressToken, T.StringToken, T.TextToken]
+    lines = [[Token(kind, f"t{i}", random.randint(0, 0x2000)) for kind in random.choices(kinds, k=6)]
+             for i in range(count)]
+    bv = SimpleNamespace(sections={'.text': SimpleNamespace(start=0x400, end=0x1800)})
+    symbol_maps = {0x500: "malloc", 0x1900: "free"}
+
+    def chain(lines, fstart, fend):
+        tstart, tend = bv.sections['.text'].start, bv.sections['.text'].end
+        res = []
+        for inst in lines:
+            nlzed = []
+            for token in inst:
+                if token.type in [T.CodeRelativeAddressToken, T.PossibleAddressToken]:
+                    if token.value in symbol_maps:
+                        nlzed.append(symbol_maps[token.value])
+                    elif fstart <= token.value <= fend:
+                        nlzed.append("<LOCADDR>")
+                    elif tstart <= token.value <= tend:
+                        nlzed.append("<INTERADDR>")
+                    else:
+                        nlzed.append("<ADDR>")
+                elif token.type == T.IntegerToken:
+                    nlzed.append("<NUM>" if token.value > NUM_THRESHOLD else str(token))
+                elif token.type == T.StringToken:
+                    nlzed.append(str(token).replace("\"", " \" ").replace("_", " ").strip())
                 else:
-                    nlzed_mlil.append(str(token))
-            elif token.type == InstructionTextTokenType.StringToken:
-                nlzed_mlil.append(str(token).replace("\""," \" ").replace("_"," ").strip())
-            else:
-                nlzed_mlil.append(str(token))
-        nlzed_mlils.append(nlzed_mlil)
-    return nlzed_mlils
\ No newline at end of file
+                    nlzed.append(str(token))
+            res.append(nlzed)
+        return res
+
+    start = time.time()
+    expected = chain(lines, 0x600, 0x700)
+    chain_time = time.time() - start
+    normalizer = Normalizer(bv, symbol_maps)
+    start = time.time()
+    result = list(normalizer.normalize(lines, 0x600, 0x700, normalizer.mlil_handlers))
+    dispatch_time = time.time() - start
+    assert result == expected
+    print(f"{count} lines, chain {chain_time:.2f}s, dispatch {dispatch_time:.2f}s")
+
+    # synthetic section table, bisect vs linear scan
+    table = [(".plt", 0x100, 0x1ff), (".text", 0x200, 0x8ff), (".rodata", 0x900, 0x9ff), (".got", 0xa00, 0xa3f),
+             (".data", 0xa40, 0xbff), (".bss", 0xc00, 0xcff), (".eh_frame", 0xd00, 0xdff), ("extern", 0x1000, 0x10ff)]
+    index = SectionIndex(table)
+    for addr in range(0, 0x1200):
+        linear = [SECTION_CLASSES.get(name, "<ADDR>") for name, start, end in table if start <= addr <= end]
+        assert index.classify(addr) == (linear[-1] if linear else "<ADDR>")
+    print("section index ok")
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,245 @@
+'''
+compact per-binary method file, replaces the indented {file}.json of 2_ext_code.py
+
+layout:
+    header   MAGIC, version, compression
+    records  one per method: start/end addr, name id and the token lists as uint32 ids,
+             each record compressed alone so a single method can be read without the others
+    strings  per-file string table, every distinct token stored once
+    index    (start_addr, end_addr, offset, size) per record
+    trailer  offsets of strings and index, record count, MAGIC
+'''
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+from array import array
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MAGIC = b"NERPACK\0"
+VERSION = 1
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+HEADER = struct.Struct("<8sBB6x")
+RECORD_HEAD = struct.Struct("<QQI")
+INDEX_ENTRY = struct.Struct("<QQQI")
+TRAILER = struct.Struct("<QQI8s")
+NESTED_FIELDS = ("instructions", "llils", "mlils")  # List[List[str]]
+FLAT_FIELDS = ("pseudo_code",)  # List[str]
+
+
+def _u32(values) -> bytes:
+    ids = array("I", values)
+    if sys.byteorder != "little":
+        ids.byteswap()
+    return ids.tobytes()
+
+
+def _read_u32(buf, pos, count):
+    ids = array("I")
+    ids.frombytes(buf[pos:pos + 4 * count])
+    if sys.byteorder != "little":
+        ids.byteswap()
+    return ids, pos + 4 * count
+
+
+class PackedWriter:
+    '''
+    stream methods into a packed file, the file appears under path only after close()
+    '''
+    def __init__(self, path, compression="zlib", level=6):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package")
+        self.path = path
+        self.compression = compression
+        if compression == "zlib":
+            self._compress = lambda data: zlib.compress(data, level)
+        elif compression == "zstd":
+            self._compress = zstandard.ZstdCompressor(level=level).compress
+        else:
+            self._compress = bytes
+        self.strings = {}
+        self.index = []
+        self.f = open(path + ".tmp", "wb")
+        self.f.write(HEADER.pack(MAGIC, VERSION, COMPRESSIONS[compression]))
+
+    def _id(self, token):
+        id_ = self.strings.get(token)
+        if id_ is None:
+            id_ = self.strings[token] = len(self.strings)
+        return id_
+
+    def write(self, method: dict):
+        start, end = (int(x) for x in method["addr"].split("_"))
+        parts = [RECORD_HEAD.pack(start, end, self._id(method["name"]))]
+        for field in NESTED_FIELDS:
+            rows = method[field]
+            parts.append(_u32([len(rows)] + [len(row) for row in rows]))
+            parts.append(_u32([self._id(token) for row in rows for token in row]))
+        for field in FLAT_FIELDS:
+            tokens = method[field]
+            parts.append(_u32([len(tokens)] + [self._id(token) for token in tokens]))
+        data = self._compress(b"".join(parts))
+        self.index.append((start, end, self.f.tell(), len(data)))
+        self.f.write(data)
+
+    def close(self):
+        if self.f is None:
+            return
+        strings_offset = self.f.tell()
+        encoded = [token.encode("utf-8") for token in self.strings]
+        offsets = [0]
+        for token in encoded:
+            offsets.append(offsets[-1] + len(token))
+        self.f.write(_u32([len(encoded)] + offsets))
+        self.f.write(self._compress(b"".join(encoded)))
+        index_offset = self.f.tell()
+        for entry in self.index:
+            self.f.write(INDEX_ENTRY.pack(*entry))
+        self.f.write(TRAILER.pack(strings_offset, index_offset, len(self.index), MAGIC))
+        self.f.close()
+        self.f = None
+        os.replace(self.path + ".tmp", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            # never leave a half written file behind
+            self.f.close()
+            self.f = None
+            os.remove(self.path + ".tmp")
+        else:
+            self.close()
+
+
+class PackedReader:
+    '''
+    memory mapped random access to a packed file,
+    reader["start_end"] returns the same dict 2_ext_code.py used to dump as json
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, compression = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a packed method file")
+        if compression == COMPRESSIONS["zlib"]:
+            self._decompress = zlib.decompress
+        elif compression == COMPRESSIONS["zstd"]:
+            if zstandard is None:
+                raise ImportError(f"{path} is zstd compressed, install zstandard")
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._decompress = bytes
+        strings_offset, index_offset, count, magic = TRAILER.unpack_from(self.buf, len(self.buf) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is truncated")
+
+        (n,), pos = _read_u32(self.buf, strings_offset, 1)
+        offsets, pos = _read_u32(self.buf, pos, n + 1)
+        blob = self._decompress(self.buf[pos:index_offset])
+        self.strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(n)]
+
+        self.index = {}
+        for i in range(count):
+            start, end, offset, size = INDEX_ENTRY.unpack_from(self.buf, index_offset + i * INDEX_ENTRY.size)
+            self.index[f"{start}_{end}"] = (offset, size)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, addr):
+        return addr in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, addr) -> dict:
+        offset, size = self.index[addr]
+        data = self._decompress(self.buf[offset:offset + size])
+        strings = self.strings
+        start, end, name_id = RECORD_HEAD.unpack_from(data, 0)
+        pos = RECORD_HEAD.size
+        method = {
+            "start_addr": start,
+            "addr": f"{start}_{end}",
+            "name": strings[name_id],
+        }
+        for field in NESTED_FIELDS:
+            (n,), pos = _read_u32(data, pos, 1)
+            lengths, pos = _read_u32(data, pos, n)
+            ids, pos = _read_u32(data, pos, sum(lengths))
+            tokens = [strings[i] for i in ids]
+            rows = []
+            i = 0
+            for length in lengths:
+                rows.append(tokens[i:i + length])
+                i += length
+            method[field] = rows
+        for field in FLAT_FIELDS:
+            (n,), pos = _read_u32(data, pos, 1)
+            ids, pos = _read_u32(data, pos, n)
+            method[field] = [strings[i] for i in ids]
+        return method
+
+    def items(self):
+        for addr in self.index:
+            yield addr, self[addr]
+
+    def close(self):
+        self.buf.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_methods(path, methods: dict, compression="zlib"):
+    with PackedWriter(path, compression) as writer:
+        for method in methods.values():
+            writer.write(method)
+
+
+def load_methods(path) -> dict:
+    '''
+    {addr: method} of a packed file or of an old json file
+    '''
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with PackedReader(path) as reader:
+        return dict(reader.items())
+
+
+def json_to_packed(json_path, packed_path=None, compression="zlib"):
+    '''
+    convert a {file}.json of 2_ext_code.py to {file}.packed
+    '''
+    if packed_path is None:
+        packed_path = json_path[:-len(".json")] + ".packed" if json_path.endswith(".json") else json_path + ".packed"
+    with open(json_path, "r", encoding="utf-8") as f:
+        methods = json.load(f)
+    save_methods(packed_path, methods, compression)
+    return packed_path
+
+
+if __name__ == '__main__':
+    # python utils/packed.py amd64/*.json
+    from glob import glob
+    for pattern in sys.argv[1:]:
+        for json_path in glob(pattern):
+            packed_path = json_to_packed(json_path)
+            print(f"{json_path} ({os.path.getsize(json_path)} bytes) -> {packed_path} ({os.path.getsize(packed_path)} bytes)")
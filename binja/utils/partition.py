@@ -0,0 +1,43 @@
+'''
+split the functions of one binary into balanced chunks for a worker pool, and merge the chunk results back.
+works on plain (start, end) spans, no binary view has to be open
+'''
+import heapq
+from typing import Callable, Dict, Iterable, List
+
+
+def partition(items: List, weight: Callable, chunks: int) -> List[List]:
+    '''
+    longest processing time first: the heaviest item goes to the lightest chunk.
+    items keep their original order inside a chunk, empty chunks are dropped
+    '''
+    chunks = max(1, min(chunks, len(items)))
+    heap = [(0, i) for i in range(chunks)]
+    assigned = [[] for _ in range(chunks)]
+    for idx in sorted(range(len(items)), key=lambda idx: -weight(items[idx])):
+        load, i = heapq.heappop(heap)
+        assigned[i].append(idx)
+        heapq.heappush(heap, (load + weight(items[idx]), i))
+    return [[items[idx] for idx in sorted(chunk)] for chunk in assigned if chunk]
+
+
+def partition_spans(spans: List, chunks: int):
+    '''
+    spans: (lowest_address, highest_address) of the functions in bv.functions order,
+    return the "{start}_{end}" keys in that order (for merge) and the function starts of every chunk,
+    chunks balanced by function size
+    '''
+    sizes = dict((start, end - start + 1) for start, end in spans)
+    order = [f"{start}_{end}" for start, end in spans]
+    return order, partition(list(sizes), sizes.get, chunks)
+
+
+def merge(order: Iterable, results: Iterable[Dict]) -> Dict:
+    '''
+    merge {key: value} chunk results into one dict ordered like order,
+    keys no chunk returned (e.g. skipped functions) are left out
+    '''
+    combined = {}
+    for result in results:
+        combined.update(result)
+    return dict((key, combined[key]) for key in order if key in combined)
@@ -0,0 +1,57 @@
+'''
+on-disk cache of rendered pseudo c, keyed by (binary sha256, function start, tool version),
+so re-running the extraction with a new tokenizer never renders unchanged functions again.
+sqlite so that the pool workers of one binary and the jobs of other binaries can share it:
+write-ahead log, so readers never wait for a writer, and a commit after every put (commit_every=1),
+so the write lock is not held while the next functions are rendered
+'''
+import sqlite3
+
+
+class RenderCache:
+    def __init__(self, path, version: str, commit_every=1, timeout=600):
+        '''
+        version: tool version (binary ninja version + render settings), entries of other versions are misses
+        commit_every: puts per transaction, keep it small, other processes wait for the write lock meanwhile
+        timeout: seconds to wait for the write lock of another process
+        '''
+        self.version = version
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        # persistent for the database file, every later connection uses the log too
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode a commit without fsync is still consistent, a crash only loses the last commits
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS pseudo_c ("
+                          "binary TEXT, start INTEGER, version TEXT, text TEXT, "
+                          "PRIMARY KEY (binary, start, version))")
+        self.conn.commit()
+
+    def get(self, binary, start):
+        row = self.conn.execute("SELECT text FROM pseudo_c WHERE binary=? AND start=? AND version=?",
+                                (binary, start, self.version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, binary, start, text):
+        self.conn.execute("INSERT OR REPLACE INTO pseudo_c VALUES (?, ?, ?, ?)", (binary, start, self.version, text))
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def cache_info(self):
+        return f"hits={self.hits}, misses={self.misses}"
@@ -0,0 +1,177 @@
+'''
+resumable job scheduler, one process per job so a job can be timed out and a crash never takes the others down.
+state is kept in a json ledger next to the outputs:
+    {job: {"state": pending|running|done|skipped|failed, "size", "version", "attempts", "started", "finished", "seconds", "error", "note"}}
+a killed run is resumed by running again with the same ledger, jobs left "running" go back to "pending".
+a job whose size or version (e.g. input sha256 + settings fingerprint) changed starts over as "pending".
+a job that returns SKIPPED (its inputs are not there yet) is not done, the next run tries it again.
+a job that returns any other string is done, the string is kept as its note (e.g. nothing to extract).
+every job runs in its own process group, a timed out job is killed together with the pools it started
+'''
+import os
+import json
+import time
+import signal
+import logging
+import traceback
+import subprocess
+import multiprocessing
+
+
+PENDING, RUNNING, DONE, SKIPPED, FAILED = "pending", "running", "done", "skipped", "failed"
+
+
+class Ledger:
+    def __init__(self, path, jobs: dict, retry_failed=False, versions: dict = None):
+        '''
+        jobs: {job: size}, new jobs are added as pending, jobs already in the ledger keep their state
+        unless their size changed (e.g. a binary replaced in place) or, with versions {job: str},
+        their version changed (same size but new content, a new model or new settings)
+        '''
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.jobs = json.load(f)
+        for job, entry in self.jobs.items():
+            # killed while running, skipped for missing inputs, or failed in a previous run and asked to retry
+            if entry["state"] in (RUNNING, SKIPPED) or (retry_failed and entry["state"] == FAILED):
+                entry["state"] = PENDING
+                entry["attempts"] = 0
+        versions = versions or {}
+        for job, size in jobs.items():
+            version = versions.get(job)
+            if job not in self.jobs or self.jobs[job]["size"] != size or self.jobs[job].get("version") != version:
+                self.jobs[job] = {"state": PENDING, "size": size, "version": version, "attempts": 0}
+        self.save()
+
+    def save(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.jobs, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def mark(self, job, state, **fields):
+        self.jobs[job]["state"] = state
+        self.jobs[job].update(fields)
+        self.save()
+
+    def pending(self):
+        '''
+        largest first, so the long jobs do not start last and become the tail
+        '''
+        jobs = [job for job, entry in self.jobs.items() if entry["state"] == PENDING]
+        return sorted(jobs, key=lambda job: -self.jobs[job]["size"])
+
+    def counts(self):
+        counts = dict((state, 0) for state in (PENDING, RUNNING, DONE, SKIPPED, FAILED))
+        for entry in self.jobs.values():
+            counts[entry["state"]] += 1
+        return counts
+
+
+def _run(func, job, conn):
+    '''
+    sends (result, error) to the driver, result is the string func returned (SKIPPED or a note) or None
+    '''
+    if hasattr(os, "setpgrp"):
+        # own process group, pool workers of the job join it and are killed with it
+        os.setpgrp()
+    try:
+        result = func(job)
+        conn.send((result if isinstance(result, str) else None, None))
+    except BaseException:
+        conn.send((None, traceback.format_exc()))
+        raise
+    finally:
+        conn.close()
+
+
+def _kill(process):
+    '''
+    kill a job process and everything it started, process.terminate() would orphan its pool workers
+    '''
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # killed before it made its process group
+            process.kill()
+    else:
+        subprocess.call(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process.join()
+
+
+def run_jobs(func, jobs: dict, ledger_path, processes=1, timeout=None, retries=1, poll=0.5, retry_failed=False,
+             versions: dict = None):
+    '''
+    run func(job) for every job not done yet, at most processes at once, a free slot always takes
+    the largest pending job. a job running longer than timeout seconds is killed, a failed or
+    timed out job is retried up to retries times, a job whose func returns SKIPPED is marked skipped,
+    one that returns another string is marked done with that string as note.
+    func must be picklable (module level). versions: see Ledger. return the ledger
+    '''
+    ledger = Ledger(ledger_path, jobs, retry_failed, versions)
+    queue = ledger.pending()
+    total = len(queue)
+    running = {}  # job -> (process, conn, start)
+    finished = 0
+    try:
+        while queue or running:
+            while queue and len(running) < processes:
+                job = queue.pop(0)
+                recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+                # not a daemon, a job may start its own pool (see 2_ext_code.extract_parallel)
+                process = multiprocessing.Process(target=_run, args=(func, job, send_conn), daemon=False)
+                process.start()
+                send_conn.close()
+                attempts = ledger.jobs[job]["attempts"] + 1
+                ledger.mark(job, RUNNING, attempts=attempts, started=time.time())
+                logging.debug(f"[-] {finished + 1}/{total} start {job}, attempt {attempts}")
+                running[job] = (process, recv_conn, time.time())
+
+            time.sleep(poll)
+            for job, (process, conn, start) in list(running.items()):
+                elapsed = time.time() - start
+                error = None
+                if process.is_alive():
+                    if timeout is None or elapsed < timeout:
+                        continue
+                    _kill(process)
+                    error = f"timeout after {timeout}s"
+                else:
+                    process.join()
+                    try:
+                        result, error = conn.recv() if conn.poll() else (None, None)
+                    except EOFError:
+                        # died without reporting, e.g. a crash in native code
+                        result, error = None, None
+                    if error is None and process.exitcode != 0:
+                        error = f"exit code {process.exitcode}"
+                conn.close()
+                del running[job]
+
+                if error is None and result == SKIPPED:
+                    finished += 1
+                    ledger.mark(job, SKIPPED, finished=time.time(), seconds=round(elapsed, 3), error=None)
+                    logging.warning(f"[!] {finished}/{total} skipped {job}")
+                elif error is None:
+                    finished += 1
+                    ledger.mark(job, DONE, finished=time.time(), seconds=round(elapsed, 3), error=None, note=result)
+                    logging.debug(f"[+] {finished}/{total} done {job} in {elapsed:.1f}s" + (f", {result}" if result else ""))
+                elif ledger.jobs[job]["attempts"] <= retries:
+                    ledger.mark(job, PENDING, error=error)
+                    queue.insert(0, job)
+                    logging.warning(f"[!] {job} failed, retry: {error}")
+                else:
+                    finished += 1
+                    ledger.mark(job, FAILED, finished=time.time(), seconds=round(elapsed, 3), error=error)
+                    logging.error(f"[!] {finished}/{total} failed {job}: {error}")
+    finally:
+        # interrupted driver, do not leave jobs and their pools behind
+        for process, conn, _start in running.values():
+            _kill(process)
+            conn.close()
+    logging.debug(f"[+] jobs {ledger.counts()}")
+    return ledger
@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+'''
+read the dataset.json of pipline.py record by record, JSON array or JSON Lines,
+without loading the whole file
+'''
+import json
+
+SEPARATORS = " \t\r\n,"
+
+
+def iter_records(path, chunk_size=1 << 20):
+    '''
+    yield the items of dataset file one by one,
+    JSON Lines are read line by line, a JSON array is parsed incrementally
+    '''
+    with open(path, "r", encoding="utf-8") as f:
+        # the format is decided by the first non whitespace character, however far into the file it is
+        buf = f.read(chunk_size)
+        while buf and not buf.strip():
+            buf = f.read(chunk_size)
+        idx = len(buf) - len(buf.lstrip())
+        if not buf[idx:idx+1] == "[": # JSON Lines
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        decoder = json.JSONDecoder()
+        idx += 1
+        eof = False
+        while True:
+            # skip separators between items
+            while idx < len(buf) and buf[idx] in SEPARATORS:
+                idx += 1
+            if idx < len(buf) and buf[idx] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, idx)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            else:
+                # an item is followed by "," or "]", anything else is a number cut by the chunk ("-1." of "-1.5")
+                after = end
+                while after < len(buf) and buf[after] in " \t\r\n":
+                    after += 1
+                complete = after < len(buf) and buf[after] in ",]"
+                if not complete and eof:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buf, after)
+            if not complete:
+                more = f.read(chunk_size)
+                eof = not more
+                # keep only the unparsed tail
+                buf = buf[idx:] + more
+                idx = 0
+                continue
+            yield item
+            idx = end
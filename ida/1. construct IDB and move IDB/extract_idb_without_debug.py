@@ -3,34 +3,62 @@ import os
 import shutil
 import sys
 import time
+import logging
+from functools import partial
+from multiprocessing import cpu_count
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..", "..")))
+from utils.batch import BatchJob, ida_command, run_batch
+from utils.layout import OutputTree
+from artifact_store import file_sha256
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%Y-%m-%d %H:%M:%S'
+                    )
 
 
 DIR_BINARY = 'Binaries_without_debug'
 DIR_IDB = 'IDB_without_debug'
+IDA_FILE = 'ida64' # or 'python <full path to>utils/mock_ida.py' to try without IDA
+IDB_EXT = '.i64'
+PROCESSES = max(1, cpu_count() // 2)
+TIMEOUT = 2 * 60 * 60 # seconds per binary, a hung IDA is killed
+RETRIES = 1
+
 
+# idbs are built straight into {DIR_IDB}/{shard}/{project}/ and listed in {DIR_IDB}/manifest.jsonl,
+# move_idb_to_IDB.py is only needed for trees of older runs
+tree = OutputTree(DIR_IDB)
 
-if not os.path.exists(DIR_IDB):
-    os.mkdir(DIR_IDB)
+
+def commit_idb(project, name, binary_path):
+    # the binary sha256 in the manifest is the stable key of the name_and_addr and pseudo code of the idb
+    tree.commit(project, name, binary=binary_path, binary_sha256=file_sha256(binary_path))
 
 
 start_time = time.time()
 
 projects = os.listdir(DIR_BINARY)
 
-for p in projects:
-    dir_p_idb = os.path.join(DIR_IDB, p)
-
-    if not os.path.exists(dir_p_idb):
-        os.mkdir(dir_p_idb)
+jobs = []
 
+for p in projects:
     p_fs = os.listdir(os.path.join(DIR_BINARY, p))
     for p_f in p_fs:
         # path of elf file
         p_f_path = os.path.join(DIR_BINARY, p, p_f)
+        if tree.has(p, p_f + IDB_EXT):
+            continue # built by an earlier run
+
+        cmd = ida_command(IDA_FILE, p_f_path, batch=True, autonomous=False, output=tree.partial_path(p, p_f + IDB_EXT))
+        jobs.append(BatchJob(p_f_path, cmd, partial(commit_idb, p, p_f + IDB_EXT, p_f_path)))
 
-        print('Disassembling File {}'.format(p_f_path))
-        cmd_disasm = r'ida64 -B {}'.format(p_f_path)
-        os.system(cmd_disasm)
+print('Disassembling {} files'.format(len(jobs)))
+results = run_batch(jobs, concurrency=PROCESSES, timeout=TIMEOUT, retries=RETRIES)
+for p_f_path, result in results.items():
+    if result.status != 'ok':
+        print('Failed File {}: {} (exit code {})'.format(p_f_path, result.status, result.returncode))
 
 
 end_time = time.time()
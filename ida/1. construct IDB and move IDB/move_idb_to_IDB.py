@@ -1,3 +1,4 @@
+# only for idbs written next to the binaries by older runs, extract_idb_*.py now build them into DIR_IDB
 import shutil
 
 import os
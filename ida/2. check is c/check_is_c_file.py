@@ -3,7 +3,11 @@ import os
 import shutil
 import logging
 import sys
-import glob
+from functools import partial
+from multiprocessing import cpu_count
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+from utils.batch import BatchJob, ida_command, run_batch
+from utils.layout import OutputTree, commit_sidecar, has_sidecar, list_artifacts, sidecar_partial_path
 
 
 logging.basicConfig(level=logging.DEBUG,
@@ -15,34 +19,39 @@ logging.basicConfig(level=logging.DEBUG,
 DIR_IDB = r'IDB_with_debug'
 ida_file = 'ida64'
 idb_ext = r'*.i64'
-
-
-def items_dir(rootname):
-    l = []
-    for main_dir, _, file_name_list in os.walk(rootname):
-
-        for f in file_name_list:
-            file_path = os.path.join(main_dir, f)
-            l.append(file_path)
-    return l
-
-
-all_files = items_dir(DIR_IDB)
-
-projects = os.listdir(DIR_IDB)
-
-count_handled_files = 0
-
-for p in projects:
-
-    p_fs = glob.glob(os.path.join(DIR_IDB, p, idb_ext))
-
-    for idb_path in p_fs:
-
-        count_handled_files += 1
-
-
-        # Extracting Function Name
-        logging.info('[{}/{}] Extracting Function Name {}'.format(count_handled_files, len(all_files), idb_path))
-        cmd_gen_code = r'{} -S../../is_c_file_idapython.py {}'.format(ida_file, idb_path)
-        os.system(cmd_gen_code)
+IDAPYTHON_ARG = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'is_c_file_idapython.py') # absolute, idbs sit at different depths in flat and sharded trees
+PROCESSES = max(1, cpu_count() // 2)
+TIMEOUT = 30 * 60 # seconds per idb, a hung IDA is killed
+RETRIES = 1
+OUTPUT_EXTS = ('.type_c', '.type_cplusplus')
+
+idb_tree = OutputTree(DIR_IDB)
+
+
+def commit_outputs(project, idb_path):
+    '''
+    move the type file the script wrote to its partial path next to the idb, and into the manifest
+    '''
+    for ext in OUTPUT_EXTS:
+        commit_sidecar(idb_tree, project, idb_path, ext, idb=idb_path)
+
+
+# from {DIR_IDB}/manifest.jsonl, or {DIR_IDB}/{project}/ of older runs
+idbs = list_artifacts(DIR_IDB, idb_ext)
+
+jobs = []
+
+for p, idb_path in idbs:
+    if any(has_sidecar(idb_tree, p, idb_path, ext) for ext in OUTPUT_EXTS):
+        continue # already checked
+    # the script writes {prefix}.type_c or {prefix}.type_cplusplus
+    prefix = os.path.splitext(sidecar_partial_path(idb_tree, p, idb_path, OUTPUT_EXTS[0]))[0]
+    cmd = ida_command(ida_file, idb_path, script=IDAPYTHON_ARG, script_args=[os.path.abspath(prefix)])
+    jobs.append(BatchJob(idb_path, cmd, partial(commit_outputs, p, idb_path)))
+
+# Checking C or C++
+logging.info('Checking {} idbs'.format(len(jobs)))
+results = run_batch(jobs, concurrency=PROCESSES, timeout=TIMEOUT, retries=RETRIES)
+for idb_path, result in results.items():
+    if result.status != 'ok':
+        logging.error('Error : {} {} (exit code {})'.format(idb_path, result.status, result.returncode))
@@ -21,9 +21,12 @@ for func_name in func_names:
         is_c_file = False
         break
 
+# the driver passes the output prefix (a partial path it commits after the run), else next to the idb
+output_prefix = idc.ARGV[1] if len(idc.ARGV) > 1 else inputFileName
+
 if is_c_file:
-    open('{}.type_c'.format(inputFileName), 'w')
+    open('{}.type_c'.format(output_prefix), 'w').close()
 else:
-    open('{}.type_cplusplus'.format(inputFileName), 'w')
+    open('{}.type_cplusplus'.format(output_prefix), 'w').close()
 
 idc.Exit(0)
@@ -3,7 +3,13 @@ import os
 import shutil
 import logging
 import sys
-import glob
+from functools import partial
+from multiprocessing import cpu_count
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..", "..")))
+from artifact_store import ArtifactStore, file_sha256, fingerprint
+from utils.batch import BatchJob, ida_command, run_batch
+from utils.layout import OutputTree, commit_sidecar, has_sidecar, list_artifacts, sidecar_partial_path
 
 
 logging.basicConfig(level=logging.DEBUG,
@@ -13,38 +19,72 @@ logging.basicConfig(level=logging.DEBUG,
 
 
 DIR_IDB = r'IDB_with_debug'
+DIR_BINARY = r'Binaries_with_debug' # binaries of idbs whose manifest entry has no binary_sha256 (older runs)
 ida_file = 'ida64'
 idb_ext = r'*.i64'
-
-def items_dir(rootname):
-    l = []
-    for main_dir, _, file_name_list in os.walk(rootname):
-
-        for f in file_name_list:
-            file_path = os.path.join(main_dir, f)
-            l.append(file_path)
-    return l
-
-
-all_files = items_dir(DIR_IDB)
-
-projects = os.listdir(DIR_IDB)
+IDAPYTHON_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ext_func_name_and_addr_idapython.py')
+IDAPYTHON_ARG = IDAPYTHON_PATH # absolute, idbs sit at different depths in flat and sharded trees
+PROCESSES = max(1, cpu_count() // 2)
+TIMEOUT = 30 * 60 # seconds per idb, a hung IDA is killed
+RETRIES = 1
+OUTPUT_EXT = '.name_and_addr'
+ARTIFACT_STORE_DIR = 'artifacts' # name_and_addr by (binary sha256, fingerprint of the idapython script), None to disable
+
+store = ArtifactStore(ARTIFACT_STORE_DIR) if ARTIFACT_STORE_DIR is not None else None
+idb_tree = OutputTree(DIR_IDB)
+
+
+def artifact_key(idb_path, project):
+    '''
+    (binary sha256, fingerprint) of an idb, the binary sha256 recorded by stage 1 in the manifest,
+    else hashed from DIR_BINARY. key None if neither exists: ida rewrites the idb on every open,
+    so the hash of the idb itself would never match again and the idb is not cached
+    '''
+    entry = idb_tree.entry_of(idb_path)
+    if entry is not None and 'binary_sha256' in entry:
+        key = entry['binary_sha256']
+    else:
+        binary_path = os.path.join(DIR_BINARY, project, os.path.basename(idb_path)[:-4])
+        key = file_sha256(binary_path) if os.path.exists(binary_path) else None
+    return key, fingerprint(ida_file, file_sha256(IDAPYTHON_PATH))
+
+
+def commit_output(project, idb_path, key=None, fp=None):
+    '''
+    move the name_and_addr the script wrote to its partial path next to the idb, into the manifest
+    and the artifact store. an idb without .text functions exits cleanly and writes nothing
+    '''
+    path = commit_sidecar(idb_tree, project, idb_path, OUTPUT_EXT, idb=idb_path)
+    if path is not None and store is not None and key is not None:
+        store.put('name_and_addr', key, fp, path)
+
+
+# from {DIR_IDB}/manifest.jsonl, or {DIR_IDB}/{project}/ of older runs
+idbs = list_artifacts(DIR_IDB, idb_ext)
 
 count_handled_files = 0
-
-for p in projects:
-
-    p_fs = glob.glob(os.path.join(DIR_IDB, p, idb_ext))
-
-    for idb_path in p_fs:
-
-        count_handled_files += 1
-
-
-        # Extracting Function Name
-        logging.info('[{}/{}] Extracting Function Name {}'.format(count_handled_files, len(all_files), idb_path))
-        cmd_gen_code = r'{} -S../../ext_func_name_and_addr_idapython.py {}'.format(ida_file, idb_path)
-        try:
-            os.system(cmd_gen_code)
-        except Exception as e:
-            logging.error('Error : {}'.format(idb_path))
+jobs = []
+
+for p, idb_path in idbs:
+
+    count_handled_files += 1
+    if has_sidecar(idb_tree, p, idb_path, OUTPUT_EXT):
+        continue # committed by an earlier run, a torn partial file is never committed
+    # the script writes {prefix}.name_and_addr, committed once ida exits cleanly
+    partial_path = sidecar_partial_path(idb_tree, p, idb_path, OUTPUT_EXT)
+    key, fp = artifact_key(idb_path, p) if store is not None else (None, None)
+    if key is not None and store.fetch('name_and_addr', key, fp, partial_path):
+        commit_sidecar(idb_tree, p, idb_path, OUTPUT_EXT, idb=idb_path, cached=True)
+        logging.info('[{}/{}] Up to date {}'.format(count_handled_files, len(idbs), idb_path))
+        continue
+
+    prefix = os.path.abspath(partial_path[:-len(OUTPUT_EXT)])
+    cmd = ida_command(ida_file, idb_path, script=IDAPYTHON_ARG, script_args=[prefix])
+    jobs.append(BatchJob(idb_path, cmd, partial(commit_output, p, idb_path, key, fp)))
+
+# Extracting Function Name
+logging.info('Extracting Function Name of {} idbs'.format(len(jobs)))
+results = run_batch(jobs, concurrency=PROCESSES, timeout=TIMEOUT, retries=RETRIES)
+for idb_path, result in results.items():
+    if result.status != 'ok':
+        logging.error('Error : {} {} (exit code {})'.format(idb_path, result.status, result.returncode))
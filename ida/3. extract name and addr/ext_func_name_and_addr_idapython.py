@@ -16,6 +16,10 @@ methods = dict()
 for func in text_segment.functions:
     methods[func.demangled] = [func.startEA, func.endEA]
 
-pickle.dump(methods, open('{}.name_and_addr'.format(inputFileName), 'wb'), protocol=2)
+# the driver passes the output prefix (a partial path it commits after the run), else next to the idb
+output_prefix = idc.ARGV[1] if len(idc.ARGV) > 1 else inputFileName
+
+with open('{}.name_and_addr'.format(output_prefix), 'wb') as f:
+    pickle.dump(methods, f, protocol=2)
 
 idc.Exit(0)
@@ -0,0 +1,63 @@
+from __future__ import print_function
+import os
+import sys
+import idc
+import ida_nalt
+import ida_pro
+import sark
+
+from ida_hexrays import decompile, DecompilationFailure
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+from utils.records import RecordWriter
+
+
+# stages 2 (is_c_file), 3 (name_and_addr) and 4 (pseudo code) in one database open,
+# the result is one record file instead of .type_c / .name_and_addr / .pseudo_code_c side files:
+# meta {'file_type': 'C' or 'C++', 'name_and_addr': {name: [start, end]}} and a record per method,
+# written to {prefix}.pseudo_code_c or {prefix}.pseudo_code_cplusplus, read it with utils.pseudo_code,
+# prefix: the script argument of the driver (a partial path in its output tree), else the input name
+
+inputFileName = ida_nalt.get_root_filename()
+output_prefix = idc.ARGV[1] if len(idc.ARGV) > 1 else inputFileName
+
+text_segment = sark.Segment(name='.text')
+funcs = list(text_segment.functions)
+if len(funcs) == 0:
+    ida_pro.qexit(0)
+
+# stage 3: demangled name -> [start, end]
+name_and_addr = dict()
+for func in funcs:
+    name_and_addr[func.demangled] = [func.start_ea, func.end_ea]
+
+# stage 2: C++ if any name looks like a method or has a signature
+is_c_file = True
+for func_name in name_and_addr.keys():
+    if '::' in func_name or '(' in func_name:
+        is_c_file = False
+        break
+file_type = 'C' if is_c_file else 'C++'
+
+# stage 4: (start_ea, end_ea) -> function name, sub_* functions are never extracted
+func_index = dict(
+    ((addr[0], addr[1]), name) for name, addr in name_and_addr.items() if not name.startswith('sub_')
+    )
+
+ext = 'pseudo_code_c' if file_type == 'C' else 'pseudo_code_cplusplus'
+output = RecordWriter('{}.{}'.format(output_prefix, ext), meta={'file_type': file_type, 'name_and_addr': name_and_addr})
+
+for (start_ea, end_ea), func_name in sorted(func_index.items()):
+    if start_ea in output.addresses:
+        continue
+
+    try:
+        pseudo_code = str(decompile(start_ea))
+        pseudo_code = "\n".join([line.strip() for line in pseudo_code.split('\n') if line != ""])
+    except DecompilationFailure:
+        continue
+
+    output.write(func_name, start_ea, end_ea, pseudo_code)
+
+output.close()
+
+ida_pro.qexit(0)
@@ -3,9 +3,14 @@ import os
 import shutil
 import logging
 import sys
-import glob
 import time
-from multiprocessing import Pool, Queue, Process, cpu_count
+from functools import partial
+from multiprocessing import cpu_count
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..", "..")))
+from artifact_store import ArtifactStore, file_sha256, fingerprint
+from utils.batch import BatchJob, ida_command, run_batch
+from utils.layout import OutputTree, list_artifacts
 
 
 logging.basicConfig(level=logging.DEBUG,
@@ -20,78 +25,93 @@ IDB_EXT = r'*.idb'
 PSEUDO_CODE_EXT = ".pseudo_code_c"
 IDA_FILE = 'ida'
 IDAPYTHON_PATH = "<full path to>ext_pseudo_code_idapython.py"
-
-
-if not os.path.exists(DIR_CODE):
-    os.mkdir(DIR_CODE)
-
-def process(p_fs, process_id=0):
-    count_handled_files = 0
-    for idb_path in p_fs:
-        count_handled_files += 1
-        # Extracting Function Name
-        logging.debug('[t{}]{}/{} Extracting {}'.format(\
-            process_id, count_handled_files, len(p_fs), idb_path))
-        cmd_gen_code = r'{} -A -S{} {}'.format(IDA_FILE, IDAPYTHON_PATH, idb_path)
-        os.system(cmd_gen_code)
-
-def process_queue(file_queue, process_id=0):
-    while not file_queue.empty():
-        idb_file = file_queue.get()
-        remain_count = file_queue.qsize()
-        # Extracting Function Name
-        logging.debug('[t{}]remain {} Extracting {}'.format(process_id, remain_count, idb_file))
-        cmd_gen_code = r'{} -A -S{} {}'.format(IDA_FILE, IDAPYTHON_PATH, idb_file)
-        os.system(cmd_gen_code)
-
-def split_list(alist, wanted_parts):
-    length = len(alist)
-    return [ alist[i*length // wanted_parts: (i+1)*length // wanted_parts] for i in range(wanted_parts) ]
-
-def multi_process(files):
-    threads = cpu_count()//2
-    filelists = split_list(list(files), threads)
-    pool = Pool(threads)
-    for idx, filelist in enumerate(filelists):
-        pool.apply_async(process, (filelist,idx,))
-    pool.close()
-    pool.join()
-
-def multi_process_queue(files):
-    threads = cpu_count()//2
-    queue = Queue()
-    for f in files:
-        queue.put(f)
-    processes = [Process(target=process_queue, args=(queue, i)) for i in range(threads)]
-    for p in processes:
-        p.start()
-    for p in processes:
-        p.join()
+FUSED_IDAPYTHON_PATH = "<full path to>ext_fused_idapython.py"
+FUSED = False # True: classify, collect name/addr and decompile in one ida run, stages 2 and 3 are not needed
+DIR_BINARY = 'i386_binary' # original binaries (project/name) of idbs whose manifest entry has no binary_sha256 (older runs)
+ARTIFACT_STORE_DIR = 'artifacts' # pseudo code by (binary sha256, fingerprint of the idapython script), None to disable
+OUTPUT_EXTS = ('.pseudo_code_c', '.pseudo_code_cplusplus')
+PROCESSES = max(1, cpu_count() // 2)
+TIMEOUT = 2 * 60 * 60 # seconds per idb, a hung decompilation is killed
+RETRIES = 1
+
+
+tree = OutputTree(DIR_CODE)
+idb_tree = OutputTree(DIR_IDB)
+store = ArtifactStore(ARTIFACT_STORE_DIR) if ARTIFACT_STORE_DIR is not None else None
+
+
+def idapython_script():
+    return FUSED_IDAPYTHON_PATH if FUSED else IDAPYTHON_PATH
+
+
+def artifact_key(idb_path):
+    '''
+    (binary sha256, fingerprint) of an idb, the binary sha256 recorded by stage 1 in the manifest,
+    else hashed from DIR_BINARY, key None if neither exists (the idb itself changes on every ida run).
+    the fingerprint covers the idapython script and the name_and_addr file it reads (none in FUSED mode)
+    '''
+    entry = idb_tree.entry_of(idb_path)
+    if entry is not None and 'binary_sha256' in entry:
+        key = entry['binary_sha256']
+    else:
+        project = os.path.basename(os.path.dirname(idb_path))
+        binary_path = os.path.join(DIR_BINARY, project, os.path.basename(idb_path)[:-4])
+        key = file_sha256(binary_path) if os.path.exists(binary_path) else None
+    name_and_addr = idb_path[:-4] + '.name_and_addr'
+    fp = fingerprint(IDA_FILE, file_sha256(idapython_script()),
+                     file_sha256(name_and_addr) if not FUSED and os.path.exists(name_and_addr) else None)
+    return key, fp
+
+
+def fetch_artifact(project, name, key, fp):
+    for ext in OUTPUT_EXTS:
+        if store.fetch(ext[1:], key, fp, tree.partial_path(project, name + ext)):
+            tree.commit(project, name + ext, cached=True)
+            return True
+    return False
+
+
+def commit_outputs(project, name, idb_path, key=None, fp=None):
+    '''
+    move what the script wrote to its partial path into place, into the manifest and the artifact store
+    '''
+    for ext in OUTPUT_EXTS:
+        path = tree.commit(project, name + ext, idb=idb_path)
+        if path is not None and store is not None and key is not None:
+            store.put(ext[1:], key, fp, path)
+
+
+def make_job(project, idb_path, key=None, fp=None):
+    name = os.path.basename(idb_path)[:-4]
+    # the script writes {prefix}.pseudo_code_c or {prefix}.pseudo_code_cplusplus
+    prefix = os.path.splitext(tree.partial_path(project, name + OUTPUT_EXTS[0]))[0]
+    cmd = ida_command(IDA_FILE, idb_path, script=idapython_script(), script_args=[os.path.abspath(prefix)])
+    return BatchJob(idb_path, cmd, partial(commit_outputs, project, name, idb_path, key, fp))
 
 
 if __name__ == '__main__':
     start_time = time.time()
 
-    projects = os.listdir(DIR_IDB)
-
     all_p_fs = []
 
-    for p in projects:
-        dir_p_mname = os.path.join(DIR_CODE, p)
-
-        if not os.path.exists(dir_p_mname):
-            os.mkdir(dir_p_mname)
-        for f in glob.glob(os.path.join(DIR_IDB, p, IDB_EXT)):
-            if os.path.exists(f[:-4]+PSEUDO_CODE_EXT) \
-                and os.path.getsize(f[:-4]+PSEUDO_CODE_EXT)!=0: 
-                continue # skip if already generated
-            all_p_fs.append(f)
-
-    # single process
-    # process(all_p_fs)
-
-    # multi process
-    multi_process_queue(all_p_fs)
+    # idbs from {DIR_IDB}/manifest.jsonl (or {DIR_IDB}/{project}/ of older runs),
+    # pseudo code goes to {DIR_CODE}/{shard}/{project}/ and {DIR_CODE}/manifest.jsonl, nothing to move afterwards
+    for p, f in list_artifacts(DIR_IDB, IDB_EXT):
+        name = os.path.basename(f)[:-4]
+        if any(tree.has(p, name + ext) for ext in OUTPUT_EXTS):
+            continue # skip if already generated, a crashed run is resumed from its partial file
+        key, fp = artifact_key(f) if store is not None else (None, None)
+        if key is not None:
+            if fetch_artifact(p, name, key, fp):
+                continue # same input and script as an earlier run
+            all_p_fs.append((p, f, key, fp))
+            continue
+        all_p_fs.append((p, f))
+
+    results = run_batch([make_job(*item) for item in all_p_fs], concurrency=PROCESSES, timeout=TIMEOUT, retries=RETRIES)
+    for idb_path, result in results.items():
+        if result.status != 'ok':
+            logging.error('Error : {} {} (exit code {})'.format(idb_path, result.status, result.returncode))
 
     end_time = time.time()
 
@@ -1,18 +1,17 @@
 from __future__ import print_function
 import os
-import sark
-import pickle
+import sys
 import joblib
 import idc
+import ida_funcs
 import ida_nalt
 import ida_pro
 
-from collections import namedtuple
 from ida_hexrays import decompile, DecompilationFailure
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
+from utils.records import RecordWriter
 
 
-InternalMethod = namedtuple('InternalMethod', ['name', 'start_addr', 'end_addr', 'pseudo_code'])
-
 inputFileName = ida_nalt.get_root_filename()
 
 if idc.get_idb_path().endswith('.i64'):
@@ -31,53 +30,43 @@ elif os.path.exists('{}.type_cplusplus'.format(inputFileName)):
 else:
     file_type = 'unknown'
 
-method_dict = joblib.load('{}.name_and_addr'.format(inputFileName))
+name_and_addr = joblib.load('{}.name_and_addr'.format(inputFileName))
 
-# key: startEA_endEA value: function name
-method_dict = dict(
-    [('_'.join(map(lambda x:str(x), item[1])), item[0]) for item in method_dict.items()]
+# (start_ea, end_ea) -> function name, sub_* functions are never extracted
+func_index = dict(
+    ((addr[0], addr[1]), name) for name, addr in name_and_addr.items() if not name.startswith('sub_')
     )
-
-all_segments = [seg.name for seg in sark.segments()]
-if '.plt' in all_segments:
-    plt_segment = sark.Segment(name='.plt')
-    plt_funcs = plt_segment.functions
-    # replace "." to "_"
-    plt_funcs_name = [plt_func.name.replace('.', '_') for plt_func in plt_funcs]
-else:
-    plt_funcs_name = []
-
-text_segment = sark.Segment(name='.text')
-if len(list(text_segment.functions)) == 0:
+if len(func_index) == 0 or file_type == 'unknown':
     ida_pro.qexit(0)
 
-# get functions with unknown names
-funcs = list(text_segment.functions)
-#funcs = list(filter(lambda x: not x.has_name, funcs))
+# the driver passes the output prefix (a partial path in its output tree), else next to the idb
+output_prefix = idc.ARGV[1] if len(idc.ARGV) > 1 else inputFileName
+if file_type == 'C':
+    output_path = '{}.pseudo_code_c'.format(output_prefix)
+else:
+    output_path = '{}.pseudo_code_cplusplus'.format(output_prefix)
 
-methods = {}
+# one record per function, appended as it is decompiled: a crashed run keeps what it wrote
+# and the next run skips those functions, read it with utils.pseudo_code.iter_methods
+output = RecordWriter(output_path, meta={'file_type': file_type})
 
-for func in funcs:
-    if '{}_{}'.format(func.start_ea, func.end_ea) not in method_dict.keys():
+for (start_ea, end_ea), func_name in sorted(func_index.items()):
+    if start_ea in output.addresses:
         continue
 
-    func_name = method_dict['{}_{}'.format(func.start_ea, func.end_ea)]
-
-    if func_name.startswith('sub_'):
+    func = ida_funcs.get_func(start_ea)
+    if func is None or func.start_ea != start_ea or func.end_ea != end_ea:
         continue
-        
+
     try:
-        pseudo_code = str(decompile(func.ea))
+        pseudo_code = str(decompile(start_ea))
         pseudo_code = "\n".join([line.strip() for line in pseudo_code.split('\n') if line != ""])
     except DecompilationFailure:
         continue
 
-    methods[func_name] = InternalMethod(name=func_name, start_addr=func.start_ea, end_addr=func.end_ea, pseudo_code=pseudo_code)
+    output.write(func_name, start_ea, end_ea, pseudo_code)
 
-if file_type == 'C':
-    pickle.dump(methods, open('{}.pseudo_code_c'.format(inputFileName), 'wb'), protocol=2)
-if file_type == 'C++':
-    pickle.dump(methods, open('{}.pseudo_code_cplusplus'.format(inputFileName), 'wb'), protocol=2)
+output.close()
 
 
-ida_pro.qexit(0)
\ No newline at end of file
+ida_pro.qexit(0)
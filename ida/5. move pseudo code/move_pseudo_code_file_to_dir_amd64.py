@@ -1,3 +1,4 @@
+# only for pseudo code written next to the idbs by older runs, ext_pseudo_code_*.py now write into DIR_CODE
 import shutil
 import os
 import sys
@@ -1,120 +1,133 @@
+import io
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..")))
-import joblib
-import random
+sys.path.append(os.path.abspath(os.path.join(os.path.realpath(__file__), "..", "..", "..")))
 import sentencepiece as spm
-from utils.utils import split_func_name, split_sentence_piece, merge_suffix, md5
-from utils.lexer import tokenize_raw_code
+from utils.utils import NameSplitter, load_lexicon
+from utils.corpus import dedup_and_split
+from utils.minhash import near_dedup
+from utils.lexer import iter_tokens_hexray, write_tokens, LEXER_ENGINE
+from artifact_store import ArtifactStore, file_sha256, fingerprint
+from utils.pseudo_code import iter_methods
+from utils.layout import list_artifacts
 from collections import namedtuple
-from nltk.corpus import words
-from glob import glob
+from multiprocessing import Pool
 
 
 DIR_CODE = 'i386_pseudo_code'
 CODE_EXT = '*.pseudo_code_c'
 TRAIN,VALID,TEST = 0.8,0.1,0.1
+GROUP_BY = 'project' # split by 'project', 'binary' or 'function', rows of one group stay in one split
+SPLIT_SEED = 233
+MAX_ROWS_IN_MEMORY = 20000000 # unique row hashes kept in memory, more rows are deduped in buckets on disk
+NEAR_DUP_THRESHOLD = 0.8 # estimated jaccard of token 5-grams, None to skip near duplicate removal
+PROCESSES = 1 # >1 to tokenize files in a process pool, output is identical to a serial run
+ARTIFACT_STORE_DIR = 'artifacts' # tokenized rows by (pseudo code file sha256, fingerprint of the tokenizer), None to disable
+CORPUS_VERSION = 1 # bump when process_file output changes
+MAX_TOKENS = None # keep the first words of a function (onmt -src_seq_length 3000), lexing stops there, None to keep all
 
 
 InternalMethod = namedtuple('InternalMethod', ['name', 'start_addr', 'end_addr', 'pseudo_code'])
 sp = spm.SentencePieceProcessor()
 sp.load(os.path.join('model', 'sentencepiece.model'))
-vocab = words.words()
-
-files = []
-projects = os.listdir(DIR_CODE)
-for p in projects:
-    dir_p_mname = os.path.join(DIR_CODE, p)
-    files.extend(glob(os.path.join(DIR_CODE, p, CODE_EXT)))
-
-
-def my_split_func_name(name):
-    return merge_suffix(split_sentence_piece(sp, split_func_name(name)), vocab)
-
-
-for idx, file in enumerate(files):
+vocab = load_lexicon(os.path.join('model', 'lexicon.pkl'))
+my_split_func_name = NameSplitter(sp, vocab, cache_path=os.path.join('model', 'name_split_cache.pkl'))
+store = ArtifactStore(ARTIFACT_STORE_DIR) if ARTIFACT_STORE_DIR is not None else None
+rows_fingerprint = fingerprint(CORPUS_VERSION, LEXER_ENGINE, MAX_TOKENS, file_sha256(os.path.join('model', 'sentencepiece.model')),
+                               file_sha256(os.path.join('model', 'lexicon.pkl')))
+
+
+def list_files():
+    # from {DIR_CODE}/manifest.jsonl, or {DIR_CODE}/{project}/ of older runs
+    return [path for _, path in list_artifacts(DIR_CODE, CODE_EXT)]
+
+
+def process_file(file):
+    '''
+    tokenize all methods of one pseudo code file, pure per-file work so it can run in a pool worker,
+    workers import this module and load the sentencepiece model once each.
+    return (method_names, method_bodies, error), methods before an error are kept
+    '''
+    if store is not None:
+        key = file_sha256(file)
+        rows = store.load('corpus_rows', key, rows_fingerprint)
+        if rows is not None:
+            return rows[0], rows[1], None
     method_names = []
     method_bodies = []
-    # method_library_funcs = []
-    if idx % 1 == 0:
-        print("{}/{}, {}".format(idx, len(files), file))
-
+    error = None
     try:
-        methods = joblib.load(file)
-
-        for m in methods.values():
+        for m in iter_methods(file):
             pseudo_code = m.pseudo_code
             if m.name in pseudo_code:  # erase func name in pseudo code
                 pseudo_code = pseudo_code.replace(m.name, "sub_0")
             # add item into dataset
             body = "\n".join([line.strip() for line in pseudo_code.split('\n') if line != ""])
-            body_token_list = tokenize_raw_code(body, my_split_func_name)
+            # tokens are written into the row as they are lexed, no token list
+            buf = io.StringIO()
+            write_tokens(buf, iter_tokens_hexray(body, my_split_func_name, max_tokens=MAX_TOKENS))
             method_names.append(my_split_func_name(m.name))
-            method_bodies.append(body_token_list)
+            method_bodies.append(buf.getvalue())
     except Exception as e:
-        os.system('echo "{} {}" >> {}-error.txt'.format(file, str(e), DIR_CODE))
+        error = str(e)
 
     method_names = list(map(lambda x: ' '.join(x), method_names))
-    method_bodies = list(map(lambda x: ' '.join(x), method_bodies))
 
     method_names = list(map(lambda x: x.replace('\r', ''), method_names))
     method_bodies = list(map(lambda x: x.replace('\r', ''), method_bodies))
 
     assert len(method_names) == len(method_bodies)
-
-    with open('i386-src-all.txt', 'a+', encoding='utf-8') as f:
-        f.write('\n'.join(method_bodies))
-        f.write("\n")
-    with open('i386-tgt-all.txt', 'a+', encoding='utf-8') as f:
-        f.write('\n'.join(method_names))
-        f.write("\n")
-
-# read out
-input("type any key to continue, distinct data, may need huge memory.")
-with open('i386-src-all.txt', 'r', encoding='utf-8') as f:
-    method_bodies = f.readlines()
-with open('i386-tgt-all.txt', 'r', encoding='utf-8') as f:
-    method_names = f.readlines()
-count = len(method_names)
-print('Original count: ', count)
-
-
-# distinct
-method_hashes = [md5('|'.join(mn)) for mn in zip(method_names, method_bodies)]
-
-hash_index_map = dict(zip(method_hashes, range(len(method_hashes))))
-
-distincted_method_names = []
-distincted_method_bodies = []
-
-for v in hash_index_map.values():
-    distincted_method_names.append(method_names[v])
-    distincted_method_bodies.append(method_bodies[v])
-count = len(distincted_method_names)
-print('Distinct: ', count)
-
-
-# shuffle and save to files
-random.seed(233)
-random.shuffle(distincted_method_names)
-random.seed(233)
-random.shuffle(distincted_method_bodies)
-train,valid = int(TRAIN*count), int(TRAIN*count)+int(VALID*count)
-with open("i386-tgt-train.txt", "w", encoding="utf-8") as f:
-    for i in range(train):
-        f.write(distincted_method_names[i])
-with open("i386-src-train.txt", "w", encoding="utf-8") as f:
-    for i in range(train):
-        f.write(distincted_method_bodies[i])
-with open("i386-tgt-valid.txt", "w", encoding="utf-8") as f:
-    for i in range(train, valid):
-        f.write(distincted_method_names[i])
-with open("i386-src-valid.txt", "w", encoding="utf-8") as f:
-    for i in range(train, valid):
-        f.write(distincted_method_bodies[i])
-with open("i386-tgt-test.txt", "w", encoding="utf-8") as f:
-    for i in range(valid, count):
-        f.write(distincted_method_names[i])
-with open("i386-src-test.txt", "w", encoding="utf-8") as f:
-    for i in range(valid, count):
-        f.write(distincted_method_bodies[i])
+    if store is not None and error is None:
+        store.dump('corpus_rows', key, rows_fingerprint, (method_names, method_bodies))
+    return method_names, method_bodies, error
+
+
+def generate_all(files, processes=PROCESSES):
+    if processes > 1:
+        pool = Pool(processes=processes)
+        # imap yields in file order, whichever worker finishes first
+        results = pool.imap(process_file, files)
+    else:
+        pool = None
+        results = map(process_file, files)
+
+    # written from scratch on every run and renamed into place at the end,
+    # so a rerun never appends the corpus twice and the three files always match
+    all_paths = ['i386-src-all.txt', 'i386-tgt-all.txt', 'i386-key-all.txt']
+    with open(all_paths[0] + '.tmp', 'w', encoding='utf-8') as f_src, \
+            open(all_paths[1] + '.tmp', 'w', encoding='utf-8') as f_tgt, \
+            open(all_paths[2] + '.tmp', 'w', encoding='utf-8') as f_key:
+        for idx, (file, (method_names, method_bodies, error)) in enumerate(zip(files, results)):
+            print("{}/{}, {}".format(idx, len(files), file))
+            if error is not None:
+                os.system('echo "{} {}" >> {}-error.txt'.format(file, error, DIR_CODE))
+
+            f_src.write('\n'.join(method_bodies))
+            f_src.write("\n")
+            f_tgt.write('\n'.join(method_names))
+            f_tgt.write("\n")
+            # "project\tbinary" per row, DIR_CODE/<project>/<binary>, one line even for an empty file
+            key = '{}\t{}'.format(os.path.basename(os.path.dirname(file)), os.path.basename(file))
+            f_key.write('\n'.join([key] * max(1, len(method_names))))
+            f_key.write("\n")
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for path in all_paths:
+        os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    generate_all(list_files())
+    # in pool mode the workers split the names, their caches are not written back
+    my_split_func_name.save()
+
+    # distinct and split, streamed, no need to hold the corpus in memory
+    dedup_and_split('i386-src-all.txt', 'i386-tgt-all.txt', 'i386', ratios=(TRAIN, VALID, TEST),
+                    max_rows_in_memory=MAX_ROWS_IN_MEMORY, key_path='i386-key-all.txt',
+                    group_by=GROUP_BY, seed=SPLIT_SEED)
+    # near duplicates of a train function are dropped from valid/test, see i386-near-dup.txt
+    if NEAR_DUP_THRESHOLD is not None:
+        near_dedup('i386', threshold=NEAR_DUP_THRESHOLD, processes=PROCESSES)
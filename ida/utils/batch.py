@@ -0,0 +1,136 @@
+'''
+headless IDA batch driver shared by the IDA stages:
+run a list of command lines with a fixed number of concurrent processes, kill a job after a
+wall-clock timeout, keep exit codes, retry failed jobs, and log progress and throughput.
+ida may be a command string, e.g. 'python utils/mock_ida.py' to try a stage without IDA
+'''
+from __future__ import print_function, division
+import os
+import time
+import shlex
+import logging
+import subprocess
+from collections import namedtuple, deque, Counter
+
+
+# on_success: optional callable run in the driver process after the job exits with 0
+BatchJob = namedtuple('BatchJob', ['name', 'cmd', 'on_success'])
+BatchJob.__new__.__defaults__ = (None,)
+# status: 'ok', 'failed' (non zero exit code) or 'timeout'
+BatchResult = namedtuple('BatchResult', ['status', 'returncode', 'seconds', 'attempts'])
+
+
+def split_command(ida, posix=None):
+    '''
+    argv of a command string. an existing file is one executable even with spaces in its path,
+    on windows backslashes are kept (posix=False) and quotes around an argument are dropped
+    '''
+    if os.path.isfile(ida):
+        return [ida]
+    if posix is None:
+        posix = os.name != 'nt'
+    if posix:
+        return shlex.split(ida)
+    return [arg[1:-1] if len(arg) > 1 and arg[0] == arg[-1] == '"' else arg
+            for arg in shlex.split(ida, posix=False)]
+
+
+def ida_command(ida, target, script=None, script_args=(), batch=False, autonomous=True, output=None):
+    '''
+    argv of an IDA run: "ida -B target" or "ida -A -S"script args" target",
+    output: database path (-o), e.g. to build the idb straight into an output tree
+    '''
+    cmd = split_command(ida) if isinstance(ida, str) else list(ida)
+    if batch:
+        cmd.append('-B')
+    if autonomous:
+        cmd.append('-A')
+    if output is not None:
+        cmd.append('-o' + output)
+    if script is not None:
+        args = ['"{}"'.format(arg) if ' ' in arg else arg for arg in [script] + list(script_args)]
+        cmd.append('-S' + ' '.join(args))
+    cmd.append(target)
+    return cmd
+
+
+def _report(results, total, running, start):
+    elapsed = time.time() - start
+    done = len(results)
+    counts = Counter(result.status for result in results.values())
+    rate = done / elapsed * 60 if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else float('inf')
+    logging.info('[batch] {}/{} done (ok {}, failed {}, timeout {}), {} running, {:.1f} jobs/min, eta {:.0f} min'.format(
+        done, total, counts['ok'], counts['failed'], counts['timeout'], running, rate, eta))
+
+
+def run_batch(jobs, concurrency=1, timeout=None, retries=0, poll=0.2, report_every=60, log_dir=None):
+    '''
+    run every BatchJob, at most concurrency at once; a job still running after timeout seconds is killed.
+    failed and timed out jobs are queued again up to retries times.
+    stdout/stderr of a job go to {log_dir}/{name}.log if log_dir is set, else they are dropped.
+    return {name: BatchResult}
+    '''
+    jobs = list(jobs)
+    pending = deque(jobs)
+    running = {}
+    attempts = Counter()
+    results = {}
+    start = last_report = time.time()
+    if log_dir is not None and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    while pending or running:
+        while pending and len(running) < concurrency:
+            job = pending.popleft()
+            attempts[job.name] += 1
+            if log_dir is not None:
+                out = open(os.path.join(log_dir, '{}.log'.format(os.path.basename(job.name))), 'ab')
+            else:
+                out = subprocess.DEVNULL
+            try:
+                proc = subprocess.Popen(job.cmd, stdout=out, stderr=subprocess.STDOUT)
+            except OSError as e:
+                # executable not found and the like, retrying will not help
+                logging.error('[batch] cannot start {}: {}'.format(job.name, e))
+                results[job.name] = BatchResult('failed', None, 0.0, attempts[job.name])
+                if out is not subprocess.DEVNULL:
+                    out.close()
+                continue
+            logging.debug('[batch] start {} (attempt {})'.format(job.name, attempts[job.name]))
+            running[job.name] = (job, proc, time.time(), out)
+
+        time.sleep(poll)
+        for name, (job, proc, job_start, out) in list(running.items()):
+            returncode = proc.poll()
+            elapsed = time.time() - job_start
+            if returncode is None:
+                if timeout is None or elapsed < timeout:
+                    continue
+                proc.kill()
+                returncode = proc.wait()
+                status = 'timeout'
+            else:
+                status = 'ok' if returncode == 0 else 'failed'
+            if out is not subprocess.DEVNULL:
+                out.close()
+            del running[name]
+
+            if status != 'ok' and attempts[name] <= retries:
+                logging.warning('[batch] {} {} (exit code {}), retry'.format(name, status, returncode))
+                pending.append(job)
+                continue
+            results[name] = BatchResult(status, returncode, round(elapsed, 3), attempts[name])
+            if status == 'ok':
+                logging.debug('[batch] done {} in {:.1f}s'.format(name, elapsed))
+                if job.on_success is not None:
+                    job.on_success()
+            else:
+                logging.error('[batch] {} {} (exit code {})'.format(name, status, returncode))
+
+        if time.time() - last_report >= report_every:
+            _report(results, len(jobs), len(running), start)
+            last_report = time.time()
+
+    _report(results, len(jobs), 0, start)
+    return results
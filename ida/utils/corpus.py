@@ -0,0 +1,188 @@
+'''
+dedup and train/valid/test split of the src/tgt "-all" corpus files,
+streamed so that corpora larger than memory can be processed unattended
+'''
+from __future__ import print_function, division
+import os
+import math
+import shutil
+import hashlib
+import tempfile
+from contextlib import ExitStack
+
+import numpy as np
+
+
+SPLITS = ('train', 'valid', 'test')
+
+
+def row_hash(name, body, digest_size=8):
+    '''
+    hash of a (name, body) row as an int, 8 bytes (64 bit) or 16 bytes (128 bit)
+    '''
+    m = hashlib.blake2b(digest_size=digest_size)
+    m.update(bytes(name, encoding='utf-8'))
+    m.update(b'|')
+    m.update(bytes(body, encoding='utf-8'))
+    return int.from_bytes(m.digest(), 'big')
+
+
+def split_of(key, seed=233, ratios=(0.8, 0.1, 0.1)):
+    '''
+    split name for a grouping key (project, binary or function), a stable hash of seed and key.
+    rows with the same key always land in the same split, no matter which shard or run sees them,
+    so adding new binaries never moves existing rows.
+    '''
+    m = hashlib.blake2b(digest_size=8)
+    m.update(bytes('{}:{}'.format(seed, key), encoding='utf-8'))
+    x = int.from_bytes(m.digest(), 'big') / 2 ** 64
+    for split, ratio in zip(SPLITS, ratios):
+        if x < ratio:
+            return split
+        x -= ratio
+    return SPLITS[-1]
+
+
+class DigestSet:
+    '''
+    set of row hashes in a sorted numpy array, 8 bytes per hash instead of ~70 for an int in a set.
+    new hashes wait in a small set and are merged into the array batch_size at a time
+    '''
+    def __init__(self, digest_size=8, batch_size=1 << 18):
+        # uint64 for 64 bit hashes, fixed width bytes (big endian, so they sort like the ints) above
+        self.digest_size = digest_size
+        self.dtype = np.uint64 if digest_size == 8 else 'S{}'.format(digest_size)
+        self.batch_size = batch_size
+        self.sorted = np.empty(0, dtype=self.dtype)
+        self.pending = set()
+
+    def _key(self, h):
+        return h if self.digest_size == 8 else h.to_bytes(self.digest_size, 'big')
+
+    def __contains__(self, h):
+        key = self._key(h)
+        if key in self.pending:
+            return True
+        key = np.asarray(key, dtype=self.dtype)
+        i = np.searchsorted(self.sorted, key)
+        return bool(i < len(self.sorted) and self.sorted[i] == key)
+
+    def add(self, h):
+        if h in self:
+            return
+        self.pending.add(self._key(h))
+        if len(self.pending) >= self.batch_size:
+            self.merge()
+
+    def merge(self):
+        if not self.pending:
+            return
+        batch = np.asarray(list(self.pending), dtype=self.dtype)
+        self.pending = set()
+        self.sorted = np.concatenate([self.sorted, batch])
+        self.sorted.sort(kind='stable') # timsort, the array is two sorted runs after the first merge
+
+    def __len__(self):
+        return len(self.sorted) + len(self.pending)
+
+
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+
+
+def group_key(key, group_by, h):
+    '''
+    key line is "project\tbinary", see generate_pseudo_code_corpus_*
+    '''
+    if group_by == 'project':
+        return key.split('\t')[0]
+    if group_by == 'binary':
+        return key.replace('\t', '/')
+    if group_by == 'function':
+        return '{:x}'.format(h)
+    raise ValueError('unknown group_by {}'.format(group_by))
+
+
+def iter_rows(src_path, tgt_path, key_path=None):
+    '''
+    yield (tgt line, src line, key) of parallel files, line endings kept,
+    key is '' without a key file
+    '''
+    with ExitStack() as stack:
+        src_f = stack.enter_context(open(src_path, 'r', encoding='utf-8'))
+        others = [stack.enter_context(open(path, 'r', encoding='utf-8')) for path in (tgt_path, key_path) if path]
+        for body in src_f:
+            lines = [f.readline() for f in others]
+            if '' in lines:
+                raise ValueError('{} has more lines than {}'.format(src_path, tgt_path if lines[0] == '' else key_path))
+            name = lines[0]
+            key = lines[1].rstrip('\n') if key_path else ''
+            # the last line may miss its newline
+            yield name if name.endswith('\n') else name + '\n', body if body.endswith('\n') else body + '\n', key
+        for f in others:
+            if f.readline() != '':
+                raise ValueError('{} has more lines than {}'.format(f.name, src_path))
+
+
+def dedup_and_split(src_path, tgt_path, prefix, ratios=(0.8, 0.1, 0.1), max_rows_in_memory=20000000,
+                    digest_size=8, key_path=None, group_by='function', seed=233, tmp_dir=None):
+    '''
+    drop duplicated (name, body) rows and write {prefix}-src-{split}.txt / {prefix}-tgt-{split}.txt.
+    only hashes of unique rows are kept in memory; if there are more rows than max_rows_in_memory,
+    rows are first partitioned by hash into bucket files on disk, then every bucket is deduped alone.
+    the split of a row is split_of(group key), group_by 'project' and 'binary' read the key file,
+    so functions of one project/binary never leak across splits; the first copy of a duplicate wins.
+    return {split: rows written}
+    '''
+    if group_by != 'function' and not key_path:
+        raise ValueError('group_by {} needs a key file'.format(group_by))
+    buckets = max(1, int(math.ceil(count_lines(tgt_path) / max_rows_in_memory)))
+    counts = dict((split, 0) for split in SPLITS)
+    total = 0
+
+    with ExitStack() as stack:
+        outputs = {}
+        for split in SPLITS:
+            outputs[split] = (stack.enter_context(open('{}-src-{}.txt'.format(prefix, split), 'w', encoding='utf-8')),
+                              stack.enter_context(open('{}-tgt-{}.txt'.format(prefix, split), 'w', encoding='utf-8')))
+
+        def write_unique(rows):
+            seen = DigestSet(digest_size)
+            for name, body, key in rows:
+                h = row_hash(name, body, digest_size)
+                if h in seen:
+                    continue
+                seen.add(h)
+                split = split_of(group_key(key, group_by, h), seed, ratios)
+                outputs[split][0].write(body)
+                outputs[split][1].write(name)
+                counts[split] += 1
+
+        def counted(rows):
+            nonlocal total
+            for row in rows:
+                total += 1
+                yield row
+
+        if buckets == 1:
+            write_unique(counted(iter_rows(src_path, tgt_path, key_path)))
+        else:
+            bucket_dir = tempfile.mkdtemp(prefix='{}-dedup-'.format(prefix), dir=tmp_dir)
+            try:
+                with ExitStack() as bucket_stack:
+                    bucket_files = [[bucket_stack.enter_context(open(os.path.join(bucket_dir, '{}.{}'.format(i, ext)), 'w', encoding='utf-8'))
+                                     for ext in ('src', 'tgt', 'key')] for i in range(buckets)]
+                    for name, body, key in counted(iter_rows(src_path, tgt_path, key_path)):
+                        src_f, tgt_f, key_f = bucket_files[row_hash(name, body, digest_size) % buckets]
+                        src_f.write(body)
+                        tgt_f.write(name)
+                        key_f.write(key + '\n')
+                for i in range(buckets):
+                    write_unique(iter_rows(*[os.path.join(bucket_dir, '{}.{}'.format(i, ext)) for ext in ('src', 'tgt', 'key')]))
+            finally:
+                shutil.rmtree(bucket_dir, ignore_errors=True)
+
+    print('Original count: ', total)
+    print('Distinct: ', sum(counts.values()))
+    return counts
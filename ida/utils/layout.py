@@ -0,0 +1,144 @@
+'''
+sharded output tree of the IDA stages, replaces writing next to the input and moving afterwards:
+    {root}/{shard}/{project}/{name}    shard: 2 hex chars of sha1(project/name without extension),
+                                       so the artifacts of one binary share a directory in every tree
+    {root}/manifest.jsonl              one json line per finished artifact, appended by the driver
+a stage writes to partial_path() and the driver calls commit() once the job succeeded, so readers
+only ever see complete files, and downstream stages read the manifest instead of walking the tree.
+only one process (the batch driver) may append to a manifest
+'''
+from __future__ import print_function, division
+import os
+import json
+import time
+import glob
+import fnmatch
+import hashlib
+
+
+MANIFEST = 'manifest.jsonl'
+PARTIAL = '.partial'
+
+
+def shard(project, name):
+    stem = os.path.splitext(name)[0]
+    return hashlib.sha1('{}/{}'.format(project, stem).encode('utf-8')).hexdigest()[:2]
+
+
+class OutputTree:
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST)
+        self._entries = None
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def path(self, project, name):
+        return os.path.join(self.root, shard(project, name), project, name)
+
+    def partial_path(self, project, name):
+        '''
+        where a job writes name before commit, {stem}.partial{ext} so tools that look at the extension still work
+        '''
+        stem, ext = os.path.splitext(self.path(project, name))
+        path = stem + PARTIAL + ext
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        return path
+
+    def entries(self):
+        '''
+        {relative path: manifest entry}, the last line of a path wins
+        '''
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path) as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue # torn last line of a killed driver
+                        self._entries[entry['path']] = entry
+        return self._entries
+
+    def has(self, project, name):
+        return os.path.relpath(self.path(project, name), self.root) in self.entries()
+
+    def entry_of(self, path):
+        '''
+        manifest entry of an artifact path under root (e.g. from list_artifacts), None if it is not listed
+        '''
+        return self.entries().get(os.path.relpath(path, self.root))
+
+    def commit(self, project, name, src=None, **info):
+        '''
+        rename src (default: the partial path) to the final path and append it to the manifest,
+        info: extra json-able fields of the entry. return the final path, None if src does not exist
+        '''
+        path = self.path(project, name)
+        if src is None:
+            stem, ext = os.path.splitext(path)
+            src = stem + PARTIAL + ext
+        if not os.path.exists(src):
+            return None
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        os.replace(src, path)
+        entry = dict(info, project=project, name=name, path=os.path.relpath(path, self.root),
+                     size=os.path.getsize(path), time=int(time.time()))
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.entries()[entry['path']] = entry
+        return path
+
+
+def sidecar_name(artifact_path, ext):
+    return os.path.splitext(os.path.basename(artifact_path))[0] + ext
+
+
+def sidecar_partial_path(tree, project, artifact_path, ext):
+    '''
+    partial path of an output that lives next to an artifact of tree, e.g. {name}.name_and_addr of an idb.
+    next to an artifact of the flat layout of older runs if the manifest does not list it
+    '''
+    if tree.entry_of(artifact_path) is not None:
+        return tree.partial_path(project, sidecar_name(artifact_path, ext))
+    return os.path.splitext(artifact_path)[0] + PARTIAL + ext
+
+
+def has_sidecar(tree, project, artifact_path, ext):
+    if tree.entry_of(artifact_path) is not None:
+        return tree.has(project, sidecar_name(artifact_path, ext))
+    # only commit_sidecar creates the final path, so it exists only when complete
+    return os.path.exists(os.path.splitext(artifact_path)[0] + ext)
+
+
+def commit_sidecar(tree, project, artifact_path, ext, **info):
+    '''
+    move the partial output next to artifact_path into place, into the manifest of tree if it lists the artifact
+    (a manifest in a flat tree would hide its other artifacts from list_artifacts).
+    return the final path, None if nothing was written
+    '''
+    if tree.entry_of(artifact_path) is not None:
+        return tree.commit(project, sidecar_name(artifact_path, ext), **info)
+    stem = os.path.splitext(artifact_path)[0]
+    if not os.path.exists(stem + PARTIAL + ext):
+        return None
+    os.replace(stem + PARTIAL + ext, stem + ext)
+    return stem + ext
+
+
+def list_artifacts(root, pattern):
+    '''
+    [(project, path)] of the artifacts under root whose name matches pattern (e.g. '*.i64'),
+    from the manifest if root has one, else from the flat {root}/{project}/ layout of older runs
+    '''
+    if os.path.exists(os.path.join(root, MANIFEST)):
+        return [(entry['project'], os.path.join(root, entry['path']))
+                for entry in OutputTree(root).entries().values()
+                if fnmatch.fnmatch(entry['name'], pattern)]
+    items = []
+    for p in os.listdir(root):
+        items.extend((p, path) for path in glob.glob(os.path.join(root, p, pattern)))
+    return items
@@ -6,11 +6,23 @@
 # - Hex-Rays augments C syntax with the '::' operator borrowed from C++ to
 #   reference shadowed global variables. We throw away this operator.
 
+import re
+from collections import deque
+from itertools import islice
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError: # python < 3.11
+    import sre_parse, sre_constants
 from pygments import lex
 from pygments.token import Token
 from pygments.token import is_token_subtype
+from pygments.token import _TokenType
 from pygments.lexers.c_cpp import CLexer, inherit, CppLexer
 
+# "pygments" walks the Pygments rule list token by token,
+# "regex" runs the same rules as one combined regex per lexer state, see CompiledLexer
+LEXER_ENGINE = "pygments"
+
 
 class TokenError(Exception):
     def __init__(self, message):
@@ -18,10 +30,17 @@ class TokenError(Exception):
 
 
 class Lexer:
-    def __init__(self, raw_code, name_split_func, lexer_cls):
+    def __init__(self, raw_code, name_split_func, lexer_cls, engine=None):
         self.raw_code = raw_code
         self.lexer_cls = lexer_cls
-        self.tokens = list(lex(self.raw_code, lexer_cls()))
+        engine = engine or LEXER_ENGINE
+        # lazy, tokens are lexed while get_tokens is consumed
+        if engine == "pygments":
+            self.tokens = lex(self.raw_code, lexer_cls())
+        elif engine == "regex":
+            self.tokens = CompiledLexer.get(lexer_cls).get_tokens(self.raw_code)
+        else:
+            raise TokenError(f"No lexer engine {engine}")
         self.func = name_split_func
 
     def get_tokens(self):
@@ -130,6 +149,199 @@ class Lexer:
 
 
 
+class CompiledLexer:
+    """Runs the rule table of a Pygments RegexLexer class with one combined regex per state.
+
+    Pygments tries the rules of a state one by one at every position, identifiers
+    match only after ~50 failed attempts. Joining the rules of a state into
+    "(?P<r0>rule0)|(?P<r1>rule1)|..." picks the same first matching rule in a single
+    re.match, so the tokens are identical to lex(raw_code, lexer_cls()).
+    Rules that cannot start with the current character are left out of the
+    alternation, see first_chars.
+    """
+    _cache = {}
+
+    def __init__(self, lexer_cls):
+        self.lexer = lexer_cls()  # builds lexer_cls._tokens
+        self.options = self.lexer.options
+        self.type_names = set()
+        # CFamilyLexer.get_tokens_unprocessed turns known type names into Keyword.Type
+        for attr, types in (('stdlibhighlighting', 'stdlib_types'), ('c99highlighting', 'c99_types'),
+                            ('c11highlighting', 'c11_atomic_types'), ('platformhighlighting', 'linux_types')):
+            if getattr(self.lexer, attr, False):
+                self.type_names |= getattr(self.lexer, types)
+        # state -> 129 (match, rule by group) entries, by first char (ascii) or 128 (non-ascii, end of text)
+        self.states = {}
+        compiled = {}
+        for state, rules in lexer_cls._tokens.items():
+            starts = [first_chars(rexmatch.__self__) for rexmatch, _, _ in rules]
+            table = []
+            for char in range(129):
+                subset = tuple(i for i, chars in enumerate(starts) if char == 128 or chars is None or char in chars)
+                if (state, subset) not in compiled:
+                    compiled[(state, subset)] = self.compile([rules[i] for i in subset])
+                table.append(compiled[(state, subset)])
+            self.states[state] = table
+
+    @staticmethod
+    def compile(rules):
+        if not rules:
+            return (lambda text, pos: None), {}
+        pattern = "|".join(f"(?P<r{i}>{rexmatch.__self__.pattern})" for i, (rexmatch, _, _) in enumerate(rules))
+        regex = re.compile(pattern, re.MULTILINE)
+        # lastindex of a match is the outer group of the matching rule
+        return regex.match, {regex.groupindex[f"r{i}"]: rule for i, rule in enumerate(rules)}
+
+    @classmethod
+    def get(cls, lexer_cls):
+        if lexer_cls not in cls._cache:
+            cls._cache[lexer_cls] = cls(lexer_cls)
+        return cls._cache[lexer_cls]
+
+    def get_tokens(self, text):
+        """Same as pygments.lex(text, lexer_cls()), yield (token_type, token)."""
+        if text.startswith('\ufeff'):
+            text = text[1:]
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        text = text.strip('\n')
+        if not text.endswith('\n'):
+            text += '\n'
+        for _, token_type, token in self.get_tokens_unprocessed(text):
+            yield token_type, token
+
+    def get_tokens_unprocessed(self, text, stack=('root',)):
+        # also called back by pygments' using(this) for nested groups
+        pos = 0
+        end = len(text)
+        type_names = self.type_names
+        statestack = list(stack)
+        table = self.states[statestack[-1]]
+        while 1:
+            char = ord(text[pos]) if pos < end else 128
+            match, by_group = table[char if char < 128 else 128]
+            m = match(text, pos)
+            if m:
+                rexmatch, action, new_state = by_group[m.lastindex]
+                if action is not None:
+                    if type(action) is _TokenType:
+                        token = m.group()
+                        if action is Token.Name and token in type_names:
+                            yield pos, Token.Keyword.Type, token
+                        else:
+                            yield pos, action, token
+                    else:
+                        # bygroups/using callbacks get the rule's own match object
+                        for i, token_type, token in action(self, rexmatch(text, pos)):
+                            if token_type is Token.Name and token in type_names:
+                                token_type = Token.Keyword.Type
+                            yield i, token_type, token
+                pos = m.end()
+                if new_state is not None:
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == '#pop':
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif state == '#push':
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == '#push':
+                        statestack.append(statestack[-1])
+                    table = self.states[statestack[-1]]
+            elif pos < end:
+                if text[pos] == '\n':
+                    # at EOL, reset state to "root"
+                    statestack = ['root']
+                    table = self.states['root']
+                    yield pos, Token.Text.Whitespace, '\n'
+                else:
+                    yield pos, Token.Error, text[pos]
+                pos += 1
+            else:
+                break
+
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r'\d', sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s', sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w', sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+_ALL_CHARS = frozenset(range(128))
+
+
+def first_chars(regex):
+    """Ascii chars a match of regex can start with, None if it may match anything (or nothing).
+
+    Over-approximates on the parsed pattern: lookarounds and anchors are skipped,
+    unknown constructs give None, so a rule is never dropped wrongly.
+    """
+    if regex.flags & (re.IGNORECASE | re.LOCALE | re.VERBOSE):
+        return None
+    try:
+        chars, nullable = _first_of(sre_parse.parse(regex.pattern, regex.flags))
+    except (TokenError, KeyError, TypeError, ValueError):
+        return None
+    return None if nullable else frozenset(chars)
+
+
+def _first_of(items):
+    chars = set()
+    for op, av in items:
+        first, nullable = _first_item(op, av)
+        chars |= first
+        if not nullable:
+            return chars, False
+    return chars, True
+
+
+def _first_item(op, av):
+    if op is sre_constants.LITERAL:
+        return {av} if av < 128 else set(), False
+    if op is sre_constants.NOT_LITERAL or op is sre_constants.ANY:
+        return set(_ALL_CHARS), False
+    if op is sre_constants.IN:
+        return _charset(av), False
+    if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return set(), True
+    if op is sre_constants.SUBPATTERN:
+        return _first_of(av[-1])
+    if op is sre_constants.BRANCH:
+        chars, nullable = set(), False
+        for branch in av[1]:
+            first, empty = _first_of(branch)
+            chars |= first
+            nullable = nullable or empty
+        return chars, nullable
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        first, nullable = _first_of(av[2])
+        return first, nullable or av[0] == 0
+    raise TokenError(f"No first chars for {op}")
+
+
+def _charset(items):
+    negate = False
+    chars = set()
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            chars.add(av)
+        elif op is sre_constants.RANGE:
+            chars.update(range(av[0], av[1] + 1))
+        elif op is sre_constants.CATEGORY:
+            category = re.compile(_CATEGORIES[av])
+            chars.update(c for c in _ALL_CHARS if category.match(chr(c)))
+        else:
+            raise TokenError(f"No first chars for {op}")
+    return set(_ALL_CHARS - chars) if negate else chars & _ALL_CHARS
+
+
 class HexRaysLexer(CLexer):
     # Additional tokens
     tokens = {
@@ -207,13 +419,33 @@ class BinJaLexer(CLexer):
         ],
     }
 
-def tokenize_raw_code(raw_code, func, flag_string=True, flag_call=True):
-    return tokenize_raw_code_hexray(raw_code, func, flag_string, flag_call)
+def tokenize_raw_code(raw_code, func, flag_string=True, flag_call=True, engine=None):
+    return tokenize_raw_code_hexray(raw_code, func, flag_string, flag_call, engine)
+
+def tokenize_raw_code_hexray(raw_code, func, keep_string=True, keep_call=True, engine=None):
+    return list(iter_tokens_hexray(raw_code, func, keep_string, keep_call, engine))
+
+
+def tokenize_raw_code_binja(raw_code, func, keep_string=True, keep_call=True, engine=None):
+    return list(iter_tokens_binja(raw_code, func, keep_string, keep_call, engine))
+
+
+def iter_tokens_hexray(raw_code, func, keep_string=True, keep_call=True, engine=None, max_tokens=None):
+    """Generator version of tokenize_raw_code_hexray, see truncate_tokens for max_tokens."""
+    lexer = Lexer(raw_code, func, HexRaysLexer, engine)
+    tokens = _filter_tokens_hexray(lexer.get_tokens(), keep_string, keep_call)
+    return truncate_tokens(tokens, max_tokens) if max_tokens else tokens
+
+
+def iter_tokens_binja(raw_code, func, keep_string=True, keep_call=True, engine=None, max_tokens=None):
+    """Generator version of tokenize_raw_code_binja, see truncate_tokens for max_tokens."""
+    lexer = Lexer(raw_code, func, BinJaLexer, engine)
+    tokens = _filter_tokens_binja(lexer.get_tokens(), keep_string, keep_call)
+    return truncate_tokens(tokens, max_tokens) if max_tokens else tokens
 
-def tokenize_raw_code_hexray(raw_code, func, keep_string=True, keep_call=True):
-    lexer = Lexer(raw_code, func, HexRaysLexer)
-    tokens = []
-    for token_type, token in lexer.get_tokens():
+
+def _filter_tokens_hexray(typed_tokens, keep_string, keep_call):
+    for token_type, token in typed_tokens:
         if not keep_call: # erase the function call
             if token_type == Token.Name.Function:
                 if token != "<FUNCTION>":
@@ -221,16 +453,13 @@ def tokenize_raw_code_hexray(raw_code, func, keep_string=True, keep_call=True):
         if not keep_string: # erase the string
             if token_type == Token.String:
                 token = "<STRING>"
-        tokens.append(token)
-    return tokens
+        yield token
 
 
-def tokenize_raw_code_binja(raw_code, func, keep_string=True, keep_call=True):
-    lexer = Lexer(raw_code, func, BinJaLexer)
-    tokens = []
+def _filter_tokens_binja(typed_tokens, keep_string, keep_call):
     func_def_flag = True
     func_def_name = ""
-    for token_type, token in lexer.get_tokens():
+    for token_type, token in typed_tokens:
         if func_def_flag and token_type == Token.Name.Function:
             func_def_name = token
             token = "<FUNCTION>"
@@ -244,5 +473,62 @@ def tokenize_raw_code_binja(raw_code, func, keep_string=True, keep_call=True):
         if not keep_string: # erase the string
             if token_type == Token.String:
                 token = "<STRING>"
-        tokens.append(token)
-    return tokens
\ No newline at end of file
+        yield token
+
+
+def truncate_tokens(tokens, max_tokens):
+    """Stop after max_tokens space separated words, like onmt -src_seq_length.
+
+    A normalized token may hold several words ("get file name"), the last one is cut
+    to fit. Lexing stops as soon as the limit is reached.
+    """
+    remain = max_tokens
+    for token in tokens:
+        words = token.split()
+        if len(words) >= remain:
+            yield token if len(words) == remain else " ".join(words[:remain])
+            return
+        remain -= len(words)
+        yield token
+
+
+def write_tokens(f, tokens):
+    """Write " ".join(tokens) to the file handle f without building the line, return the token count."""
+    count = 0
+    for token in tokens:
+        if count:
+            f.write(" ")
+        f.write(token)
+        count += 1
+    return count
+
+
+def merge_tokens(tokens, run, merged):
+    """Streaming version of " ".join(tokens).replace(f" {' '.join(run)} ", f" {' '.join(merged)} ").
+
+    A run of consecutive tokens equal to run is replaced by the tokens of merged if a token
+    precedes and follows it, leftmost first and non-overlapping like str.replace. Only runs
+    made of whole tokens are seen, a run inside a multi-word token (a string literal) is kept.
+    """
+    run = list(run)
+    tokens = iter(tokens)
+    pending = deque()
+    first = True
+    blocked = False # the str.replace match before consumed the leading space
+    while True:
+        while len(pending) < len(run) + 1:
+            token = next(tokens, None)
+            if token is None:
+                break
+            pending.append(token)
+        if not pending:
+            return
+        if not first and not blocked and len(pending) > len(run) and list(islice(pending, len(run))) == run:
+            for _ in run:
+                pending.popleft()
+            yield from merged
+            blocked = True
+        else:
+            yield pending.popleft()
+            blocked = False
+        first = False
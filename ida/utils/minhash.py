@@ -0,0 +1,248 @@
+'''
+near duplicate detection over tokenized pseudo code (MinHash signatures + banded LSH),
+functions differing only in <Number> placement or register names still share most token shingles
+'''
+from __future__ import print_function, division
+import os
+import time
+import zlib
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+from .corpus import count_lines
+
+
+SPLITS = ('train', 'valid', 'test')
+SHINGLE_MULTIPLIERS = np.asarray([0x9e3779b1, 0x85ebca6b, 0xc2b2ae35, 0x27d4eb2f, 0x165667b1,
+                                  0xd3a2646c, 0xfd7046c5, 0xb55a4f09], dtype=np.uint64)  # k <= 8
+
+
+class MinHasher:
+    '''
+    minhash signatures of token lines, shingles are k consecutive tokens,
+    hashed with crc32 so they are stable across processes (unlike hash())
+    '''
+    def __init__(self, num_perm=64, k=5, seed=233):
+        assert 1 <= k <= len(SHINGLE_MULTIPLIERS)
+        self.num_perm = num_perm
+        self.k = k
+        rng = np.random.RandomState(seed)
+        # multiply-shift hashing, a is odd
+        self.a = rng.randint(0, 2 ** 63, size=(num_perm, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.randint(0, 2 ** 63, size=(num_perm, 1), dtype=np.uint64)
+
+    def shingles(self, lines):
+        '''
+        shingle hashes of all lines and the offset of every line's first shingle,
+        tokens are crc32 hashed once and combined into k-grams in numpy, a line shorter than k
+        tokens is one shingle padded with zeros
+        '''
+        k = self.k
+        token_hashes = []
+        counts = []
+        line_starts = []
+        for line in lines:
+            hashes = list(map(zlib.crc32, line.encode('utf-8').split()))
+            line_starts.append(len(token_hashes))
+            counts.append(max(len(hashes) - k + 1, 1))
+            # zeros so that no window crosses into the next line
+            token_hashes.extend(hashes)
+            token_hashes.extend([0] * (k - 1 if hashes else k))
+        counts = np.asarray(counts, dtype=np.int64)
+        flat = np.asarray(token_hashes, dtype=np.uint64)
+        # uint64 wraps around, only the low 32 bits are kept
+        windows = flat[:len(flat) - k + 1] * SHINGLE_MULTIPLIERS[0]
+        for j in range(1, k):
+            windows += flat[j:len(flat) - k + 1 + j] * SHINGLE_MULTIPLIERS[j]
+        windows &= np.uint64(0xffffffff)
+        line_starts = np.asarray(line_starts, dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        index = np.repeat(line_starts - offsets, counts) + np.arange(counts.sum())
+        return windows[index], offsets
+
+    def signatures(self, lines):
+        '''
+        (len(lines), num_perm) uint32 array, one numpy pass over all shingles of the lines
+        '''
+        if not lines:
+            return np.zeros((0, self.num_perm), dtype=np.uint32)
+        hashes, offsets = self.shingles(lines)
+        # (a*x+b) mod 2**64, the high 32 bits are the permuted hash, no slow modulo
+        values = (self.a * hashes[np.newaxis, :] + self.b) >> np.uint64(32)
+        return np.minimum.reduceat(values, offsets, axis=1).T.astype(np.uint32)
+
+
+def choose_bands(num_perm, threshold):
+    '''
+    (bands, rows) with bands*rows == num_perm whose LSH threshold (1/bands)**(1/rows) is closest to threshold
+    '''
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+
+def lsh_pairs(sigs, bands, rows):
+    '''
+    candidate pairs (i, j), j < i is the first row sharing one band with row i
+    '''
+    pairs = []
+    for band in range(bands):
+        block = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        keys = block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        first = first[inverse.ravel()]
+        i = np.nonzero(first != np.arange(len(sigs)))[0]
+        pairs.append(np.stack([i, first[i]], axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def clusters_of(sigs, threshold, bands, rows):
+    '''
+    union-find over LSH candidates whose estimated jaccard >= threshold,
+    return the root (smallest index) of every row
+    '''
+    pairs = lsh_pairs(sigs, bands, rows)
+    if len(pairs):
+        similarity = (sigs[pairs[:, 0]] == sigs[pairs[:, 1]]).mean(axis=1)
+        pairs = pairs[similarity >= threshold]
+    parent = list(range(len(sigs)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs.tolist():
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            # smaller index is the root, train rows come first
+            parent[max(ri, rj)] = min(ri, rj)
+    return np.asarray([find(i) for i in range(len(sigs))], dtype=np.int64)
+
+
+def _signatures_worker(args):
+    hasher, lines = args
+    return hasher.signatures(lines)
+
+
+def iter_chunks(path, size):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        chunk = []
+        for line in f:
+            chunk.append(line)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def signatures_of_files(paths, hasher, processes=1, chunk_size=256):
+    '''
+    signatures of all lines of paths, shards of chunk_size lines run in a process pool,
+    at most 2 shards per worker are read ahead
+    '''
+    chunks = ((hasher, chunk) for path in paths for chunk in iter_chunks(path, chunk_size))
+    results = []
+    if processes > 1:
+        with Pool(processes=processes) as pool:
+            pending = deque()
+            for args in chunks:
+                pending.append(pool.apply_async(_signatures_worker, (args,)))
+                if len(pending) >= 2 * processes:
+                    results.append(pending.popleft().get())
+            while pending:
+                results.append(pending.popleft().get())
+    else:
+        results = [_signatures_worker(args) for args in chunks]
+    if not results:
+        return np.zeros((0, hasher.num_perm), dtype=np.uint32)
+    return np.concatenate(results)
+
+
+def near_dedup(prefix, threshold=0.8, num_perm=64, k=5, keep_train=True, processes=1, seed=233):
+    '''
+    find clusters of near duplicated functions across {prefix}-src-{train,valid,test}.txt,
+    write them to {prefix}-near-dup.txt as "split:line" lists and drop every row that has an
+    earlier member in its cluster (train < valid < test), train rows are kept if keep_train.
+    src/tgt split files are rewritten in place, return {split: rows dropped}
+    '''
+    src_paths = ['{}-src-{}.txt'.format(prefix, split) for split in SPLITS]
+    tgt_paths = ['{}-tgt-{}.txt'.format(prefix, split) for split in SPLITS]
+    hasher = MinHasher(num_perm, k, seed)
+    sigs = signatures_of_files(src_paths, hasher, processes)
+
+    offsets = [0]
+    for path in src_paths:
+        offsets.append(offsets[-1] + count_lines(path))
+    assert offsets[-1] == len(sigs)
+
+    bands, rows = choose_bands(num_perm, threshold)
+    roots = clusters_of(sigs, threshold, bands, rows)
+
+    def location(i):
+        split = int(np.searchsorted(offsets, i, side='right')) - 1
+        return SPLITS[split], i - offsets[split]
+
+    members = {}
+    for i, root in enumerate(roots.tolist()):
+        if root != i or i in members:
+            members.setdefault(root, []).append(i)
+    with open('{}-near-dup.txt'.format(prefix), 'w', encoding='utf-8') as f:
+        for root in sorted(members):
+            f.write(' '.join('{}:{}'.format(*location(i)) for i in [root] + members[root]) + '\n')
+
+    drop = roots != np.arange(len(roots))
+    if keep_train:
+        drop[:offsets[1]] = False
+    dropped = {}
+    for idx, split in enumerate(SPLITS):
+        keep = ~drop[offsets[idx]:offsets[idx + 1]]
+        dropped[split] = int((~keep).sum())
+        for path in (src_paths[idx], tgt_paths[idx]):
+            with open(path, 'r', encoding='utf-8', newline='') as src, \
+                    open(path + '.tmp', 'w', encoding='utf-8', newline='') as dst:
+                for line, kept in zip(src, keep):
+                    if kept:
+                        dst.write(line)
+            os.replace(path + '.tmp', path)
+    print('Near duplicate clusters: ', len(members))
+    print('Near duplicate dropped: ', dropped)
+    return dropped
+
+
+def benchmark(count=1000000, length=200, processes=os.cpu_count() or 1, num_perm=64, threshold=0.8):
+    '''
+    throughput on a synthetic corpus of count token lines, every 10th line a near copy of the line before
+    '''
+    rng = np.random.RandomState(0)
+    vocab = np.asarray(['v{}'.format(i) for i in range(5000)] + ['<Number>', '(', ')', ';', '='])
+    lines = []
+    for i in range(count):
+        if i % 10 == 9:
+            tokens = lines[-1].split()
+            tokens[rng.randint(len(tokens))] = '<Number>'
+            lines.append(' '.join(tokens))
+        else:
+            lines.append(' '.join(vocab[rng.randint(len(vocab), size=length)]))
+    hasher = MinHasher(num_perm)
+    chunks = [(hasher, lines[i:i + 256]) for i in range(0, count, 256)]
+    start = time.time()
+    with Pool(processes=processes) as pool:
+        sigs = np.concatenate(pool.map(_signatures_worker, chunks))
+    sig_time = time.time() - start
+    start = time.time()
+    roots = clusters_of(sigs, threshold, *choose_bands(num_perm, threshold))
+    lsh_time = time.time() - start
+    print('{} functions, {} processes'.format(count, processes))
+    print('signatures: {:.1f}s, {:.0f} functions/s'.format(sig_time, count / sig_time))
+    print('lsh + clustering: {:.1f}s, {:.0f} functions/s'.format(lsh_time, count / lsh_time))
+    print('near duplicates found: {} (expected {})'.format(int((roots != np.arange(count)).sum()), count // 10))
+
+
+if __name__ == '__main__':
+    benchmark()
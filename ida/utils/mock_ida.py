@@ -0,0 +1,46 @@
+'''
+stand-in for ida/ida64 to try the batch driver and the IDA stages without IDA:
+    python utils/mock_ida.py -B binary           -> writes binary.i64 (binary.idb with MOCK_IDA_EXT=.idb)
+    python utils/mock_ida.py -B -oout.i64 binary -> writes out.i64
+    python utils/mock_ida.py -A -Sscript.py idb  -> writes {idb root}.{script name}.mock
+    python utils/mock_ida.py -A -S"script.py out" idb -> writes out.{script name}.mock
+the target name picks a failure: "hang" never exits, "crash" exits with 3,
+"flaky" fails on the first run only. MOCK_IDA_DELAY adds seconds to every run
+'''
+from __future__ import print_function, division
+import os
+import sys
+import time
+import shlex
+
+
+def main(argv):
+    batch = '-B' in argv
+    # -S"path with spaces" args
+    scripts = [shlex.split(arg[2:]) for arg in argv if arg.startswith('-S')]
+    outputs = [arg[2:] for arg in argv if arg.startswith('-o')]
+    target = argv[-1]
+    name = os.path.basename(target)
+
+    time.sleep(float(os.environ.get('MOCK_IDA_DELAY', '0')))
+    if 'hang' in name:
+        while True:
+            time.sleep(1)
+    if 'crash' in name:
+        return 3
+    if 'flaky' in name and not os.path.exists(target + '.flaky'):
+        open(target + '.flaky', 'w').close()
+        return 1
+
+    if batch:
+        open(outputs[0] if outputs else target + os.environ.get('MOCK_IDA_EXT', '.i64'), 'w').close()
+    for script in scripts:
+        script_name = os.path.splitext(os.path.basename(script[0]))[0]
+        prefix = script[1] if len(script) > 1 else os.path.splitext(target)[0]
+        with open('{}.{}.mock'.format(prefix, script_name), 'w') as f:
+            f.write(' '.join(argv))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
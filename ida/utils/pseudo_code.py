@@ -0,0 +1,69 @@
+'''
+readers of the pseudo code files written by the idapython scripts of stage 4.
+a file is a record file (utils/records.py, read lazily, possibly cut short by a crash),
+or from an older run a sequence of {name: InternalMethod} pickles
+'''
+from __future__ import print_function, division
+import os
+import pickle
+from .records import RecordReader, is_record_file
+
+
+def iter_chunks(path):
+    '''
+    yield the pickles of a file one by one, InternalMethod must be importable from __main__
+    '''
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def is_complete(path):
+    '''
+    True if path holds the whole output of an extraction, a crashed one leaves an unclosed record file
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    if is_record_file(path):
+        with RecordReader(path) as reader:
+            return reader.complete
+    return True
+
+
+def iter_methods(path):
+    '''
+    yield the methods (name, start_addr, end_addr, pseudo_code) of a pseudo code file one by one
+    '''
+    if is_record_file(path):
+        with RecordReader(path) as reader:
+            for record in reader:
+                yield record
+        return
+    for chunk in iter_chunks(path):
+        for method in chunk.values():
+            yield method
+
+
+def load_artifact(path):
+    '''
+    {'file_type', 'name_and_addr', 'methods'} of a pseudo code file, the first two are None if the file does not have them
+    '''
+    if is_record_file(path):
+        with RecordReader(path) as reader:
+            meta = reader.meta
+            methods = dict((record.name, record) for record in reader)
+        return {'file_type': meta.get('file_type'), 'name_and_addr': meta.get('name_and_addr'), 'methods': methods}
+    methods = {}
+    for chunk in iter_chunks(path):
+        methods.update(chunk)
+    return {'file_type': None, 'name_and_addr': None, 'methods': methods}
+
+
+def load_methods(path):
+    '''
+    {name: method} of a pseudo code file, iter_methods does not hold them all in memory
+    '''
+    return load_artifact(path)['methods']
@@ -0,0 +1,248 @@
+'''
+append-only pseudo code file, one record per function, written by the idapython scripts of stage 4
+and read lazily by the corpus stage. a crashed extraction leaves every record written before the
+crash readable, and the next run appends to it instead of starting over.
+
+layout:
+    header   MAGIC, version, length of meta, meta as json (file_type, name_and_addr, ...)
+    records  per function: length, flags, payload (start_addr, end_addr, name, pseudo code),
+             the payload zlib compressed if flags says so
+    index    (start_addr, offset) per record, sorted by address
+    trailer  index offset, record count, INDEX_MAGIC
+index and trailer are written by close(), a file without them is scanned record by record
+'''
+from __future__ import print_function, division
+import os
+import json
+import zlib
+import struct
+import bisect
+from collections import namedtuple
+
+
+MAGIC = b'NERREC\0\0'
+INDEX_MAGIC = b'NERIDX\0\0'
+VERSION = 1
+HEADER = struct.Struct('<8sBI')
+RECORD_HEAD = struct.Struct('<IB')
+PAYLOAD_HEAD = struct.Struct('<QQI')
+INDEX_ENTRY = struct.Struct('<QQ')
+TRAILER = struct.Struct('<QQ8s')
+FLAG_ZLIB = 1
+
+# same fields as InternalMethod of the idapython scripts
+Record = namedtuple('Record', ['name', 'start_addr', 'end_addr', 'pseudo_code'])
+
+
+def _to_bytes(s):
+    return s if isinstance(s, bytes) else s.encode('utf-8')
+
+
+def _encode(name, start_addr, end_addr, pseudo_code):
+    name = _to_bytes(name)
+    return PAYLOAD_HEAD.pack(start_addr, end_addr, len(name)) + name + _to_bytes(pseudo_code)
+
+
+def _decode(payload):
+    start_addr, end_addr, name_len = PAYLOAD_HEAD.unpack_from(payload)
+    pos = PAYLOAD_HEAD.size
+    name = payload[pos:pos + name_len].decode('utf-8', 'replace')
+    pseudo_code = payload[pos + name_len:].decode('utf-8', 'replace')
+    return Record(name, start_addr, end_addr, pseudo_code)
+
+
+def is_record_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _read_header(f):
+    head = f.read(HEADER.size)
+    if len(head) < HEADER.size:
+        raise ValueError('truncated header')
+    magic, version, meta_len = HEADER.unpack(head)
+    if magic != MAGIC:
+        raise ValueError('not a record file')
+    if version != VERSION:
+        raise ValueError('unsupported record file version {}'.format(version))
+    meta = f.read(meta_len)
+    if len(meta) < meta_len:
+        raise ValueError('truncated header')
+    return json.loads(meta.decode('utf-8'))
+
+
+def _read_trailer(f):
+    '''
+    (index offset, count) of a closed file, None if the file was not closed
+    '''
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size < TRAILER.size:
+        return None
+    f.seek(size - TRAILER.size)
+    index_offset, count, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != INDEX_MAGIC or index_offset + count * INDEX_ENTRY.size + TRAILER.size != size:
+        return None
+    return index_offset, count
+
+
+def _scan(f, start, end=None):
+    '''
+    yield (offset, flags, payload) of the complete records from start, a truncated record ends the scan
+    '''
+    offset = start
+    f.seek(offset)
+    while end is None or offset < end:
+        head = f.read(RECORD_HEAD.size)
+        if len(head) < RECORD_HEAD.size:
+            return
+        length, flags = RECORD_HEAD.unpack(head)
+        payload = f.read(length)
+        if len(payload) < length:
+            return
+        yield offset, flags, payload
+        offset += RECORD_HEAD.size + length
+
+
+def _payload(flags, payload):
+    return zlib.decompress(payload) if flags & FLAG_ZLIB else payload
+
+
+class RecordWriter:
+    '''
+    append records to path. with resume=True an existing file is kept: its meta wins,
+    a torn last record and the old index are cut off, and addresses holds the starts already written
+    '''
+    def __init__(self, path, meta=None, compression='zlib', level=6, resume=True):
+        if compression not in ('zlib', None):
+            raise ValueError('unknown compression {}'.format(compression))
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self.index = []
+        self.addresses = set()
+
+        if resume and os.path.exists(path) and is_record_file(path):
+            with open(path, 'rb') as f:
+                try:
+                    self.meta = _read_header(f)
+                except ValueError:
+                    self.meta = None
+                else:
+                    records_start = f.tell()
+                    trailer = _read_trailer(f)
+                    end = trailer[0] if trailer is not None else None
+                    valid_end = records_start
+                    for offset, flags, payload in _scan(f, records_start, end):
+                        record = _decode(_payload(flags, payload))
+                        self.index.append((record.start_addr, offset))
+                        self.addresses.add(record.start_addr)
+                        valid_end = offset + RECORD_HEAD.size + len(payload)
+            if self.meta is not None:
+                self.f = open(path, 'r+b')
+                self.f.truncate(valid_end)
+                self.f.seek(valid_end)
+                return
+
+        self.meta = meta if meta is not None else {}
+        meta = json.dumps(self.meta).encode('utf-8')
+        self.f = open(path, 'wb')
+        self.f.write(HEADER.pack(MAGIC, VERSION, len(meta)) + meta)
+        self.f.flush()
+
+    def write(self, name, start_addr, end_addr, pseudo_code):
+        payload = _encode(name, start_addr, end_addr, pseudo_code)
+        flags = 0
+        if self.compression == 'zlib':
+            payload = zlib.compress(payload, self.level)
+            flags |= FLAG_ZLIB
+        offset = self.f.tell()
+        self.f.write(RECORD_HEAD.pack(len(payload), flags) + payload)
+        # every finished record reaches the file, a crash loses at most the current one
+        self.f.flush()
+        self.index.append((start_addr, offset))
+        self.addresses.add(start_addr)
+
+    def close(self):
+        index_offset = self.f.tell()
+        self.index.sort()
+        self.f.write(b''.join(INDEX_ENTRY.pack(addr, offset) for addr, offset in self.index))
+        self.f.write(TRAILER.pack(index_offset, len(self.index), INDEX_MAGIC))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            # no index and trailer: the file stays incomplete and the next RecordWriter resumes it
+            self.f.close()
+        else:
+            self.close()
+
+
+class RecordReader:
+    '''
+    for record in RecordReader(path) streams the records in file order, reader[start_addr] looks one up,
+    complete is False for a file whose writer did not close (the index is then rebuilt by a scan)
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        self.meta = _read_header(self.f)
+        self.records_start = self.f.tell()
+        trailer = _read_trailer(self.f)
+        self.complete = trailer is not None
+        if self.complete:
+            self.records_end, count = trailer
+            self.f.seek(self.records_end)
+            data = self.f.read(count * INDEX_ENTRY.size)
+            self._addrs = []
+            self._offsets = []
+            for i in range(count):
+                addr, offset = INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)
+                self._addrs.append(addr)
+                self._offsets.append(offset)
+        else:
+            self.records_end = None
+            self._addrs = None
+
+    def _build_index(self):
+        pairs = sorted((_decode(_payload(flags, payload)).start_addr, offset)
+                       for offset, flags, payload in _scan(self.f, self.records_start))
+        self._addrs = [addr for addr, _ in pairs]
+        self._offsets = [offset for _, offset in pairs]
+
+    def __iter__(self):
+        # own file object, lookups during the iteration do not move it
+        with open(self.path, 'rb') as f:
+            for _, flags, payload in _scan(f, self.records_start, self.records_end):
+                yield _decode(_payload(flags, payload))
+
+    def __len__(self):
+        if self._addrs is None:
+            self._build_index()
+        return len(self._addrs)
+
+    def addresses(self):
+        if self._addrs is None:
+            self._build_index()
+        return list(self._addrs)
+
+    def __getitem__(self, start_addr):
+        if self._addrs is None:
+            self._build_index()
+        i = bisect.bisect_left(self._addrs, start_addr)
+        if i == len(self._addrs) or self._addrs[i] != start_addr:
+            raise KeyError(start_addr)
+        _, flags, payload = next(_scan(self.f, self._offsets[i]))
+        return _decode(_payload(flags, payload))
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,10 +1,11 @@
 from __future__ import print_function, division
 from iteration_utilities import deepflatten
-from collections import Counter
+from collections import Counter, OrderedDict
 import math
 import re
 import os
 import hashlib
+import pickle
 
 
 def is_required_func(func_name):
@@ -155,20 +156,41 @@ def split_sentence_piece(sp, tokens):
     return tokenized
 
 
-def merge_suffix(tokens, vocab):
+SUFFIXES = frozenset(['er', 'or', 'ed', 'ied', 'ing', 'ling', 'est', 's', 'es', 'ies', 'ify', 'ified', 'ly', 'ible', 'able', 'ize',
+                      'al', 'tion', 'ition', 'ous', 'ance', 'ence', 'ful', 'ment', 'hood'])
+CONDITIONAL_SUFFIXES = (('t', 'ion'), ('e', 'd'), ('e', 'r'))
+
 
-    suffixes = ['er', 'or', 'ed', 'ied', 'ing', 'ling', 'est', 's', 'es', 'ies', 'ify', 'ified', 'ly', 'ible', 'able', 'ize',
-                'al', 'tion', 'ition', 'ous', 'ance', 'ence', 'ful', 'ment', 'hood']
-    conditional_suffixes = [['t', 'ion'], ['e', 'd'], ['e', 'r']]
+def load_lexicon(cache_path=None):
+    '''
+    english words for merge_suffix as a frozenset, so "in vocab" is O(1) instead of a scan over the 236k nltk words.
+    the set is pickled to cache_path, later runs never load the nltk corpus.
+    '''
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    from nltk.corpus import words
+    lexicon = frozenset(words.words())
+    if cache_path:
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(lexicon, f)
+        os.replace(tmp_path, cache_path)
+    return lexicon
 
+
+def merge_suffix(tokens, vocab):
+    '''
+    vocab should be a set, see load_lexicon
+    '''
     if len(tokens) < 2:
         return tokens
 
-    if tokens[-1] in suffixes:
+    if tokens[-1] in SUFFIXES:
         tokens[-2] = tokens[-2]+tokens[-1]
         tokens = tokens[:-1]
         return tokens
-    for p1, p2 in conditional_suffixes:
+    for p1, p2 in CONDITIONAL_SUFFIXES:
         if tokens[-2].endswith(p1) and tokens[-1].endswith(p2):
             tokens[-2] = tokens[-2] + tokens[-1]
             tokens = tokens[:-1]
@@ -178,6 +200,66 @@ def merge_suffix(tokens, vocab):
     return tokens
 
 
+class NameSplitter:
+    '''
+    memoized merge_suffix(split_sentence_piece(sp, split_func_name(name)), vocab),
+    the same library names are split millions of times across symbols, calls and lexer tokens.
+    LRU bounded by maxsize, optionally persisted to cache_path so the next run starts warm.
+    '''
+    def __init__(self, sp, vocab, maxsize=1000000, cache_path=None):
+        self.sp = sp
+        self.vocab = vocab
+        self.maxsize = maxsize
+        self.cache_path = cache_path
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # a cache made with another sentencepiece model or lexicon is stale, hash the words, not only their count
+        digest = hashlib.md5(sp.serialized_model_proto())
+        digest.update('\n'.join(sorted(vocab)).encode('utf-8'))
+        self.fingerprint = digest.hexdigest()
+        if cache_path and os.path.exists(cache_path):
+            self.load(cache_path)
+
+    def __call__(self, name):
+        if name in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(name)
+            tokens = self.cache[name]
+        else:
+            self.misses += 1
+            tokens = merge_suffix(split_sentence_piece(self.sp, split_func_name(name)), self.vocab)
+            self.cache[name] = tokens
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        # callers may modify the returned list
+        return list(tokens) if isinstance(tokens, list) else tokens
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache), 'maxsize': self.maxsize}
+
+    def load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                fingerprint, cache = pickle.load(f)
+        except Exception:
+            return
+        if fingerprint != self.fingerprint:
+            return
+        for name, tokens in list(cache.items())[-self.maxsize:]:
+            self.cache[name] = tokens
+
+    def save(self, path=None):
+        path = path or self.cache_path
+        if not path:
+            return
+        # write then rename, parallel workers may save the same file
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.fingerprint, dict(self.cache)), f)
+        os.replace(tmp_path, path)
+
+
 def get_files_with_specific_ext_from_dir(rootname, exts):
     if isinstance(exts, str):
         exts = [exts]
@@ -0,0 +1,178 @@
+# -*- coding: UTF-8 -*-
+'''
+accuracy/precision/recall/f1 of predicted function names and the line counts of the prediction files, used by py_test_models.py.
+no model or vocab is loaded here, vocab_set and summarization_index are passed in
+(summarization_index None: no synonym extension)
+'''
+import os
+import numpy as np
+
+
+def build_summarization_index(summarization_list):
+    '''
+    map every token to the union of all summarization rows containing it,
+    so extending a reference token is a single dict lookup instead of a scan over all rows
+    '''
+    summarization_index = {}
+    for summ_l in summarization_list:
+        row = set(summ_l)
+        for token in row:
+            if token in summarization_index:
+                summarization_index[token] |= row
+            else:
+                summarization_index[token] = set(row)
+    return summarization_index
+
+
+def get_aprf(preds:list, refs:list, vocab_set, summarization_index=None):
+    '''
+    per-pair reference implementation, get_aprf_batch must give the same averages
+    '''
+    assert len(preds) == len(refs)
+
+    accs = []
+    precisions = []
+    recalls = []
+    f1s = []
+    for p, r in zip(preds, refs):
+
+        p_tokens = p.split(' ')
+        r_tokens = r.split(' ')
+
+
+        r_tokens = list(filter(lambda x: x in vocab_set, r_tokens))
+        if len(r_tokens) == 0:
+            continue
+
+        if summarization_index is not None:
+            r_tokens_extend = set(r_tokens)
+            for r_t in r_tokens:
+                if r_t in summarization_index:
+                    r_tokens_extend |= summarization_index[r_t]
+
+            hits = sum([1 if p_t in r_tokens_extend else 0 for p_t in p_tokens])
+            acc = hits / len(p_tokens)
+
+            precision = hits / len(p_tokens)
+            recall = hits / len(r_tokens)
+
+        else:
+            acc = len([x for x in p_tokens if x in r_tokens]) / len(p_tokens)
+
+            precision = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / len(p_tokens)
+            recall = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / len(r_tokens)
+
+            # precision = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / (sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) + sum([1 if p_t not in r_tokens else 0 for p_t in p_tokens]))
+            # recall = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / (sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) + sum([1 if r_t not in p_tokens else 0 for r_t in r_tokens]))
+
+        f1 = 2*precision*recall / (precision+recall+0.0001)
+
+        accs.append(acc)
+        precisions.append(precision)
+        recalls.append(recall)
+        f1s.append(f1)
+
+
+    avg_accuracy = sum(accs) / len(accs)
+    avg_precision = sum(precisions) / len(precisions)
+    avg_recall = sum(recalls) / len(recalls)
+    avg_f1 = sum(f1s) / len(f1s)
+
+    return {'accuracy': avg_accuracy,'precision':avg_precision, 'recall':avg_recall, 'f1':avg_f1}
+
+
+def encode_tokens(sentences, token_ids:dict):
+    '''
+    intern tokens to integer ids (token_ids is updated in place),
+    return the flat id array and the length of each sentence (a ragged array)
+    '''
+    flat = []
+    lengths = []
+    for tokens in sentences:
+        ids = [token_ids.setdefault(t, len(token_ids)) for t in tokens]
+        flat.extend(ids)
+        lengths.append(len(ids))
+    return np.asarray(flat, dtype=np.int64), np.asarray(lengths, dtype=np.int64)
+
+
+def get_aprf_batch(preds:list, refs:list, vocab_set, summarization_index=None):
+    '''
+    vectorized get_aprf, return (avg metrics, per_example)
+    per_example is a (len(preds), 4) array of accuracy/precision/recall/f1,
+    rows skipped by get_aprf (no reference token in vocab) are nan,
+    so it can be sliced by project or length bucket, see group_metrics
+    '''
+    assert len(preds) == len(refs)
+
+    p_sentences = [p.split(' ') for p in preds]
+    r_sentences = [[x for x in r.split(' ') if x in vocab_set] for r in refs]
+    if summarization_index is not None:
+        e_sentences = []
+        for r_tokens in r_sentences:
+            r_tokens_extend = set(r_tokens)
+            for r_t in r_tokens:
+                if r_t in summarization_index:
+                    r_tokens_extend |= summarization_index[r_t]
+            e_sentences.append(r_tokens_extend)
+    else:
+        e_sentences = [set(r_tokens) for r_tokens in r_sentences]
+
+    token_ids = {}
+    p_flat, p_len = encode_tokens(p_sentences, token_ids)
+    e_flat, e_len = encode_tokens(e_sentences, token_ids)
+    r_len = np.asarray([len(r_tokens) for r_tokens in r_sentences], dtype=np.int64)
+
+    # (example, token) pairs as one int key, a pred token hits if its pair is in the refs
+    n = len(preds)
+    p_key = np.repeat(np.arange(n, dtype=np.int64), p_len) * len(token_ids) + p_flat
+    e_key = np.repeat(np.arange(n, dtype=np.int64), e_len) * len(token_ids) + e_flat
+    hits = np.bincount(np.repeat(np.arange(n), p_len), weights=np.isin(p_key, e_key), minlength=n)
+
+    valid = r_len > 0
+    per_example = np.full((n, 4), np.nan)
+    precision = hits[valid] / p_len[valid]
+    recall = hits[valid] / r_len[valid]
+    per_example[valid, 0] = precision
+    per_example[valid, 1] = precision
+    per_example[valid, 2] = recall
+    per_example[valid, 3] = 2*precision*recall / (precision+recall+0.0001)
+
+    avg_accuracy, avg_precision, avg_recall, avg_f1 = per_example[valid].mean(axis=0)
+
+    return {'accuracy': float(avg_accuracy),'precision':float(avg_precision), 'recall':float(avg_recall), 'f1':float(avg_f1)}, per_example
+
+
+def group_metrics(per_example, groups:list):
+    '''
+    average per_example metrics by group, groups[i] is the project/length bucket of example i
+    '''
+    groups = np.asarray(groups)
+    results = {}
+    for g in np.unique(groups):
+        rows = per_example[groups == g]
+        rows = rows[~np.isnan(rows[:, 0])]
+        if len(rows) == 0:
+            continue
+        results[g.item()] = dict(zip(['accuracy', 'precision', 'recall', 'f1'], rows.mean(axis=0).tolist()))
+    return results
+
+
+def count_lines(path):
+    '''
+    number of lines the way print_result reads a file: split on newlines and drop one trailing empty line,
+    so a src written with "\\n".join (no trailing newline) counts the same as the onmt_translate output
+    '''
+    newlines = 0
+    last = b''
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            newlines += chunk.count(b'\n')
+            last = chunk[-1:]
+    return newlines + (1 if last not in (b'', b'\n') else 0)
+
+
+def is_complete(pred_path, src_lines):
+    '''
+    onmt_translate writes one line per src line (-n_best 1), a killed run leaves fewer lines
+    '''
+    return os.path.exists(pred_path) and count_lines(pred_path) == src_lines
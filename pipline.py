@@ -2,26 +2,82 @@
 '''
 @desc: generate eval file for eval
 '''
-import json
+import sys
+import io
+from itertools import islice
+from collections import deque
+from multiprocessing import Pool
 from tqdm import tqdm
 import sentencepiece
-from nltk.corpus import words
-from binja.utils.utils import split_func_name, split_sentence_piece, merge_suffix
-from binja.utils.lexer import tokenize_raw_code_hexray
+from binja.utils.utils import NameSplitter, load_lexicon
+from dataset import iter_records
+from binja.utils.lexer import iter_tokens_hexray, merge_tokens, truncate_tokens, write_tokens
 from typing import List
 
 MODEL_PATH = "./data/binja/model/sentencepiece.model"
+NAME_CACHE_PATH = "./data/binja/model/name_split_cache.pkl"
+LEXICON_PATH = "./data/binja/model/lexicon.pkl"
+DATASET_PATH = "./dataset.json" # JSON array or JSON Lines (.jsonl)
+PROCESSES = 1 # >1 to process chunks of records in a process pool
+CHUNK_SIZE = 1000 # records per chunk, bounds memory with PROCESSES
+MAX_TOKENS = None # keep the first words of the pseudo code (onmt -src_seq_length), None to keep all
 sp = sentencepiece.SentencePieceProcessor()
 sp.load(MODEL_PATH)
-vocab = words.words()
-def my_split_func_name(name):
-    return merge_suffix(split_sentence_piece(sp, split_func_name(name)), vocab)
+vocab = load_lexicon(LEXICON_PATH)
+my_split_func_name = NameSplitter(sp, vocab, cache_path=NAME_CACHE_PATH)
 
-def save(src:List, tgt:List, src_type, set_type):
-    with open(f"src-{set_type}-{src_type}.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(src))
-    with open(f"tgt-{set_type}-{src_type}.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(tgt))
+class EvalWriter:
+    '''
+    write src-{set_type}-{src_type}.txt / tgt-{set_type}-{src_type}.txt row by row,
+    same content as "\n".join(rows)
+    '''
+    def __init__(self, src_type, set_type):
+        self.src_file = open(f"src-{set_type}-{src_type}.txt", "w", encoding="utf-8")
+        self.tgt_file = open(f"tgt-{set_type}-{src_type}.txt", "w", encoding="utf-8")
+        self.rows = 0
+
+    def write(self, src:str, tgt:str):
+        sep = "\n" if self.rows else ""
+        self.src_file.write(sep + src)
+        self.tgt_file.write(sep + tgt)
+        self.rows += 1
+
+    def close(self):
+        self.src_file.close()
+        self.tgt_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap_bounded(pool, func, iterable, window):
+    '''
+    ordered pool.imap that reads at most `window` items ahead,
+    pool.imap would pull the whole dataset into its task queue
+    '''
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def process_chunk(records:List) -> List:
+    return [pipline_for_eval(data['pcode'], data['func_name']) for data in records]
 
 
 def pipline_for_eval(raw_pcode:str, func_name:str):
@@ -30,21 +86,38 @@ def pipline_for_eval(raw_pcode:str, func_name:str):
     '''
     if func_name in raw_pcode:
         raw_pcode = raw_pcode.replace(func_name, "<FUNCTION>")
-    pseudo_code = tokenize_raw_code_hexray(raw_pcode, my_split_func_name)
-    pseudo_code = " ".join(pseudo_code).replace(" < function > ( ", " <FUNCTION> ( ") # fix it
+    # the lexer splits the <FUNCTION>( placeholder into "< function > (", merge it back
+    tokens = merge_tokens(iter_tokens_hexray(raw_pcode, my_split_func_name), ("<", "function", ">", "("), ("<FUNCTION>", "("))
+    if MAX_TOKENS:
+        tokens = truncate_tokens(tokens, MAX_TOKENS) # lexing stops at the limit
+    buf = io.StringIO()
+    write_tokens(buf, tokens)
+    pseudo_code = buf.getvalue()
     split_name = my_split_func_name(func_name)
     split_name = " ".join(split_name)
     return pseudo_code, split_name
 
 
+def main(dataset_path, processes=PROCESSES):
+    chunks = iter_chunks(iter_records(dataset_path), CHUNK_SIZE)
+    if processes > 1:
+        pool = Pool(processes=processes)
+        # keeps the dataset order, at most 2 chunks per worker are in flight
+        results = imap_bounded(pool, process_chunk, chunks, 2 * processes)
+    else:
+        pool = None
+        results = map(process_chunk, chunks)
+    with EvalWriter("pc", "eval") as writer:
+        for rows in tqdm(results, desc="processing chunks"):
+            for pseudo_code, split_name in rows:
+                writer.write(pseudo_code, split_name)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    # in pool mode the workers split the names, their caches are not written back
+    my_split_func_name.save()
+
+
 if __name__ == "__main__":
-    src,tgt = [],[]
     # each item in dataset is a dict storing pseudo code and function name
-    with open("./dataset.json", "r", encoding="utf-8") as f:
-        for data in tqdm(json.load(f), desc="processing"):
-            pseudo_code = data['pcode']
-            func_name = data['func_name']
-            pseudo_code, split_name = pipline_for_eval(pseudo_code, func_name)
-            src.append(pseudo_code)
-            tgt.append(split_name)
-    save(src, tgt, "eval", "pc")
+    main(sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH)
@@ -1,11 +1,17 @@
 # -*- coding: UTF-8 -*-
+import csv
 import logging
 import os
+import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import torch
 import datetime
 import pickle
+import numpy as np
+from metrics import build_summarization_index, group_metrics, count_lines, is_complete
+from metrics import get_aprf as aprf_of, get_aprf_batch as aprf_batch_of
 
 
 # parameters need define and you also need modify in main()
@@ -17,6 +23,8 @@ src_path = "./test/src-test-len3000.txt"
 # speed up data loading
 vocab_pickle_path = vocab_path+".pkl"
 summarization_pickle_path = summarization_path+".pkl"
+# evaluate checkpoints from step 10000 to 1000000
+steps = range(10000,1000001,10000)
 
 
 def read_vocab(path):
@@ -44,77 +52,39 @@ else: # not exist cache
     with open(vocab_pickle_path, "wb") as f:
         pickle.dump(vocab,f)
 print('vocab size: ', len(vocab))
+vocab_set = set(vocab)
 
 
 if load_summarization:
+    summarization_index = None
     if os.path.exists(summarization_pickle_path):
         # load from pkl
         with open(summarization_pickle_path, "rb") as f:
-           summarization_list = pickle.load(f)
+           summarization_cache = pickle.load(f)
+        if isinstance(summarization_cache, tuple): # (list, index)
+            summarization_list, summarization_index = summarization_cache
+        else: # old cache only stores the list
+            summarization_list = summarization_cache
     else:
         with open(summarization_path, 'r', encoding='utf-8') as f:
             content = f.read().split('\n')
         summarization_list = list(map(lambda x: x.split(','), content))
+    if summarization_index is None:
+        summarization_index = build_summarization_index(summarization_list)
         # save to pkl
         with open(summarization_pickle_path, "wb") as f:
-            pickle.dump(summarization_list,f)
+            pickle.dump((summarization_list, summarization_index),f)
 
 
 def get_aprf(preds:list, refs:list):
+    return aprf_of(preds, refs, vocab_set, summarization_index if load_summarization else None)
 
-    assert len(preds) == len(refs)
-    
-    accs = []
-    precisions = []
-    recalls = []
-    f1s = []
-    for p, r in zip(preds, refs):
 
-        p_tokens = p.split(' ')
-        r_tokens = r.split(' ')
-
-
-        r_tokens = list(filter(lambda x: x in vocab, r_tokens))
-        if len(r_tokens) == 0:
-            continue
-
-        if load_summarization:
-            r_tokens_extend = []
-            for r_t in r_tokens:
-                r_tokens_extend.append(r_t)
-                for summ_l in summarization_list:
-                    if r_t in summ_l:
-                        r_tokens_extend.extend(summ_l)
-            r_tokens_extend = list(set(r_tokens_extend))
-
-            acc = len([x for x in p_tokens if x in r_tokens_extend]) / len(p_tokens)
-
-            precision = sum([1 if p_t in r_tokens_extend else 0 for p_t in p_tokens]) / len(p_tokens)
-            recall = sum([1 if p_t in r_tokens_extend else 0 for p_t in p_tokens]) / len(r_tokens)
-
-        else:
-            acc = len([x for x in p_tokens if x in r_tokens]) / len(p_tokens)
-
-            precision = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / len(p_tokens)
-            recall = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / len(r_tokens)
-
-            # precision = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / (sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) + sum([1 if p_t not in r_tokens else 0 for p_t in p_tokens]))
-            # recall = sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) / (sum([1 if p_t in r_tokens else 0 for p_t in p_tokens]) + sum([1 if r_t not in p_tokens else 0 for r_t in r_tokens]))
-
-        f1 = 2*precision*recall / (precision+recall+0.0001)
-
-        accs.append(acc)
-        precisions.append(precision)
-        recalls.append(recall)
-        f1s.append(f1)
-
-
-    avg_accuracy = sum(accs) / len(accs)
-    avg_precision = sum(precisions) / len(precisions)
-    avg_recall = sum(recalls) / len(recalls)
-    avg_f1 = sum(f1s) / len(f1s)
-
-    return {'accuracy': avg_accuracy,'precision':avg_precision, 'recall':avg_recall, 'f1':avg_f1}
+def get_aprf_batch(preds:list, refs:list):
+    '''
+    vectorized get_aprf, see metrics.get_aprf_batch
+    '''
+    return aprf_batch_of(preds, refs, vocab_set, summarization_index if load_summarization else None)
 
 
 def print_result(pred_path=None, tgt_path=None):
@@ -146,12 +116,96 @@ def print_result(pred_path=None, tgt_path=None):
 
     print(len(preds), len(refs))
 
-    metrics = get_aprf(preds, refs)
+    metrics, per_example = get_aprf_batch(preds, refs)
+    # keep per example metrics for slicing, rows follow the filtered preds
+    np.save(pred_path+".metrics.npy", per_example)
 
     logger.info('A: {}'.format(metrics['accuracy']))
     logger.info('P: {}'.format(metrics['precision']))
     logger.info('R: {}'.format(metrics['recall']))
     logger.info('F: {}'.format(metrics['f1']))
+    # the same metrics sliced by the number of words in the reference name, 4 means 4 or more
+    buckets = [min(len(ref.split()), 4) for ref in refs]
+    for bucket, m in sorted(group_metrics(per_example, buckets).items()):
+        logger.info('len {}{}: A {:.4f} P {:.4f} R {:.4f} F {:.4f} ({} names)'.format(
+            bucket, '+' if bucket == 4 else '', m['accuracy'], m['precision'], m['recall'], m['f1'], buckets.count(bucket)))
+    return metrics
+
+
+def translate(model_name, step, gpu_idx, threads):
+    '''
+    run one onmt_translate job, return (step, returncode, seconds)
+    '''
+    cmd = "onmt_translate -model models/{0}_step_{1}.pt -src {2} -output results/pred_test_{0}_step_{1}.txt -min_length 1 -max_length 30 -beam_size 10 -batch_size 16 -n_best 1".format(model_name,step,src_path)
+    if str(gpu_idx) != "-1":
+        cmd += " -gpu {}".format(gpu_idx)
+    env = dict(os.environ)
+    # split cpu cores among concurrent jobs instead of oversubscribing them
+    env.setdefault("OMP_NUM_THREADS", str(threads))
+    logger.info("[+]start cmd: {}".format(cmd))
+    start = time.time()
+    returncode = subprocess.call(cmd, shell=True, env=env)
+    logger.info("[+]finish cmd: {}, return {}".format(cmd, returncode))
+    return step, returncode, time.time() - start
+
+
+def save_summary(rows:dict, path):
+    fields = ['step', 'status', 'accuracy', 'precision', 'recall', 'f1', 'translate_seconds', 'score_seconds']
+    with open(path+".tmp", 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, delimiter='\t')
+        writer.writeheader()
+        for step in sorted(rows):
+            writer.writerow(rows[step])
+    os.replace(path+".tmp", path)
+
+
+def evaluate_checkpoints(model_name, gpu_idx=0, slots=1):
+    '''
+    translate checkpoints with at most `slots` onmt_translate processes at a time,
+    score each checkpoint as soon as its translation finishes,
+    skip checkpoints whose prediction file is already complete,
+    and keep results/summary_<model_name>.tsv updated with per-step metrics and wall time
+    '''
+    src_lines = count_lines(src_path)
+    summary_path = "results/summary_{}.tsv".format(model_name)
+    threads = max(1, (os.cpu_count() or 1) // slots)
+    rows = {}
+
+    def score(step, status, translate_seconds):
+        start = time.time()
+        metrics = print_result("results/pred_test_{0}_step_{1}.txt".format(model_name,step),tgt_path)
+        row = {'step': step, 'status': status, 'translate_seconds': round(translate_seconds, 2),
+               'score_seconds': round(time.time() - start, 2)}
+        row.update(metrics)
+        rows[step] = row
+        save_summary(rows, summary_path)
+
+    pending = []
+    cached = []
+    for step in steps:
+        if not os.path.exists("models/{0}_step_{1}.pt".format(model_name,step)):
+            continue
+        if is_complete("results/pred_test_{0}_step_{1}.txt".format(model_name,step), src_lines):
+            logger.info("[-]skip step {}, prediction exists".format(step))
+            cached.append(step)
+            continue
+        pending.append(step)
+
+    # threads only wait on the onmt_translate processes, scoring runs here meanwhile
+    with ThreadPoolExecutor(max_workers=slots) as executor:
+        # start the translations first so the slots are busy while the cached steps are scored
+        futures = [executor.submit(translate, model_name, step, gpu_idx, threads) for step in pending]
+        for step in cached:
+            score(step, 'cached', 0.0)
+        for future in as_completed(futures):
+            step, returncode, translate_seconds = future.result()
+            if returncode != 0 or not is_complete("results/pred_test_{0}_step_{1}.txt".format(model_name,step), src_lines):
+                logger.error("[!]translate step {} failed, return {}".format(step, returncode))
+                rows[step] = {'step': step, 'status': 'failed', 'translate_seconds': round(translate_seconds, 2)}
+                save_summary(rows, summary_path)
+                continue
+            score(step, 'done', translate_seconds)
+    return rows
 
 
 
@@ -163,9 +217,13 @@ if __name__ == '__main__':
         print("[!]need model name as parameter!")
         exit(-1)
     try:
-        gpu_idx = sys.argv[2]
+        gpu_idx = sys.argv[2] # -1 for cpu
     except:
         pass
+    try:
+        slots = int(sys.argv[3]) # concurrent onmt_translate jobs
+    except:
+        slots = 1
 
     logging.basicConfig(level=logging.DEBUG)
     logger = logging.getLogger()
@@ -175,14 +233,7 @@ if __name__ == '__main__':
     logger.addHandler(fh)
 
     time_start = time.time()
-    for i in range(10000,1000001,10000):
-        cmd = "onmt_translate -model models/{0}_step_{1}.pt -src {5} -output results/pred_test_{2}_step_{3}.txt -min_length 1 -max_length 30 -beam_size 10 -batch_size 16 -n_best 1 -gpu {4}".format(model_name,i,model_name,i,gpu_idx,src_path)
-        if not os.path.exists("models/{0}_step_{1}.pt".format(model_name,i)):
-            continue
-        logger.info("[+]start cmd: {}".format(cmd))
-        os.system(cmd)
-        logger.info("[+]finish cmd: {}".format(cmd))
-        print_result("results/pred_test_{0}_step_{1}.txt".format(model_name,i),tgt_path)
+    evaluate_checkpoints(model_name, gpu_idx, slots)
     time_end = time.time()
     time_cost = int(time_end - time_start)
     time_cost = str(datetime.timedelta(seconds=time_cost))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules are imported from the repository root: metrics, binja.utils.*, ida.utils.*
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,51 @@
+import os
+
+from artifact_store import ArtifactStore, file_sha256, fingerprint
+from ida.utils.layout import OutputTree
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_store_round_trip(tmp_path):
+    store = ArtifactStore(str(tmp_path / "store"))
+    src = str(tmp_path / "a.name_and_addr")
+    write(src, b"main 0x401000\n")
+    key, fp = file_sha256(src), fingerprint("ida64", "script-sha")
+    dst = str(tmp_path / "copy")
+    assert not store.fetch("name_and_addr", key, fp, dst)
+    store.put("name_and_addr", key, fp, src)
+    assert store.fetch("name_and_addr", key, fp, dst)
+    with open(dst, "rb") as f:
+        assert f.read() == b"main 0x401000\n"
+    # other settings are a miss
+    assert not store.fetch("name_and_addr", key, fingerprint("ida64", "other-script-sha"), dst)
+    assert store.cache_info() == "hits=1, misses=2"
+
+
+def test_dump_load(tmp_path):
+    store = ArtifactStore(str(tmp_path / "store"))
+    assert store.load("pseudo_code", "ab" * 32, "fp") is None
+    store.dump("pseudo_code", "ab" * 32, "fp", {"main": ["int", "main"]})
+    assert store.load("pseudo_code", "ab" * 32, "fp") == {"main": ["int", "main"]}
+
+
+def test_fingerprint_is_stable():
+    assert fingerprint("a", 1, None) == fingerprint("a", 1, None)
+    assert fingerprint("a", 1, None) != fingerprint("a", 1, "b")
+
+
+def test_binary_sha256_survives_idb_rewrite(tmp_path):
+    binary = str(tmp_path / "ls")
+    write(binary, b"\x7fELF binary")
+    tree = OutputTree(str(tmp_path / "idb"))
+    idb = tree.partial_path("coreutils", "ls.i64")
+    write(idb, b"idb v1")
+    path = tree.commit("coreutils", "ls.i64", binary=binary, binary_sha256=file_sha256(binary))
+    # ida saves the idb again on every open, the recorded binary hash stays the key
+    write(path, b"idb v2")
+    entry = OutputTree(tree.root).entry_of(path)
+    assert entry["binary_sha256"] == file_sha256(binary)
+    assert OutputTree(tree.root).entry_of(os.path.join(tree.root, "missing.i64")) is None
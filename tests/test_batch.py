@@ -0,0 +1,76 @@
+import os
+import sys
+
+from ida.utils.batch import BatchJob, ida_command, run_batch, split_command
+
+
+MOCK_IDA = [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ida", "utils", "mock_ida.py")]
+
+
+def binary(tmp_path, name):
+    path = str(tmp_path / name)
+    open(path, "w").close()
+    return path
+
+
+def test_split_command_keeps_windows_paths(tmp_path):
+    assert split_command(r"C:\IDA\ida64.exe", posix=False) == [r"C:\IDA\ida64.exe"]
+    assert split_command(r'"C:\Program Files\IDA\ida64.exe" -t', posix=False) == \
+        [r"C:\Program Files\IDA\ida64.exe", "-t"]
+    assert split_command("python mock_ida.py", posix=True) == ["python", "mock_ida.py"]
+    ida = binary(tmp_path, "ida dir")
+    assert split_command(ida) == [ida]
+
+
+def test_ida_command_quotes_script_args():
+    assert ida_command("ida64", "a.i64", script="x.py", script_args=["out dir/a", "b"]) == \
+        ["ida64", "-A", '-Sx.py "out dir/a" b', "a.i64"]
+    assert ida_command("python mock_ida.py", "bin", batch=True, output="o.i64") == \
+        ["python", "mock_ida.py", "-B", "-A", "-oo.i64", "bin"]
+
+
+def test_build_and_script(tmp_path):
+    ls, cat = binary(tmp_path, "ls"), binary(tmp_path, "cat")
+    committed = []
+    jobs = [BatchJob(ls, ida_command(MOCK_IDA, ls, batch=True), lambda: committed.append("ls")),
+            BatchJob(cat, ida_command(MOCK_IDA, cat, batch=True, output=str(tmp_path / "out.i64")))]
+    results = run_batch(jobs, concurrency=2, poll=0.05)
+    assert [results[name].status for name in (ls, cat)] == ["ok", "ok"]
+    assert os.path.exists(ls + ".i64")
+    assert os.path.exists(str(tmp_path / "out.i64")) and not os.path.exists(cat + ".i64")
+    assert committed == ["ls"]
+
+    # the quoted output prefix with a space reaches the script as one argument
+    prefix = str(tmp_path / "out dir" / "ls")
+    os.makedirs(os.path.dirname(prefix))
+    idb = ls + ".i64"
+    results = run_batch([BatchJob(idb, ida_command(MOCK_IDA, idb, script="ext.py", script_args=[prefix]))], poll=0.05)
+    assert results[idb].status == "ok"
+    assert os.path.exists(prefix + ".ext.mock")
+
+
+def test_failures_and_retries(tmp_path):
+    crash, flaky = binary(tmp_path, "crash"), binary(tmp_path, "flaky")
+    committed = []
+    jobs = [BatchJob(crash, ida_command(MOCK_IDA, crash, batch=True), lambda: committed.append("crash")),
+            BatchJob(flaky, ida_command(MOCK_IDA, flaky, batch=True), lambda: committed.append("flaky"))]
+    results = run_batch(jobs, concurrency=2, retries=1, poll=0.05, log_dir=str(tmp_path / "logs"))
+    assert results[crash].status == "failed" and results[crash].returncode == 3 and results[crash].attempts == 2
+    assert results[flaky].status == "ok" and results[flaky].attempts == 2
+    assert committed == ["flaky"]
+    assert os.path.exists(str(tmp_path / "logs" / "crash.log"))
+
+
+def test_timeout_kills(tmp_path):
+    hang, ok = binary(tmp_path, "hang"), binary(tmp_path, "ok")
+    jobs = [BatchJob(hang, ida_command(MOCK_IDA, hang, batch=True)), BatchJob(ok, ida_command(MOCK_IDA, ok, batch=True))]
+    results = run_batch(jobs, concurrency=1, timeout=1, poll=0.05)
+    assert results[hang].status == "timeout" and results[hang].attempts == 1
+    # the slot is free again after the kill
+    assert results[ok].status == "ok"
+
+
+def test_missing_executable(tmp_path):
+    ls = binary(tmp_path, "ls")
+    results = run_batch([BatchJob(ls, ida_command(str(tmp_path / "no-ida"), ls))], retries=3, poll=0.05)
+    assert results[ls] == ("failed", None, 0.0, 1)
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from ida.utils.corpus import DigestSet, dedup_and_split, row_hash, SPLITS
+
+
+@pytest.mark.parametrize("digest_size", [8, 16])
+def test_digest_set_matches_set(digest_size):
+    rng = random.Random(digest_size)
+    values = [rng.getrandbits(8 * digest_size) for _ in range(2000)]
+    # extremes and trailing zero bytes must survive the fixed width dtype
+    values += [0, 1, 2 ** (8 * digest_size) - 1, 1 << (8 * digest_size - 8), 256]
+    seen = DigestSet(digest_size, batch_size=97)
+    reference = set()
+    for h in values + values[:500]:
+        assert (h in seen) == (h in reference)
+        seen.add(h)
+        reference.add(h)
+    assert len(seen) == len(reference)
+    assert all(h in seen for h in reference)
+
+
+def write_corpus(tmp_path, rows):
+    src, tgt, key = tmp_path / "src.txt", tmp_path / "tgt.txt", tmp_path / "key.txt"
+    src.write_text("".join(body + "\n" for _, body, _ in rows))
+    tgt.write_text("".join(name + "\n" for name, _, _ in rows))
+    key.write_text("".join(k + "\n" for _, _, k in rows))
+    return str(src), str(tgt), str(key)
+
+
+def read_splits(prefix):
+    result = {}
+    for split in SPLITS:
+        with open("{}-src-{}.txt".format(prefix, split)) as f_src, open("{}-tgt-{}.txt".format(prefix, split)) as f_tgt:
+            result[split] = list(zip(f_tgt, f_src))
+    return result
+
+
+@pytest.mark.parametrize("digest_size", [8, 16])
+@pytest.mark.parametrize("group_by", ["function", "project"])
+def test_dedup_in_memory_equals_buckets(tmp_path, digest_size, group_by):
+    rng = random.Random(0)
+    rows = [("name {}".format(rng.randrange(50)), "body {}".format(rng.randrange(40)), "p{}\tb".format(rng.randrange(5)))
+            for _ in range(3000)]
+    src, tgt, key = write_corpus(tmp_path, rows)
+    memory = dedup_and_split(src, tgt, str(tmp_path / "memory"), digest_size=digest_size,
+                             key_path=key, group_by=group_by)
+    buckets = dedup_and_split(src, tgt, str(tmp_path / "buckets"), digest_size=digest_size, max_rows_in_memory=300,
+                              key_path=key, group_by=group_by, tmp_dir=str(tmp_path))
+    assert memory == buckets
+    assert sum(memory.values()) == len(set((name, body) for name, body, _ in rows))
+    in_memory, bucketed = read_splits(str(tmp_path / "memory")), read_splits(str(tmp_path / "buckets"))
+    for split in SPLITS:
+        assert sorted(in_memory[split]) == sorted(bucketed[split])
+        assert len(set(in_memory[split])) == len(in_memory[split])
+
+
+def test_row_hash_is_stable():
+    assert row_hash("a", "b") == row_hash("a", "b") != row_hash("a|", "b")
+    assert row_hash("a", "b", 16) < 2 ** 128
+
+
+def split_by_row(prefix):
+    return dict((row, split) for split, rows in read_splits(prefix).items() for row in rows)
+
+
+@pytest.mark.parametrize("group_by", ["project", "binary"])
+def test_adding_a_project_keeps_existing_splits(tmp_path, group_by):
+    rows = [("name {} {}".format(p, i), "body {} {}".format(p, i), "p{}\tb{}".format(p, i % 3))
+            for p in range(30) for i in range(10)]
+    src, tgt, key = write_corpus(tmp_path, rows)
+    dedup_and_split(src, tgt, str(tmp_path / "before"), key_path=key, group_by=group_by)
+    before = split_by_row(str(tmp_path / "before"))
+    assert set(before.values()) == set(SPLITS)
+
+    new_rows = [("name new {}".format(i), "body new {}".format(i), "new\tb{}".format(i % 3)) for i in range(10)]
+    src, tgt, key = write_corpus(tmp_path, rows + new_rows)
+    dedup_and_split(src, tgt, str(tmp_path / "after"), key_path=key, group_by=group_by,
+                    max_rows_in_memory=50, tmp_dir=str(tmp_path))
+    after = split_by_row(str(tmp_path / "after"))
+    assert len(after) == len(rows) + len(new_rows)
+    assert all(after[row] == split for row, split in before.items())
+
+    # every group sits in exactly one split
+    group_splits = {}
+    for (name, body, k) in rows + new_rows:
+        group = k.split("\t")[0] if group_by == "project" else k
+        group_splits.setdefault(group, set()).add(after[(name + "\n", body + "\n")])
+    assert all(len(splits) == 1 for splits in group_splits.values())
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from dataset import iter_records
+
+
+RECORDS = [
+    {"name": "main", "code": "int main() { return 0; }"},
+    {"name": "tricky", "code": "a[1], b] , {c}, \"q\" [", "tags": ["]", ",", "{"]},
+    {"name": "unicode", "code": "数据 ]"},
+    [1, 2, {"x": "]"}],
+    "a string, with ] and {",
+    12345678,
+    -1.5e10,
+    None,
+    True,
+]
+
+
+def write(tmp_path, text):
+    path = tmp_path / "dataset.json"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 4])
+def test_array_matches_json_load(tmp_path, chunk_size, indent):
+    path = write(tmp_path, json.dumps(RECORDS, indent=indent, ensure_ascii=False))
+    with open(path, encoding="utf-8") as f:
+        expected = json.load(f)
+    assert list(iter_records(path, chunk_size)) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 20])
+def test_json_lines(tmp_path, chunk_size):
+    path = write(tmp_path, "\n".join(json.dumps(r, ensure_ascii=False) for r in RECORDS if r is not None) + "\n\n")
+    assert list(iter_records(path, chunk_size)) == [r for r in RECORDS if r is not None]
+
+
+@pytest.mark.parametrize("text", ["[]", "  [ ]\n", "\n"])
+def test_empty(tmp_path, text):
+    assert list(iter_records(write(tmp_path, text), 1)) == []
+
+
+def test_leading_whitespace_longer_than_chunk(tmp_path):
+    path = write(tmp_path, " " * 100 + "\n" * 100 + json.dumps(RECORDS))
+    assert list(iter_records(path, 16)) == RECORDS
+
+
+def test_truncated_array(tmp_path):
+    path = write(tmp_path, json.dumps(RECORDS)[:40])
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_records(path, 8))
@@ -0,0 +1,89 @@
+import os
+
+from ida.utils.layout import (MANIFEST, OutputTree, commit_sidecar, has_sidecar, list_artifacts, shard,
+                             sidecar_partial_path)
+
+
+def test_partial_commit_and_manifest(tmp_path):
+    root = str(tmp_path / "out")
+    tree = OutputTree(root)
+    partial = tree.partial_path("proj", "bin.i64")
+    assert partial.endswith("bin.partial.i64")
+    assert not tree.has("proj", "bin.i64")
+    assert tree.commit("proj", "bin.i64") is None
+
+    with open(partial, "w") as f:
+        f.write("idb")
+    path = tree.commit("proj", "bin.i64", sha256="abc")
+    assert path == os.path.join(root, shard("proj", "bin.i64"), "proj", "bin.i64")
+    assert not os.path.exists(partial)
+    assert tree.has("proj", "bin.i64")
+    assert tree.entry_of(path)["sha256"] == "abc"
+
+    # a fresh reader sees the manifest, a torn last line is ignored
+    with open(os.path.join(root, MANIFEST), "a") as f:
+        f.write('{"path": ')
+    reread = OutputTree(root)
+    assert reread.has("proj", "bin.i64")
+    assert reread.entry_of(path)["size"] == 3
+
+
+def test_artifacts_of_one_binary_share_a_shard():
+    assert shard("proj", "bin.i64") == shard("proj", "bin.pkl")
+    assert shard("proj", "bin.i64") == shard("proj", "bin")
+
+
+def test_list_artifacts(tmp_path):
+    root = str(tmp_path / "out")
+    tree = OutputTree(root)
+    for name in ("a.i64", "b.i64", "a.pkl"):
+        with open(tree.partial_path("proj", name), "w") as f:
+            f.write(name)
+        tree.commit("proj", name)
+    assert sorted(os.path.basename(p) for _, p in list_artifacts(root, "*.i64")) == ["a.i64", "b.i64"]
+
+    # flat {root}/{project}/ layout of older runs
+    flat = tmp_path / "flat"
+    (flat / "proj").mkdir(parents=True)
+    (flat / "proj" / "c.i64").write_text("")
+    assert list_artifacts(str(flat), "*.i64") == [("proj", str(flat / "proj" / "c.i64"))]
+
+
+def test_sidecar_in_sharded_tree(tmp_path):
+    root = str(tmp_path / "idb")
+    tree = OutputTree(root)
+    with open(tree.partial_path("proj", "lib.so.i64"), "w") as f:
+        f.write("idb")
+    idb = tree.commit("proj", "lib.so.i64")
+
+    partial = sidecar_partial_path(tree, "proj", idb, ".name_and_addr")
+    assert os.path.dirname(partial) == os.path.dirname(idb)
+    # a crash mid write leaves only the partial file, which does not count as done
+    with open(partial, "wb") as f:
+        f.write(b"torn")
+    assert not has_sidecar(tree, "proj", idb, ".name_and_addr")
+    assert commit_sidecar(tree, "proj", idb, ".type_c") is None
+
+    path = commit_sidecar(tree, "proj", idb, ".name_and_addr", idb=idb)
+    assert path == os.path.join(os.path.dirname(idb), "lib.so.name_and_addr")
+    assert has_sidecar(OutputTree(root), "proj", idb, ".name_and_addr")
+    assert tree.entry_of(path)["idb"] == idb
+    assert [os.path.basename(p) for _, p in list_artifacts(root, "*.i64")] == ["lib.so.i64"]
+
+
+def test_sidecar_in_flat_tree(tmp_path):
+    (tmp_path / "idb" / "proj").mkdir(parents=True)
+    idb = tmp_path / "idb" / "proj" / "bin.i64"
+    idb.write_text("")
+    root, idb = str(tmp_path / "idb"), str(idb)
+    tree = OutputTree(root)
+
+    partial = sidecar_partial_path(tree, "proj", idb, ".type_c")
+    assert partial == os.path.join(root, "proj", "bin.partial.type_c")
+    open(partial, "w").close()
+    assert not has_sidecar(tree, "proj", idb, ".type_c")
+    assert commit_sidecar(tree, "proj", idb, ".type_c") == os.path.join(root, "proj", "bin.type_c")
+    assert has_sidecar(tree, "proj", idb, ".type_c")
+    # no manifest is created, it would hide the flat idbs
+    assert not os.path.exists(os.path.join(root, MANIFEST))
+    assert list_artifacts(root, "*.i64") == [("proj", idb)]
@@ -0,0 +1,120 @@
+import io
+import itertools
+import os
+import random
+
+import pytest
+from pygments import lex
+
+from binja.utils import lexer as binja_lexer
+from ida.utils import lexer as ida_lexer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEXRAYS_SAMPLES = [
+    '__int64 __fastcall sub_4011A0(__int64 a1, char *a2)\n'
+    '{\n'
+    '  unsigned int v2; // eax\n'
+    '  _QWORD *v3; // rbx\n'
+    '\n'
+    '  v2 = strlen(a2);\n'
+    '  v3 = (_QWORD *)malloc(v2 + 16LL);\n'
+    '  if ( !v3 || a1 == 0x10 )\n'
+    '    return 0xFFFFFFFFLL;\n'
+    '  *v3 = ::g_count++ >> 2;\n'
+    '  printf("error: %s\\n \\"quoted\\"", a2);\n'
+    '  LODWORD(v3[1]) = sub_401000(v3, \'\\n\') -> 1.5e3;\n'
+    '  /* block\n'
+    '     comment */\n'
+    '  return (unsigned __int8)v3[2] <<= 4;\n'
+    '}\n',
+    '#include <stdio.h>\n#define X 1\nint main(int argc, char **argv) { return argc ? argv[0][0] : -1; }',
+    'void f()\r\n{\r\n  wchar_t *s = L"wide"; // trailing\r\n  x->y.z[3] ^= ~0u;\r\n}',
+    '\ufeffint g = 0; char *u = "caf\u00e9"; int \u00e9 = 1;',
+    '',
+]
+
+
+def binja_demo():
+    with open(os.path.join(ROOT, "binja", "utils", "binja_pseudocode_demo.txt"), encoding="utf-8") as f:
+        return f.read()
+
+
+def fuzz_samples(count, seed):
+    rng = random.Random(seed)
+    pieces = [s for s in HEXRAYS_SAMPLES if s] + [binja_demo()]
+    samples = []
+    for _ in range(count):
+        text = rng.choice(pieces)
+        start = rng.randrange(len(text))
+        samples.append(text[start:start + rng.randint(1, 400)])
+    return samples
+
+
+SAMPLES = HEXRAYS_SAMPLES + fuzz_samples(100, 0)
+
+
+@pytest.mark.parametrize("module", [binja_lexer, ida_lexer], ids=["binja", "ida"])
+@pytest.mark.parametrize("lexer_name", ["HexRaysLexer", "BinJaLexer"])
+def test_compiled_lexer_matches_pygments(module, lexer_name):
+    lexer_cls = getattr(module, lexer_name)
+    for text in SAMPLES + [binja_demo()]:
+        expected = list(lex(text, lexer_cls()))
+        assert list(module.CompiledLexer.get(lexer_cls).get_tokens(text)) == expected
+
+
+@pytest.mark.parametrize("module", [binja_lexer, ida_lexer], ids=["binja", "ida"])
+@pytest.mark.parametrize("keep_string,keep_call", [(True, True), (False, False)])
+def test_tokenize_engines_agree(module, keep_string, keep_call):
+    func = lambda x: x.split('_')
+    for text in SAMPLES:
+        assert module.tokenize_raw_code_hexray(text, func, keep_string, keep_call, engine="regex") == \
+            module.tokenize_raw_code_hexray(text, func, keep_string, keep_call, engine="pygments")
+    for text in SAMPLES + [binja_demo()]:
+        assert module.tokenize_raw_code_binja(text, func, keep_string, keep_call, engine="regex") == \
+            module.tokenize_raw_code_binja(text, func, keep_string, keep_call, engine="pygments")
+
+
+def test_unknown_engine():
+    with pytest.raises(binja_lexer.TokenError):
+        binja_lexer.Lexer("int a;", None, binja_lexer.HexRaysLexer, engine="nope")
+
+
+def join_path(module, text, func, max_tokens=None):
+    # the path before streaming: tokenize to a list, " ".join, cut to max_tokens words
+    line = " ".join(module.tokenize_raw_code_hexray(text, func))
+    return line if max_tokens is None else " ".join(line.split()[:max_tokens])
+
+
+def stream_path(module, text, func, max_tokens=None):
+    buf = io.StringIO()
+    module.write_tokens(buf, module.iter_tokens_hexray(text, func, max_tokens=max_tokens))
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("module", [binja_lexer, ida_lexer], ids=["binja", "ida"])
+def test_streaming_equals_join(module):
+    func = lambda x: x.split('_')
+    for text in SAMPLES + [binja_demo()]:
+        assert stream_path(module, text, func) == join_path(module, text, func)
+        for max_tokens in (1, 2, 7, 50, 3000):
+            assert stream_path(module, text, func, max_tokens).split() == join_path(module, text, func, max_tokens).split()
+
+
+def test_truncate_is_lazy():
+    words = ("w{}".format(i) for i in itertools.count())
+    assert list(binja_lexer.truncate_tokens(words, 3)) == ["w0", "w1", "w2"]
+    assert list(binja_lexer.truncate_tokens(["a b", "c d e", "f"], 4)) == ["a b", "c d"]
+
+
+@pytest.mark.parametrize("module", [binja_lexer, ida_lexer], ids=["binja", "ida"])
+def test_merge_tokens_equals_replace(module):
+    rng = random.Random(1)
+    run, merged = ("<", "function", ">", "("), ("<FUNCTION>", "(")
+    words = list(run) + ["x", "<", "("]
+    cases = [[], list(run), ["a"] + list(run), list(run) + ["b"], ["a"] + list(run) * 3 + ["b"]]
+    cases += [[rng.choice(words) for _ in range(rng.randint(0, 30))] for _ in range(500)]
+    for tokens in cases:
+        expected = " ".join(tokens).replace(" < function > ( ", " <FUNCTION> ( ")
+        assert " ".join(module.merge_tokens(iter(tokens), run, merged)) == expected
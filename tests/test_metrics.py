@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+import pytest
+
+from metrics import build_summarization_index, count_lines, get_aprf, get_aprf_batch, group_metrics, is_complete
+
+
+VOCAB = ["get", "set", "file", "name", "read", "write", "buf", "size", "init", "free"]
+SUMMARIZATION = [["get", "read"], ["set", "write"], ["buf", "size"]]
+
+
+def random_pairs(count, seed):
+    rng = random.Random(seed)
+    words = VOCAB + ["oov1", "oov2"]
+    preds, refs = [], []
+    for _ in range(count):
+        preds.append(" ".join(rng.choice(words) for _ in range(rng.randint(0, 5))))
+        refs.append(" ".join(rng.choice(words) for _ in range(rng.randint(0, 5))))
+    return preds, refs
+
+
+@pytest.mark.parametrize("summarization", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_equals_reference(summarization, seed):
+    preds, refs = random_pairs(200, seed)
+    # empty predictions and empty / out of vocab targets
+    preds += ["", "get name", "", "read"]
+    refs += ["get name", "", "", "oov1 oov2"]
+    index = build_summarization_index(SUMMARIZATION) if summarization else None
+    expected = get_aprf(preds, refs, set(VOCAB), index)
+    result, per_example = get_aprf_batch(preds, refs, set(VOCAB), index)
+    assert result.keys() == expected.keys()
+    for key in expected:
+        assert result[key] == pytest.approx(expected[key])
+    assert per_example.shape == (len(preds), 4)
+    # rows without an in-vocab target are skipped by the reference too
+    assert np.isnan(per_example[-3:, 0]).all()
+
+
+def test_batch_all_targets_empty():
+    with pytest.raises(ZeroDivisionError):
+        get_aprf(["get"], [""], set(VOCAB))
+    with pytest.warns(RuntimeWarning):
+        result, per_example = get_aprf_batch(["get"], [""], set(VOCAB))
+    assert np.isnan(result["f1"]) and np.isnan(per_example).all()
+
+
+def test_group_metrics_matches_reference_per_group():
+    preds, refs = random_pairs(100, 7)
+    groups = ["a" if i % 3 else "b" for i in range(len(preds))]
+    _, per_example = get_aprf_batch(preds, refs, set(VOCAB))
+    grouped = group_metrics(per_example, groups)
+    for group, result in grouped.items():
+        rows = [i for i, g in enumerate(groups) if g == group]
+        expected = get_aprf([preds[i] for i in rows], [refs[i] for i in rows], set(VOCAB))
+        for key in expected:
+            assert result[key] == pytest.approx(expected[key])
+
+
+def test_count_lines_trailing_newline(tmp_path):
+    src = tmp_path / "src.txt"
+    pred = tmp_path / "pred.txt"
+    # the src is written with "\n".join, onmt_translate ends every line with a newline
+    src.write_text("\n".join(["a b", "c", "d e f"]))
+    pred.write_text("".join(line + "\n" for line in ["x", "y", "z"]))
+    assert count_lines(src) == count_lines(pred) == 3
+    assert is_complete(str(pred), count_lines(src))
+    pred.write_text("x\ny\n")
+    assert not is_complete(str(pred), count_lines(src))
+    assert not is_complete(str(tmp_path / "missing.txt"), 3)
+
+
+@pytest.mark.parametrize("text", ["", "\n", "a", "a\n", "a\n\n", "\n\na", "a\nb", "a\nb\n"])
+def test_count_lines_matches_print_result(tmp_path, text):
+    path = tmp_path / "f.txt"
+    path.write_text(text)
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines = lines[:-1]
+    assert count_lines(path) == len(lines)
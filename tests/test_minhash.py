@@ -0,0 +1,125 @@
+import random
+import zlib
+
+import numpy as np
+import pytest
+
+from ida.utils.minhash import (MinHasher, SHINGLE_MULTIPLIERS, choose_bands, clusters_of, near_dedup,
+                               signatures_of_files)
+
+
+VOCAB = ['v{}'.format(i) for i in range(300)] + ['<Number>', '(', ')', ';', '=']
+
+
+def random_line(rng, length=300):
+    return ' '.join(rng.choice(VOCAB) for _ in range(length))
+
+
+def near_copy(rng, line, changes=2):
+    tokens = line.split()
+    for _ in range(changes):
+        tokens[rng.randrange(len(tokens))] = '<Number>'
+    return ' '.join(tokens)
+
+
+def reference_signature(hasher, line):
+    # one line at a time in plain python, the numpy version must give the same minimums
+    hashes = [zlib.crc32(token) for token in line.encode('utf-8').split()]
+    k = hasher.k
+    padded = hashes + [0] * (k - 1 if hashes else k)
+    shingles = []
+    for start in range(max(len(hashes) - k + 1, 1)):
+        shingles.append(sum(padded[start + j] * int(SHINGLE_MULTIPLIERS[j]) for j in range(k)) % 2 ** 64 & 0xffffffff)
+    return [min(((int(a) * x + int(b)) % 2 ** 64) >> 32 for x in shingles)
+            for a, b in zip(hasher.a.ravel(), hasher.b.ravel())]
+
+
+def test_signatures_match_reference():
+    rng = random.Random(0)
+    lines = [random_line(rng, rng.randint(1, 12)) for _ in range(30)] + ['', 'a', 'a b c d e']
+    hasher = MinHasher(num_perm=16, k=5)
+    sigs = hasher.signatures(lines)
+    assert sigs.shape == (len(lines), 16) and sigs.dtype == np.uint32
+    for line, sig in zip(lines, sigs):
+        assert sig.tolist() == reference_signature(hasher, line)
+
+
+def test_estimated_jaccard():
+    rng = random.Random(1)
+    hasher = MinHasher(num_perm=256, k=3)
+    base = random_line(rng, 200)
+    copy = near_copy(rng, base, changes=5)
+    other = random_line(rng, 200)
+    sigs = hasher.signatures([base, copy, other])
+
+    def shingles(line):
+        tokens = line.split()
+        return set(tuple(tokens[i:i + 3]) for i in range(len(tokens) - 2))
+
+    jaccard = len(shingles(base) & shingles(copy)) / len(shingles(base) | shingles(copy))
+    assert (sigs[0] == sigs[1]).mean() == pytest.approx(jaccard, abs=0.1)
+    assert (sigs[0] == sigs[2]).mean() < 0.05
+
+
+def test_clusters_near_copies_only():
+    rng = random.Random(2)
+    lines = []
+    for _ in range(200):
+        lines.append(random_line(rng))
+    copies = {}
+    for i in range(0, 200, 10):
+        copies[len(lines)] = i
+        lines.append(near_copy(rng, lines[i]))
+    hasher = MinHasher(num_perm=64)
+    threshold = 0.8
+    roots = clusters_of(hasher.signatures(lines), threshold, *choose_bands(64, threshold))
+    for i, root in enumerate(roots.tolist()):
+        assert root == copies.get(i, i)
+
+
+def test_choose_bands():
+    bands, rows = choose_bands(64, 0.8)
+    assert bands * rows == 64
+    assert abs((1 / bands) ** (1 / rows) - 0.8) < 0.1
+
+
+def test_parallel_signatures_equal_serial(tmp_path):
+    rng = random.Random(3)
+    paths = []
+    for n in (50, 0, 37):
+        path = tmp_path / '{}.txt'.format(n)
+        path.write_text(''.join(random_line(rng, rng.randint(0, 30)) + '\n' for _ in range(n)))
+        paths.append(str(path))
+    hasher = MinHasher()
+    serial = signatures_of_files(paths, hasher, processes=1, chunk_size=8)
+    parallel = signatures_of_files(paths, hasher, processes=2, chunk_size=8)
+    assert serial.shape == (87, hasher.num_perm)
+    assert np.array_equal(serial, parallel)
+
+
+@pytest.mark.parametrize('keep_train', [True, False])
+def test_near_dedup(tmp_path, monkeypatch, keep_train):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(4)
+    train = [random_line(rng) for _ in range(20)]
+    train.append(near_copy(rng, train[0]))
+    valid = [near_copy(rng, train[3]), random_line(rng), train[5]]
+    test = [random_line(rng), near_copy(rng, valid[1]), near_copy(rng, train[7])]
+    for split, lines in (('train', train), ('valid', valid), ('test', test)):
+        (tmp_path / 'x-src-{}.txt'.format(split)).write_text(''.join(line + '\n' for line in lines))
+        (tmp_path / 'x-tgt-{}.txt'.format(split)).write_text(''.join('name {}\n'.format(i) for i in range(len(lines))))
+
+    dropped = near_dedup('x', threshold=0.8, keep_train=keep_train)
+    assert dropped == {'train': 0 if keep_train else 1, 'valid': 2, 'test': 2}
+
+    def read(kind, split):
+        return (tmp_path / 'x-{}-{}.txt'.format(kind, split)).read_text().splitlines()
+
+    assert read('src', 'train') == (train if keep_train else train[:-1])
+    assert read('src', 'valid') == [valid[1]]
+    assert read('tgt', 'valid') == ['name 1']
+    assert read('src', 'test') == [test[0]]
+    assert read('tgt', 'test') == ['name 0']
+    clusters = sorted(line.split() for line in (tmp_path / 'x-near-dup.txt').read_text().splitlines())
+    assert clusters == sorted([['train:0', 'train:20'], ['train:3', 'valid:0'], ['train:5', 'valid:2'],
+                               ['train:7', 'test:2'], ['valid:1', 'test:1']])
@@ -0,0 +1,94 @@
+import inspect
+import os
+
+import pytest
+
+from binja.utils import utils as binja_utils
+from ida.utils import utils as ida_utils
+
+NameSplitter = binja_utils.NameSplitter
+
+
+class FakeSentencePiece:
+    # splits on nothing: one piece per word, enough to exercise the cache
+    def __init__(self, proto=b"model"):
+        self.proto = proto
+        self.calls = 0
+
+    def serialized_model_proto(self):
+        return self.proto
+
+    def EncodeAsPieces(self, text):
+        self.calls += 1
+        return ["▁" + text]
+
+
+VOCAB = frozenset(["read", "file", "write"])
+
+
+def test_hits_misses_and_copies():
+    sp = FakeSentencePiece()
+    splitter = NameSplitter(sp, VOCAB)
+    first = splitter("read_file")
+    first.append("changed")
+    assert splitter("read_file") == ["read", "file"]
+    assert sp.calls == 2
+    assert splitter.cache_info() == {"hits": 1, "misses": 1, "size": 1, "maxsize": 1000000}
+
+
+def test_lru_eviction_at_maxsize():
+    splitter = NameSplitter(FakeSentencePiece(), VOCAB, maxsize=2)
+    splitter("a")
+    splitter("b")
+    splitter("a") # b is now the least recently used
+    splitter("c")
+    assert list(splitter.cache) == ["a", "c"]
+    splitter("b")
+    assert splitter.cache_info() == {"hits": 1, "misses": 4, "size": 2, "maxsize": 2}
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "cache.pkl")
+    splitter = NameSplitter(FakeSentencePiece(), VOCAB, cache_path=path)
+    splitter("read_file")
+    splitter("write_file")
+    splitter.save()
+    assert os.listdir(tmp_path) == ["cache.pkl"]
+
+    sp = FakeSentencePiece()
+    warm = NameSplitter(sp, VOCAB, cache_path=path)
+    assert warm("read_file") == ["read", "file"]
+    assert sp.calls == 0
+    assert warm.cache_info()["hits"] == 1
+
+    # loading keeps the most recent maxsize entries
+    assert list(NameSplitter(FakeSentencePiece(), VOCAB, maxsize=1, cache_path=path).cache) == ["write_file"]
+
+
+@pytest.mark.parametrize("sp, vocab", [
+    (FakeSentencePiece(b"other model"), VOCAB),
+    # same size, other words
+    (FakeSentencePiece(), frozenset(["read", "file", "writes"])),
+])
+def test_fingerprint_mismatch_starts_cold(tmp_path, sp, vocab):
+    path = str(tmp_path / "cache.pkl")
+    splitter = NameSplitter(FakeSentencePiece(), VOCAB, cache_path=path)
+    splitter("read_file")
+    splitter.save()
+    assert len(NameSplitter(sp, vocab, cache_path=path).cache) == 0
+    assert len(NameSplitter(FakeSentencePiece(), frozenset(VOCAB), cache_path=path).cache) == 1
+
+
+@pytest.mark.parametrize("module", [binja_utils, ida_utils])
+def test_copies_reject_a_same_size_lexicon(tmp_path, module):
+    # ida/utils/utils.py is a copy of binja/utils/utils.py, both must fingerprint the words
+    path = str(tmp_path / "cache.pkl")
+    splitter = module.NameSplitter(FakeSentencePiece(), VOCAB, cache_path=path)
+    splitter("read_file")
+    splitter.save()
+    assert len(module.NameSplitter(FakeSentencePiece(), frozenset(["read", "file", "writes"]), cache_path=path).cache) == 0
+    assert len(module.NameSplitter(FakeSentencePiece(), VOCAB, cache_path=path).cache) == 1
+
+
+def test_copies_in_sync():
+    assert inspect.getsource(binja_utils.NameSplitter) == inspect.getsource(ida_utils.NameSplitter)
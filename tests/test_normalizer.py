@@ -0,0 +1,113 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from binja.normalizer import (InstructionTextTokenType as T, NUM_THRESHOLD, Normalizer, SECTION_CLASSES, SectionIndex,
+                              Token, normalize_instruction, normalize_LLIL, normalize_MLIL)
+
+
+SECTIONS = {'.plt': (0x100, 0x1ff), '.text': (0x400, 0x1800), '.rodata': (0x1900, 0x19ff), '.bss': (0x1a00, 0x1aff)}
+SYMBOLS = {0x500: "malloc", 0x1900: "free", 0x3000: "exit"}
+KINDS = [T.TextToken, T.InstructionToken, T.OperandSeparatorToken, T.RegisterToken, T.IntegerToken,
+         T.PossibleAddressToken, T.BeginMemoryOperandToken, T.CodeRelativeAddressToken, T.StringToken]
+
+
+def make_bv(sections=SECTIONS):
+    return SimpleNamespace(sections=dict((name, SimpleNamespace(start=start, end=end))
+                                         for name, (start, end) in sections.items()))
+
+
+def reference(lines, fstart, fend, mlil):
+    # the per-token if chain the Normalizer replaced, extended to the section classes
+    res = []
+    for inst in lines:
+        nlzed = []
+        for token in inst:
+            if token.type in [T.CodeRelativeAddressToken, T.PossibleAddressToken]:
+                if token.value in SYMBOLS:
+                    nlzed.append(SYMBOLS[token.value])
+                elif fstart <= token.value <= fend:
+                    nlzed.append("<LOCADDR>")
+                else:
+                    hits = [SECTION_CLASSES[name] for name, (start, end) in SECTIONS.items() if start <= token.value <= end]
+                    nlzed.append(hits[0] if hits else "<ADDR>")
+            elif token.type == T.IntegerToken:
+                nlzed.append("<NUM>" if token.value > NUM_THRESHOLD else str(token))
+            elif mlil and token.type == T.StringToken:
+                nlzed.append(str(token).replace("\"", " \" ").replace("_", " ").strip())
+            else:
+                nlzed.append(str(token))
+        res.append(nlzed)
+    return res
+
+
+def random_lines(count, seed):
+    rng = random.Random(seed)
+    values = list(SYMBOLS) + [0, 0x600, 0x650, 0x700, 0x1a80, 0x2000, 0x150]
+    return [[Token(kind, '"a_b{}"'.format(i) if kind == T.StringToken else "t{}".format(i),
+                   rng.choice(values + [rng.randint(0, 0x2000)]))
+             for kind in rng.choices(KINDS, k=rng.randint(0, 8))]
+            for i in range(count)]
+
+
+def test_stand_in_enum_values():
+    # must match binaryninja.enums.InstructionTextTokenType
+    assert (T.TextToken, T.IntegerToken, T.PossibleAddressToken, T.CodeRelativeAddressToken, T.StringToken) == \
+        (0, 4, 5, 10, 17)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_normalize_matches_reference(seed):
+    lines = random_lines(2000, seed)
+    normalizer = Normalizer(make_bv(), SYMBOLS)
+    assert list(normalizer.normalize(lines, 0x600, 0x700)) == reference(lines, 0x600, 0x700, mlil=False)
+    assert list(normalizer.normalize(iter(lines), 0x600, 0x700, normalizer.mlil_handlers)) == \
+        reference(lines, 0x600, 0x700, mlil=True)
+
+
+def test_function_views():
+    lines = random_lines(50, 3)
+    func = SimpleNamespace(lowest_address=0x600, highest_address=0x700,
+                           instructions=[(tokens, 0x600 + i) for i, tokens in enumerate(lines)],
+                           llil=SimpleNamespace(instructions=[SimpleNamespace(tokens=tokens) for tokens in lines]),
+                           mlil=SimpleNamespace(instructions=[SimpleNamespace(tokens=tokens) for tokens in lines]))
+    bv = make_bv()
+    assert normalize_instruction(func, bv, SYMBOLS) == reference(lines, 0x600, 0x700, mlil=False)
+    assert normalize_LLIL(func, bv, SYMBOLS) == reference(lines, 0x600, 0x700, mlil=False)
+    assert normalize_MLIL(func, bv, SYMBOLS) == reference(lines, 0x600, 0x700, mlil=True)
+
+
+def test_shared_section_index():
+    index = SectionIndex.from_bv(make_bv())
+    normalizer = Normalizer(None, {}, sections=index)
+    assert normalizer.sections is index
+    assert list(normalizer.normalize([[Token(T.PossibleAddressToken, "x", 0x180), Token(T.IntegerToken, "0", 0)]],
+                                     0, 0)) == [["<PLTADDR>", "0"]]
+
+
+def linear_classify(table, addr):
+    # innermost covering section: latest start, then shortest
+    covering = [(start, -end, SECTION_CLASSES.get(name, "<ADDR>")) for name, start, end in table if start <= addr <= end]
+    return max(covering)[2] if covering else "<ADDR>"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_section_index_nested_and_overlapping(seed):
+    rng = random.Random(seed)
+    names = list(SECTION_CLASSES) + [".eh_frame", ".init"]
+    table = []
+    for _ in range(rng.randint(1, 12)):
+        start = rng.randrange(0, 200)
+        table.append((rng.choice(names), start, start + rng.randrange(0, 80)))
+    index = SectionIndex(table)
+    assert all(end < start for end, start in zip(index.ends, index.starts[1:])) # disjoint and sorted
+    for addr in range(0, 300):
+        assert index.classify(addr) == linear_classify(table, addr)
+
+
+def test_section_index_innermost_wins():
+    index = SectionIndex([(".text", 0x1000, 0x1fff), (".plt", 0x1400, 0x14ff), (".data", 0x1fff, 0x2fff)])
+    assert [index.classify(a) for a in (0xfff, 0x1000, 0x13ff, 0x1400, 0x14ff, 0x1500, 0x1ffe, 0x1fff, 0x2fff, 0x3000)] == \
+        ["<ADDR>", "<INTERADDR>", "<INTERADDR>", "<PLTADDR>", "<PLTADDR>", "<INTERADDR>", "<INTERADDR>",
+         "<DATAADDR>", "<DATAADDR>", "<ADDR>"]
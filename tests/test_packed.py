@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from binja.utils.packed import PackedReader, PackedWriter, json_to_packed, load_methods, save_methods
+
+
+def make_method(start, end, name):
+    return {
+        "start_addr": start,
+        "addr": f"{start}_{end}",
+        "name": name,
+        "instructions": [["push", "rbp"], ["mov", "rbp", "rsp"], []],
+        "llils": [["rax", "=", "0"]],
+        "mlils": [],
+        "pseudo_code": ["int", name, "(", ")", "{", "return", "0", ";", "}", "数据"],
+    }
+
+
+METHODS = {m["addr"]: m for m in (make_method(16, 48, "main"), make_method(48, 96, "parse_args"),
+                                  make_method(96, 97, "main"))}
+
+
+@pytest.mark.parametrize("compression", ["zlib", "none"])
+def test_round_trip(tmp_path, compression):
+    path = str(tmp_path / "a.packed")
+    save_methods(path, METHODS, compression)
+    with PackedReader(path) as reader:
+        assert len(reader) == 3
+        assert dict(reader.items()) == METHODS
+        assert list(reader.keys()) == list(METHODS)
+    assert load_methods(path) == METHODS
+
+
+def test_compression_shrinks_repetitive_methods(tmp_path):
+    methods = {f"{i}_{i + 1}": make_method(i, i + 1, f"f{i % 3}") for i in range(200)}
+    sizes = {}
+    for compression in ("zlib", "none"):
+        path = str(tmp_path / f"{compression}.packed")
+        save_methods(path, methods, compression)
+        sizes[compression] = (tmp_path / f"{compression}.packed").stat().st_size
+        assert load_methods(path) == methods
+    assert sizes["zlib"] < sizes["none"]
+
+
+def test_empty(tmp_path):
+    path = str(tmp_path / "a.packed")
+    save_methods(path, {})
+    with PackedReader(path) as reader:
+        assert len(reader) == 0
+        assert list(reader.items()) == []
+        assert "0_1" not in reader
+
+
+def test_random_access(tmp_path):
+    path = str(tmp_path / "a.packed")
+    save_methods(path, METHODS)
+    with PackedReader(path) as reader:
+        assert "48_96" in reader
+        assert reader["96_97"] == METHODS["96_97"]
+        assert reader["16_48"] == METHODS["16_48"]
+        with pytest.raises(KeyError):
+            reader["16_96"]
+
+
+def test_failed_write_leaves_no_file(tmp_path):
+    path = tmp_path / "a.packed"
+    with pytest.raises(KeyError):
+        with PackedWriter(str(path)) as writer:
+            writer.write(METHODS["16_48"])
+            writer.write({"addr": "1_2"})
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_truncated_file(tmp_path):
+    path = tmp_path / "a.packed"
+    save_methods(str(path), METHODS)
+    path.write_bytes(path.read_bytes()[:-4])
+    with pytest.raises(ValueError):
+        PackedReader(str(path))
+
+
+def test_json_to_packed(tmp_path):
+    json_path = tmp_path / "bin.json"
+    json_path.write_text(json.dumps(METHODS, indent=4, ensure_ascii=False), encoding="utf-8")
+    packed_path = json_to_packed(str(json_path), compression="none")
+    assert packed_path == str(tmp_path / "bin.packed")
+    assert load_methods(packed_path) == load_methods(str(json_path)) == METHODS
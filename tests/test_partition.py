@@ -0,0 +1,57 @@
+import random
+from multiprocessing import Pool
+
+import pytest
+
+from binja.utils.partition import merge, partition, partition_spans
+
+
+def fake_spans(count, seed):
+    # (lowest_address, highest_address) in bv.functions order, sizes spread like real binaries
+    rng = random.Random(seed)
+    spans = []
+    addr = 0x1000
+    for _ in range(count):
+        size = int(rng.paretovariate(1.2) * 16)
+        spans.append((addr, addr + size - 1))
+        addr += size + rng.randrange(0, 32)
+    rng.shuffle(spans)
+    return spans
+
+
+def extract_fake_chunk(args):
+    # stands in for 2_ext_code.extract_chunk, drops every 7th function like a missing get_function_at
+    starts, ends = args
+    return dict((f"{start}_{ends[start]}", start * 2) for start in starts if start % 7)
+
+
+def test_partition_balance():
+    rng = random.Random(0)
+    items = list(range(500))
+    weights = dict((item, rng.randint(1, 1000)) for item in items)
+    chunks = partition(items, weights.get, 8)
+    assert sorted(item for chunk in chunks for item in chunk) == items
+    assert all(chunk == sorted(chunk) for chunk in chunks) # original order kept
+    loads = [sum(weights[item] for item in chunk) for chunk in chunks]
+    # longest processing time first: no chunk exceeds another by more than the heaviest item
+    assert max(loads) - min(loads) <= max(weights.values())
+
+
+def test_partition_few_items():
+    assert partition([], len, 4) == []
+    assert partition(["a"], len, 4) == [["a"]]
+    assert len(partition(["a", "b", "c"], len, 10)) == 3
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_parallel_merge_equals_serial(processes):
+    spans = fake_spans(2000, processes)
+    ends = dict(spans)
+    serial = dict((f"{start}_{end}", start * 2) for start, end in spans if start % 7)
+    order, chunks = partition_spans(spans, processes * 4)
+    assert order == [f"{start}_{end}" for start, end in spans]
+    assert sorted(start for chunk in chunks for start in chunk) == sorted(ends)
+    jobs = [(starts, dict((start, ends[start]) for start in starts)) for starts in chunks]
+    with Pool(processes) as pool:
+        merged = merge(order, pool.imap_unordered(extract_fake_chunk, jobs))
+    assert list(merged.items()) == list(serial.items())
@@ -0,0 +1,95 @@
+import pytest
+
+from ida.utils.pseudo_code import is_complete
+from ida.utils.records import RecordReader, RecordWriter, is_record_file
+
+
+def write_records(path, addrs, close=True):
+    writer = RecordWriter(path, meta={"file_type": "ELF64"})
+    for addr in addrs:
+        writer.write(f"f{addr}", addr, addr + 0x10, f"int f{addr}() {{}}")
+    if close:
+        writer.close()
+    else:
+        writer.f.close()
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "a.rec")
+    write_records(path, [0x30, 0x10, 0x20])
+    assert is_record_file(path)
+    with RecordReader(path) as reader:
+        assert reader.complete
+        assert reader.meta == {"file_type": "ELF64"}
+        assert [r.start_addr for r in reader] == [0x30, 0x10, 0x20]
+        assert reader.addresses() == [0x10, 0x20, 0x30]
+        assert reader[0x20].pseudo_code == "int f32() {}"
+        with pytest.raises(KeyError):
+            reader[0x40]
+
+
+def test_uncompressed(tmp_path):
+    path = str(tmp_path / "a.rec")
+    with RecordWriter(path, compression=None) as writer:
+        writer.write("f", 1, 2, "code")
+    with RecordReader(path) as reader:
+        assert list(reader)[0].pseudo_code == "code"
+
+
+def test_torn_tail_is_readable_and_resumed(tmp_path):
+    # a writer killed mid record: no index, no trailer, half a record at the end
+    path = str(tmp_path / "a.rec")
+    write_records(path, [0x10, 0x20], close=False)
+    with open(path, "ab") as f:
+        f.write(b"\x50\x00\x00\x00\x01abc")
+    with RecordReader(path) as reader:
+        assert not reader.complete
+        assert len(reader) == 2
+        assert reader[0x20].name == "f32"
+
+    writer = RecordWriter(path, meta={"file_type": "other"})
+    assert writer.meta == {"file_type": "ELF64"}
+    assert writer.addresses == {0x10, 0x20}
+    writer.write("f48", 0x30, 0x40, "code")
+    writer.close()
+    with RecordReader(path) as reader:
+        assert reader.complete
+        assert reader.addresses() == [0x10, 0x20, 0x30]
+        assert [r.name for r in reader] == ["f16", "f32", "f48"]
+
+
+def test_resume_closed_file(tmp_path):
+    path = str(tmp_path / "a.rec")
+    write_records(path, [0x10, 0x20])
+    writer = RecordWriter(path)
+    assert writer.addresses == {0x10, 0x20}
+    writer.close()
+    with RecordReader(path) as reader:
+        assert reader.complete
+        assert len(reader) == 2
+
+
+def test_no_resume_starts_over(tmp_path):
+    path = str(tmp_path / "a.rec")
+    write_records(path, [0x10])
+    RecordWriter(path, meta={"file_type": "x"}, resume=False).close()
+    with RecordReader(path) as reader:
+        assert reader.meta == {"file_type": "x"}
+        assert len(reader) == 0
+
+
+def test_exception_in_with_leaves_file_resumable(tmp_path):
+    path = str(tmp_path / "a.rec")
+    with pytest.raises(RuntimeError):
+        with RecordWriter(path, meta={"file_type": "C"}) as writer:
+            writer.write("f16", 0x10, 0x20, "code")
+            raise RuntimeError("decompiler crashed")
+    assert not is_complete(path)
+    with RecordReader(path) as reader:
+        assert not reader.complete
+        assert reader.addresses() == [0x10]
+
+    with RecordWriter(path) as writer:
+        assert writer.addresses == {0x10}
+        writer.write("f32", 0x20, 0x30, "code")
+    assert is_complete(path)
@@ -0,0 +1,48 @@
+import sqlite3
+import time
+from multiprocessing import Pool
+
+from binja.utils.render_cache import RenderCache
+
+
+def render_worker(args):
+    # one extraction job: a get and a slow render before every put, like PseudoCRenderer.render
+    path, binary, count = args
+    cache = RenderCache(path, "v1", timeout=2)
+    try:
+        for start in range(count):
+            if cache.get(binary, start) is None:
+                time.sleep(0.01)
+                cache.put(binary, start, f"{binary} {start}")
+    except sqlite3.OperationalError as e:
+        return str(e)
+    finally:
+        cache.close()
+    return None
+
+
+def test_get_put_and_versions(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = RenderCache(path, "v1")
+    assert cache.get("bin", 1) is None
+    cache.put("bin", 1, "int f() {}")
+    assert cache.get("bin", 1) == "int f() {}"
+    cache.close()
+    assert RenderCache(path, "v2").get("bin", 1) is None
+    reopened = RenderCache(path, "v1")
+    assert reopened.get("bin", 1) == "int f() {}"
+    assert reopened.cache_info() == "hits=1, misses=0"
+    assert reopened.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    reopened.close()
+
+
+def test_concurrent_writers(tmp_path):
+    # the old cache held one write transaction for 1000 puts, the other jobs failed with "database is locked"
+    path = str(tmp_path / "cache.sqlite")
+    jobs = [(path, f"bin{i}", 150) for i in range(4)]
+    with Pool(4) as pool:
+        assert pool.map(render_worker, jobs) == [None] * 4
+    cache = RenderCache(path, "v1")
+    assert cache.conn.execute("SELECT COUNT(*) FROM pseudo_c").fetchone()[0] == 600
+    assert cache.get("bin3", 149) == "bin3 149"
+    cache.close()
@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import pytest
+
+from binja.utils.scheduler import DONE, FAILED, PENDING, SKIPPED, Ledger, run_jobs
+
+
+def job_func(job):
+    # job names say what to do, the marker file counts the attempts
+    with open(job + ".attempts", "a") as f:
+        f.write("x")
+    name = os.path.basename(job)
+    if name.startswith("skip"):
+        return SKIPPED
+    if name.startswith("empty"):
+        return "nothing to extract"
+    if name.startswith("fail"):
+        raise ValueError("broken " + name)
+    if name.startswith("flaky") and os.path.getsize(job + ".attempts") == 1:
+        os._exit(3)
+    if name.startswith("hang"):
+        # a pool like 2_ext_code.extract_parallel, its workers must die with the job
+        with Pool(2) as pool:
+            pool.map_async(_sleep_worker, [job + ".worker0", job + ".worker1"])
+            time.sleep(60)
+
+
+def _sleep_worker(path):
+    with open(path, "w") as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
+
+
+def alive(pid):
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def run(tmp_path, names, **kwargs):
+    jobs = dict((str(tmp_path / name), i) for i, name in enumerate(names))
+    return run_jobs(job_func, jobs, str(tmp_path / "ledger.json"), poll=0.05, **kwargs), jobs
+
+
+def state_of(ledger, tmp_path, name):
+    return ledger.jobs[str(tmp_path / name)]["state"]
+
+
+def test_states(tmp_path):
+    ledger, _ = run(tmp_path, ["ok", "skip", "fail", "flaky"], processes=2, retries=1)
+    assert state_of(ledger, tmp_path, "ok") == DONE
+    assert state_of(ledger, tmp_path, "skip") == SKIPPED
+    assert state_of(ledger, tmp_path, "flaky") == DONE
+    assert state_of(ledger, tmp_path, "fail") == FAILED
+    assert "broken fail" in ledger.jobs[str(tmp_path / "fail")]["error"]
+    assert os.path.getsize(str(tmp_path / "fail.attempts")) == 2
+    with open(str(tmp_path / "ledger.json")) as f:
+        assert json.load(f) == ledger.jobs
+
+
+def test_resume_retries_skipped_not_done(tmp_path):
+    run(tmp_path, ["ok", "skip", "fail"], retries=0)
+    ledger, jobs = run(tmp_path, ["ok", "skip", "fail"], retries=0)
+    # done and failed jobs are not run again, skipped ones are
+    assert os.path.getsize(str(tmp_path / "ok.attempts")) == 1
+    assert os.path.getsize(str(tmp_path / "fail.attempts")) == 1
+    assert os.path.getsize(str(tmp_path / "skip.attempts")) == 2
+    reloaded = Ledger(str(tmp_path / "ledger.json"), jobs)
+    assert reloaded.pending() == [str(tmp_path / "skip")]
+    assert Ledger(str(tmp_path / "ledger.json"), jobs, retry_failed=True).jobs[str(tmp_path / "fail")]["state"] == PENDING
+
+
+def test_note_is_done_for_good(tmp_path):
+    ledger, _ = run(tmp_path, ["empty", "ok"])
+    assert state_of(ledger, tmp_path, "empty") == DONE
+    assert ledger.jobs[str(tmp_path / "empty")]["note"] == "nothing to extract"
+    assert ledger.jobs[str(tmp_path / "ok")]["note"] is None
+    ledger, _ = run(tmp_path, ["empty", "ok"])
+    assert state_of(ledger, tmp_path, "empty") == DONE
+    assert os.path.getsize(str(tmp_path / "empty.attempts")) == 1
+
+
+def test_size_change_requeues(tmp_path):
+    _, jobs = run(tmp_path, ["ok"])
+    jobs[str(tmp_path / "ok")] += 1
+    assert Ledger(str(tmp_path / "ledger.json"), jobs).pending() == [str(tmp_path / "ok")]
+
+
+def test_version_change_requeues(tmp_path):
+    ok = str(tmp_path / "ok")
+    _, jobs = run(tmp_path, ["ok"], versions={ok: "sha-a-settings-1"})
+    ledger_path = str(tmp_path / "ledger.json")
+    assert Ledger(ledger_path, jobs, versions={ok: "sha-a-settings-1"}).pending() == []
+    # same size, new content or new settings
+    assert Ledger(ledger_path, jobs, versions={ok: "sha-b-settings-1"}).pending() == [ok]
+    run(tmp_path, ["ok"], versions={ok: "sha-b-settings-1"})
+    assert Ledger(ledger_path, jobs, versions={ok: "sha-b-settings-2"}).pending() == [ok]
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_timeout_kills_the_job_pool(tmp_path):
+    ledger, _ = run(tmp_path, ["hang"], timeout=3, retries=0)
+    assert state_of(ledger, tmp_path, "hang") == FAILED
+    assert ledger.jobs[str(tmp_path / "hang")]["error"] == "timeout after 3s"
+    pids = []
+    for i in range(2):
+        with open(str(tmp_path / "hang.worker{}".format(i))) as f:
+            pids.append(int(f.read()))
+    deadline = time.time() + 5
+    while any(alive(pid) for pid in pids) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not any(alive(pid) for pid in pids)